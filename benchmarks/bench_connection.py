@@ -0,0 +1,133 @@
+"""
+Latency and throughput of the connection layer and controllers measured against the in-process FakeAdapter.
+
+    python -m benchmarks.bench_connection --latency 0.02 --jitter 0.005 --iterations 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+from tests.fake_adapter import FakeAdapter
+
+CONNECTION_MODES = {
+    'serial': {},
+    'pipelined': {'pipelined': True, 'max_in_flight': 8},
+}
+
+
+class BenchmarkResult:
+    def __init__(self, name, timings, operations=1):
+        self.name = name
+        self.timings = timings
+        self.operations = operations
+
+    @property
+    def mean(self):
+        return statistics.mean(self.timings)
+
+    def percentile(self, p):
+        ordered = sorted(self.timings)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    @property
+    def throughput(self):
+        return self.operations * len(self.timings) / sum(self.timings)
+
+    def __str__(self):
+        return f'{self.name:<45} mean {self.mean * 1000:8.1f} ms  p50 {self.percentile(50) * 1000:8.1f} ms  ' \
+               f'p95 {self.percentile(95) * 1000:8.1f} ms  {self.throughput:8.1f} op/s'
+
+
+async def measure(name, fn, iterations, operations=1) -> BenchmarkResult:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return BenchmarkResult(name, timings, operations)
+
+
+async def connected_controller(session, host, discover=True, bulk_read=False, **connection_args):
+    conn = DaikinWSConnection(session, host, timeout=10, **connection_args)
+    controller = AlthermaController(conn, bulk_read=bulk_read)
+    if discover:
+        await controller.discover_units()
+    return conn, controller
+
+
+async def bench_discovery(session, host, iterations, mode, parallel):
+    async def _discover():
+        conn, controller = await connected_controller(session, host, discover=False, **CONNECTION_MODES[mode])
+        await controller.discover_units(parallel=parallel)
+        await conn.close()
+
+    name = f'discover_units {mode}{" parallel" if parallel else ""}'
+    return await measure(name, _discover, iterations)
+
+
+async def bench_current_state(session, host, iterations, mode, bulk_read=False):
+    conn, controller = await connected_controller(session, host, bulk_read=bulk_read, **CONNECTION_MODES[mode])
+    name = f'get_current_state {mode}{" bulk" if bulk_read else ""}'
+    result = await measure(name, controller.get_current_state, iterations)
+    await conn.close()
+    return result
+
+
+async def bench_single_read(session, host, iterations, mode):
+    conn, controller = await connected_controller(session, host, **CONNECTION_MODES[mode])
+    climate = controller.climate_control
+
+    async def _read():
+        await climate.indoor_temperature
+
+    result = await measure(f'single read {mode}', _read, iterations)
+    await conn.close()
+    return result
+
+
+async def bench_writes(session, host, iterations, mode, batch=10):
+    conn, controller = await connected_controller(session, host, **CONNECTION_MODES[mode])
+    climate = controller.climate_control
+
+    async def _write():
+        await asyncio.gather(*[climate.set_leaving_water_temperature_offset_heating(i % 5) for i in range(batch)])
+
+    result = await measure(f'{batch} concurrent writes {mode}', _write, iterations, operations=batch)
+    await conn.close()
+    return result
+
+
+async def run(latency, jitter, iterations):
+    async with FakeAdapter(latency=latency, jitter=jitter, seed=1) as adapter:
+        async with ClientSession() as session:
+            host = adapter.host
+            results = []
+            for mode in CONNECTION_MODES:
+                results.append(await bench_discovery(session, host, iterations, mode, parallel=False))
+                results.append(await bench_discovery(session, host, iterations, mode, parallel=True))
+                results.append(await bench_current_state(session, host, iterations, mode))
+                results.append(await bench_current_state(session, host, iterations, mode, bulk_read=True))
+                results.append(await bench_single_read(session, host, iterations, mode))
+                results.append(await bench_writes(session, host, iterations, mode))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.02, help='adapter response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005, help='random extra latency in seconds')
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+    print(f'latency {args.latency * 1000:.1f} ms, jitter {args.jitter * 1000:.1f} ms, '
+          f'{args.iterations} iterations')
+    for result in asyncio.run(run(args.latency, args.jitter, args.iterations)):
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Seconds a value of given query type stays fresh. None keeps it until evicted or invalidated.
+DEFAULT_TTL = {
+    'Sensor': 5,
+    'Operation': 5,
+    'UnitStatus': 5,
+    'Consumption': 60,
+    'UnitIdentifier': None,
+    'UnitInfo': None,
+}
+
+
+class ReadCache:
+    def __init__(self, ttl: dict = None, default_ttl=5, max_entries=256):
+        """
+        Bounded LRU cache of adapter reads. Concurrent reads of the same resource share one request.
+        :param ttl: seconds per query type, overrides DEFAULT_TTL. None never expires, 0 disables caching.
+        :param default_ttl: seconds for query types not listed in ttl
+        :param max_entries: maximum number of cached resources
+        """
+        self._ttl = dict(DEFAULT_TTL)
+        if ttl is not None:
+            self._ttl.update(ttl)
+        self._default_ttl = default_ttl
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, query_type):
+        return self._ttl.get(query_type, self._default_ttl)
+
+    def lookup(self, key):
+        """
+        :return: tuple (found, value) for a fresh entry
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key, query_type, value):
+        ttl = self.ttl(query_type)
+        if ttl == 0:
+            return
+        self._entries[key] = (None if ttl is None else time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Drop a cached resource, or everything when key is None. Reads in flight are not stored.
+        """
+        if key is None:
+            self._entries.clear()
+            self._in_flight.clear()
+        else:
+            self._entries.pop(key, None)
+            self._in_flight.pop(key, None)
+
+    async def get(self, key, query_type, fetch):
+        """
+        Return cached value or call fetch. Concurrent callers for the same key wait for the same fetch.
+        :param key: resource destination
+        :param query_type: resource type used to pick the TTL
+        :param fetch: coroutine function reading the value from the adapter
+        """
+        found, value = self.lookup(key)
+        if found:
+            self._hits += 1
+            return value
+        task = self._in_flight.get(key)
+        if task is None:
+            self._misses += 1
+            task = asyncio.ensure_future(self._fetch(key, query_type, fetch))
+            self._in_flight[key] = task
+        # One cancelled caller must not cancel the read for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, query_type, fetch):
+        task = asyncio.current_task()
+        try:
+            value = await fetch()
+        finally:
+            invalidated = self._in_flight.get(key) is not task
+            if not invalidated:
+                del self._in_flight[key]
+        if not invalidated:
+            self.put(key, query_type, value)
+        else:
+            logger.debug(f'{key} was invalidated while reading, result not cached')
+        return value
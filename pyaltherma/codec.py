@@ -0,0 +1,69 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class JsonCodec:
+    def __init__(self, name, dumps, loads):
+        """
+        :param name: codec name
+        :param dumps: function serializing an object to str
+        :param loads: function parsing str or bytes
+        """
+        self._name = name
+        self._dumps = dumps
+        self._loads = loads
+
+    @property
+    def name(self):
+        return self._name
+
+    def dumps(self, o) -> str:
+        return self._dumps(o)
+
+    def loads(self, s):
+        return self._loads(s)
+
+    def __repr__(self):
+        return f'JsonCodec({self._name})'
+
+
+STDLIB_CODEC = JsonCodec('json', json.dumps, json.loads)
+ORJSON_CODEC = JsonCodec('orjson', lambda o: orjson.dumps(o).decode(), orjson.loads) if orjson is not None else None
+
+_codec = ORJSON_CODEC if ORJSON_CODEC is not None else STDLIB_CODEC
+
+
+def get_codec() -> JsonCodec:
+    return _codec
+
+
+def set_codec(codec):
+    """
+    Select the JSON implementation used for websocket messages.
+    :param codec: JsonCodec, 'json' or 'orjson'
+    """
+    global _codec
+    if isinstance(codec, str):
+        codecs = {'json': STDLIB_CODEC, 'orjson': ORJSON_CODEC}
+        if codec not in codecs:
+            raise ValueError(f'Unknown JSON codec {codec}')
+        if codecs[codec] is None:
+            raise ValueError(f'JSON codec {codec} is not installed')
+        codec = codecs[codec]
+    logger.debug(f'Using {codec.name} for JSON messages')
+    _codec = codec
+
+
+def dumps(o) -> str:
+    return _codec.dumps(o)
+
+
+def loads(s):
+    return _codec.loads(s)
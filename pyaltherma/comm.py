@@ -1,22 +1,100 @@
 import asyncio
-import json
+import random
+import time
 
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession, WSMsgType
 
+from pyaltherma import codec
+from pyaltherma.const import ConnectionState
+from pyaltherma.errors import AlthermaConnectionException
+from pyaltherma.metrics import ConnectionObserver, OPERATION_NAMES
 from pyaltherma.proto import Request
+from pyaltherma.recording import ERROR_CONNECTION, ERROR_TIMEOUT
+from pyaltherma.throttle import CircuitBreaker, TokenBucket
+from pyaltherma.utils import query_object
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Failures after which a request can be retried on a fresh connection
+CONNECTION_ERRORS = (ClientError, ConnectionError, AlthermaConnectionException)
+
+# Seconds to wait for the acknowledgement of a fire-and-forget request when the connection has no timeout
+ACK_TIMEOUT = 10
+# Seconds the background drain of acknowledgements holds the connection before letting queued requests in
+DRAIN_INTERVAL = 0.05
+
+
+def _error_kind(error):
+    return ERROR_TIMEOUT if isinstance(error, asyncio.TimeoutError) else ERROR_CONNECTION
+
+
+class _Unlimited:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
 class DaikinWSConnection:
-    def __init__(self, session: ClientSession, host, timeout=None):
+    def __init__(self, session: ClientSession, host, timeout=None, pipelined=False, max_in_flight=4,
+                 recorder=None, observer: ConnectionObserver = None, keepalive=None, auto_reconnect=False,
+                 backoff_base=0.5, backoff_max=30, retry_deadline=None, rate_limiter: TokenBucket = None,
+                 circuit_breaker: CircuitBreaker = None, request_slots: asyncio.Semaphore = None):
+        """
+        :param session: aiohttp client session used to open the websocket
+        :param host: address of the LAN adapter
+        :param timeout: seconds to wait for a response, None waits forever
+        :param pipelined: send requests without waiting for previous responses. A background reader task
+            routes every response to its caller by the request identifier (rqi)
+        :param max_in_flight: maximum number of unanswered requests in pipelined mode
+        :param recorder: optional SessionRecorder receiving every exchange for later replay
+        :param observer: optional ConnectionObserver, e.g. MetricsCollector, notified about requests,
+            timeouts and reconnects
+        :param keepalive: seconds between websocket pings, None disables them
+        :param auto_reconnect: reconnect in the background as soon as the websocket drops
+        :param backoff_base: seconds before the second reconnect attempt, doubled for each further attempt
+        :param backoff_max: upper bound of the reconnect backoff in seconds
+        :param retry_deadline: seconds within which requests failing due to a lost connection are retried,
+            None fails them immediately
+        :param rate_limiter: optional TokenBucket every request has to take a token from before it is sent,
+            share one between connections to the same adapter to limit their combined load
+        :param circuit_breaker: optional CircuitBreaker failing requests fast with AlthermaCircuitOpenException
+            after repeated timeouts, connection errors or adapter errors (response codes 5xxx)
+        :param request_slots: optional semaphore shared between connections bounding their combined number
+            of unanswered requests
+        """
         self._host = host
         self._session: ClientSession = session
         self._client = None
         self._timeout = timeout
         self._address = f"ws://{self._host}/mca"
         self._lock = asyncio.Lock()
+        self._pipelined = pipelined
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._pending = {}
+        self._acks = {}
+        self._drain_task = None
+        self._reader_task = None
+        self._notification_handlers = []
+        self._recorder = recorder
+        self._observer = observer
+        self._connected_before = False
+        self._keepalive = keepalive
+        self._auto_reconnect = auto_reconnect
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._retry_deadline = retry_deadline
+        self._state = ConnectionState.Disconnected
+        self._state_listeners = []
+        self._monitor_task = None
+        self._reconnect_task = None
+        self._closing = False
+        self._rate_limiter = rate_limiter
+        self._circuit_breaker = circuit_breaker
+        self._request_slots = request_slots if request_slots is not None else _Unlimited()
 
     @property
     def host(self):
@@ -26,20 +104,301 @@ class DaikinWSConnection:
     def ws_address(self):
         return self._address
 
+    @property
+    def pipelined(self):
+        return self._pipelined
+
+    @property
+    def state(self) -> ConnectionState:
+        return self._state
+
+    def add_state_listener(self, listener):
+        """
+        :param listener: called with the new ConnectionState on every change
+        """
+        self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener):
+        if listener in self._state_listeners:
+            self._state_listeners.remove(listener)
+
+    def _set_state(self, state: ConnectionState):
+        if state == self._state:
+            return
+        logger.debug('Connection to %s is %s', self.ws_address, state.value)
+        self._state = state
+        if self._observer is not None:
+            self._observer.on_state_change(state)
+        for listener in list(self._state_listeners):
+            try:
+                listener(state)
+            except Exception as e:
+                logger.error(f'Connection state listener failed: {e}')
+
+    def _backoff(self, attempt):
+        delay = min(self._backoff_max, self._backoff_base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def add_notification_handler(self, handler):
+        """
+        Register a callable receiving every oneM2M request (e.g. notification) the adapter sends over
+        the websocket. In serial mode such messages are only read while a request is in progress, use
+        pipelined mode to receive them as they arrive.
+        """
+        self._notification_handlers.append(handler)
+
+    def remove_notification_handler(self, handler):
+        if handler in self._notification_handlers:
+            self._notification_handlers.remove(handler)
+
     async def connect(self):
-        self._client = await self._session.ws_connect(self.ws_address)
-        logger.debug(f'Connected to {self.ws_address}')
+        self._closing = False
+        if self._state != ConnectionState.Reconnecting:
+            self._set_state(ConnectionState.Connecting)
+        try:
+            self._client = await self._session.ws_connect(self.ws_address)
+        except Exception:
+            if self._state == ConnectionState.Connecting:
+                self._set_state(ConnectionState.Disconnected)
+            raise
+        logger.debug('Connected to %s', self.ws_address)
+        if self._observer is not None:
+            self._observer.on_connect(self.ws_address, self._connected_before)
+        self._connected_before = True
+        if self._pipelined:
+            # Each connection gets its own pending table so a dying reader only fails its own requests
+            self._pending = {}
+            self._reader_task = asyncio.ensure_future(self._read_loop(self._client, self._pending))
+        self._set_state(ConnectionState.Connected)
+        if (self._keepalive is not None or self._auto_reconnect) and self._monitor_task is None:
+            self._monitor_task = asyncio.ensure_future(self._monitor())
 
     async def close(self):
+        self._closing = True
+        for task in [self._monitor_task, self._reconnect_task]:
+            if task is not None:
+                task.cancel()
+        self._monitor_task = None
+        self._reconnect_task = None
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            self._drain_task = None
+        self._fail_acks(AlthermaConnectionException(f'Connection to {self.ws_address} closed'))
         async with self._lock:
-            await self._client.close()
+            if self._client is not None:
+                await self._client.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._set_state(ConnectionState.Closed)
 
-    async def request(self, dest, payload=None, wait_for_response=True, assert_response_fn=None):
-        async with self._lock:
-            result = await self._request(dest, payload, wait_for_response, assert_response_fn)
+    def _connection_lost(self):
+        if self._closing:
+            return
+        if self._auto_reconnect:
+            if self._reconnect_task is None or self._reconnect_task.done():
+                self._reconnect_task = asyncio.ensure_future(self._reconnect())
+        else:
+            self._set_state(ConnectionState.Disconnected)
+
+    async def _reconnect(self):
+        self._set_state(ConnectionState.Reconnecting)
+        attempt = 0
+        while not self._closing:
+            try:
+                async with self._lock:
+                    if self._client is None or self._client.closed:
+                        await self.connect()
+                self._set_state(ConnectionState.Connected)
+                return
+            except (ClientError, OSError, asyncio.TimeoutError) as e:
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning(f'Reconnecting to {self.ws_address} failed: {e}, next attempt in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    async def _monitor(self):
+        interval = self._keepalive if self._keepalive is not None else 1
+        while not self._closing:
+            await asyncio.sleep(interval)
+            client = self._client
+            if client is None or self._state == ConnectionState.Reconnecting:
+                continue
+            if client.closed:
+                self._connection_lost()
+                continue
+            if self._keepalive is not None:
+                try:
+                    await client.ping()
+                except Exception as e:
+                    logger.debug('Keepalive ping to %s failed: %s', self.ws_address, e)
+                    await client.close()
+                    self._connection_lost()
+
+    async def request(self, dest, payload=None, wait_for_response=True, assert_response_fn=None, **request_args):
+        """
+        Send a request to the adapter. With retry_deadline set, requests failing due to a lost connection
+        are sent again on a new connection until the deadline passes.
+        :param wait_for_response: False returns as soon as the request is sent, its response is consumed
+            in the background
+        :param request_args: extra oneM2M request parameters passed to Request, e.g. result_content
+        """
+        result = await self._send_with_retry(dest, payload, wait_for_response, assert_response_fn, **request_args)
+        return result if wait_for_response else None
+
+    async def request_nowait(self, dest, payload=None, **request_args) -> asyncio.Future:
+        """
+        Send a request without waiting for its response.
+        :return: future resolved with the response once it arrives, failing with asyncio.TimeoutError if it
+            does not arrive in time
+        """
+        return await self._send_with_retry(dest, payload, False, None, **request_args)
+
+    async def _send_with_retry(self, dest, payload, wait_for_response, assert_response_fn, **request_args):
+        if self._retry_deadline is None:
+            return await self._send(dest, payload, wait_for_response, assert_response_fn, **request_args)
+        deadline = time.monotonic() + self._retry_deadline
+        attempt = 0
+        while True:
+            try:
+                return await self._send(dest, payload, wait_for_response, assert_response_fn, **request_args)
+            except CONNECTION_ERRORS as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closing:
+                    raise
+                # A stale socket is replaced right away, an unreachable adapter is retried with backoff
+                delay = 0 if attempt == 0 else min(remaining, self._backoff(attempt - 1))
+                attempt += 1
+                logger.debug('Retrying %s in %.2fs after connection error: %s', dest, delay, e)
+                await asyncio.sleep(delay)
+
+    async def _send(self, dest, payload=None, wait_for_response=True, assert_response_fn=None, **request_args):
+        breaker = self._circuit_breaker
+        if breaker is not None:
+            breaker.before_request()
+        queued_at = time.monotonic()
+        try:
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire()
+            if self._pipelined:
+                result = await self._pipelined_request(dest, payload, wait_for_response, queued_at=queued_at,
+                                                       **request_args)
+            else:
+                async with self._lock, self._request_slots:
+                    result = await self._request(dest, payload, wait_for_response, queued_at=queued_at,
+                                                 **request_args)
+        except (asyncio.TimeoutError,) + CONNECTION_ERRORS:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        if not wait_for_response:
+            if breaker is not None:
+                result.add_done_callback(lambda ack: self._acknowledged(breaker, ack))
+            return result
+        if breaker is not None:
+            self._record_response(breaker, result)
+        if callable(assert_response_fn):
+            assert_response_fn(result)
         return result
 
-    async def _request(self, dest, payload=None, wait_for_response=True, assert_response_fn=None):
+    @staticmethod
+    def _record_response(breaker: CircuitBreaker, response):
+        # 4xxx codes blame the request, only 5xxx codes mean the adapter is in trouble
+        rsc = query_object(response, 'm2m:rsp/rsc')
+        if isinstance(rsc, int) and rsc >= 5000:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _acknowledged(self, breaker: CircuitBreaker, ack: asyncio.Future):
+        if ack.cancelled():
+            breaker.release()
+        elif isinstance(ack.exception(), (asyncio.TimeoutError,) + CONNECTION_ERRORS):
+            breaker.record_failure()
+        elif ack.exception() is not None:
+            breaker.release()
+        else:
+            self._record_response(breaker, ack.result())
+
+    def _track_ack(self, pending: dict, pkg: Request, queued_at, sent_at, request_size) -> asyncio.Future:
+        """
+        Register the response of a request nobody waits for so the reader can deliver or drop it by rqi.
+        :return: future resolved with the response
+        """
+        loop = asyncio.get_event_loop()
+        ack = loop.create_future()
+        raw = loop.create_future()
+        pending[pkg.rqi] = raw
+
+        def _expire():
+            if not raw.done():
+                self._timed_out(pkg, sent_at)
+                raw.set_exception(asyncio.TimeoutError())
+
+        timeout = self._timeout if self._timeout is not None else ACK_TIMEOUT
+        handle = loop.call_later(timeout, _expire)
+
+        def _done(f):
+            handle.cancel()
+            if pending.get(pkg.rqi) is f:
+                del pending[pkg.rqi]
+            if f.cancelled() or f.exception() is not None:
+                self._completed(pkg, queued_at, sent_at, request_size,
+                                error=None if f.cancelled() else _error_kind(f.exception()))
+                if not ack.done():
+                    if f.cancelled():
+                        ack.cancel()
+                    else:
+                        ack.set_exception(f.exception())
+                return
+            response, response_size = f.result()
+            self._completed(pkg, queued_at, sent_at, request_size, response, response_size)
+            if not ack.done():
+                ack.set_result(response)
+
+        raw.add_done_callback(_done)
+        # Cancelling the acknowledgement stops tracking the response
+        ack.add_done_callback(lambda f: raw.cancel() if f.cancelled() else None)
+        ack.add_done_callback(self._ack_done)
+        return ack
+
+    @staticmethod
+    def _ack_done(ack: asyncio.Future):
+        # Retrieves the exception so unobserved acknowledgements do not warn on garbage collection
+        if not ack.cancelled() and ack.exception() is not None:
+            logger.debug('Request was not acknowledged: %r', ack.exception())
+
+    def _completed(self, pkg: Request, queued_at, sent_at, request_size, response=None, response_size=None,
+                   error=None):
+        """
+        :param error: ERROR_TIMEOUT or ERROR_CONNECTION if the request failed without response
+        """
+        received_at = time.monotonic() if response is not None or error is not None else None
+        if self._recorder is not None:
+            self._recorder.record(pkg.message, response, sent_at, received_at, error)
+        if self._observer is not None:
+            self._observer.on_request(
+                pkg.message['to'], OPERATION_NAMES.get(pkg.message['op']), sent_at - queued_at,
+                None if response is None else received_at - sent_at, request_size, response_size,
+                None if response is None else query_object(response, 'm2m:rsp/rsc'))
+
+    def _request_failed(self, pkg: Request, queued_at, sent_at, request_size, error):
+        if isinstance(error, asyncio.TimeoutError):
+            self._timed_out(pkg, sent_at)
+        self._completed(pkg, queued_at, sent_at, request_size, error=_error_kind(error))
+
+    def _timed_out(self, pkg: Request, sent_at):
+        if self._observer is not None:
+            self._observer.on_timeout(pkg.message['to'], OPERATION_NAMES.get(pkg.message['op']),
+                                      time.monotonic() - sent_at)
+
+    async def _request(self, dest, payload=None, wait_for_response=True, assert_response_fn=None, queued_at=None,
+                       **request_args):
+        queued_at = queued_at if queued_at is not None else time.monotonic()
 
         if self._client is None:
             await self.connect()
@@ -47,18 +406,180 @@ class DaikinWSConnection:
         if self._client.closed:
             await self.connect()
 
-        pkg: Request = Request(dest, payload)
+        pkg: Request = Request(dest, payload, **request_args)
         data = pkg.serialize()
-        logger.debug(f"[OUT]: {dest} {data}")
-        _ = await self._client.send_str(data)
-        if wait_for_response:
-            response_str = await self._client.receive_str(timeout=self._timeout)
-            logger.debug(f"[IN]: {response_str}")
-            response = json.loads(response_str)
-            if callable(assert_response_fn):
-                assert_response_fn(response)
+        logger.debug("[OUT]: %s %s", dest, data)
+        sent_at = time.monotonic()
+        if not wait_for_response:
+            ack = self._track_ack(self._acks, pkg, queued_at, sent_at, len(data))
+            try:
+                _ = await self._client.send_str(data)
+            except BaseException:
+                ack.cancel()
+                raise
+            # The response is read by whoever uses the socket next, the drain makes sure someone does
+            if self._drain_task is None or self._drain_task.done():
+                self._drain_task = asyncio.ensure_future(self._drain_acks())
+            return ack
 
-        else:
-            response = None
+        try:
+            _ = await self._client.send_str(data)
+            while True:
+                received = await self._receive_response(self._client, self._timeout)
+                if received is None:
+                    continue
+                response, response_size = received
+                rqi = query_object(response, 'm2m:rsp/rqi')
+                if rqi is None or rqi == pkg.rqi:
+                    break
+                logger.debug('Dropping response for unknown request %s', rqi)
+        except (asyncio.TimeoutError,) + CONNECTION_ERRORS as e:
+            self._request_failed(pkg, queued_at, sent_at, len(data), e)
+            raise
+        self._completed(pkg, queued_at, sent_at, len(data), response, response_size)
+        if callable(assert_response_fn):
+            assert_response_fn(response)
+        return response
+
+    async def _receive_response(self, client, timeout):
+        """
+        Read the next message in serial mode. Notifications and acknowledgements of fire-and-forget requests
+        are handled on the way.
+        :return: tuple (response, size) or None if the message was consumed
+        """
+        msg = await client.receive(timeout=timeout)
+        if msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+            await client.close()
+            self._connection_lost()
+            error = AlthermaConnectionException(f'Connection to {self.ws_address} closed')
+            self._fail_acks(error)
+            raise error
+        if msg.type != WSMsgType.TEXT:
+            return None
+        logger.debug("[IN]: %s", msg.data)
+        response = codec.loads(msg.data)
+        if 'm2m:rqp' in response:
+            await self._handle_notification(client, response)
+            return None
+        if query_object(response, 'm2m:rsp/rqi') in self._acks:
+            self._dispatch(self._acks, response, len(msg.data))
+            return None
+        return response, len(msg.data)
+
+    def _fail_acks(self, error):
+        acks, self._acks = self._acks, {}
+        for future in acks.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _drain_acks(self):
+        while len(self._acks) > 0:
+            # The lock is given up after every message and every DRAIN_INTERVAL, asyncio.Lock hands it to queued
+            # requests first. Acknowledgements arriving meanwhile are dispatched by their receive loop, and
+            # unanswered ones expire on their own timer.
+            async with self._lock:
+                client = self._client
+                if len(self._acks) == 0 or client is None or client.closed:
+                    break
+                try:
+                    received = await self._receive_response(client, DRAIN_INTERVAL)
+                except asyncio.TimeoutError:
+                    continue
+                except AlthermaConnectionException:
+                    break
+                except Exception as e:
+                    logger.error(f'Draining responses of {self.ws_address} failed: {e}')
+                    self._fail_acks(AlthermaConnectionException(f'Connection to {self.ws_address} failed'))
+                    break
+            if received is not None:
+                logger.debug('Dropping response for unknown request %s', query_object(received[0], 'm2m:rsp/rqi'))
+        if len(self._acks) > 0:
+            self._fail_acks(AlthermaConnectionException(f'Connection to {self.ws_address} closed'))
+
+    async def _pipelined_request(self, dest, payload=None, wait_for_response=True, assert_response_fn=None,
+                                 queued_at=None, **request_args):
+        queued_at = queued_at if queued_at is not None else time.monotonic()
+        async with self._in_flight, self._request_slots:
+            async with self._lock:
+                if self._client is None or self._client.closed:
+                    await self.connect()
+                client, pending = self._client, self._pending
 
+            pkg: Request = Request(dest, payload, **request_args)
+            while pkg.rqi in pending:
+                pkg = Request(dest, payload, **request_args)
+            data = pkg.serialize()
+            logger.debug("[OUT]: %s %s", dest, data)
+
+            sent_at = time.monotonic()
+            if not wait_for_response:
+                ack = self._track_ack(pending, pkg, queued_at, sent_at, len(data))
+                try:
+                    await client.send_str(data)
+                except BaseException:
+                    ack.cancel()
+                    raise
+                return ack
+
+            future = asyncio.get_event_loop().create_future()
+            pending[pkg.rqi] = future
+            try:
+                await client.send_str(data)
+                response, response_size = await asyncio.wait_for(future, self._timeout)
+            except (asyncio.TimeoutError,) + CONNECTION_ERRORS as e:
+                self._request_failed(pkg, queued_at, sent_at, len(data), e)
+                raise
+            finally:
+                pending.pop(pkg.rqi, None)
+            self._completed(pkg, queued_at, sent_at, len(data), response, response_size)
+
+        if callable(assert_response_fn):
+            assert_response_fn(response)
         return response
+
+    async def _read_loop(self, client, pending):
+        try:
+            async for msg in client:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                logger.debug("[IN]: %s", msg.data)
+                try:
+                    response = codec.loads(msg.data)
+                except ValueError:
+                    logger.warning(f'Dropping malformed message: {msg.data}')
+                    continue
+                if 'm2m:rqp' in response:
+                    await self._handle_notification(client, response)
+                else:
+                    self._dispatch(pending, response, len(msg.data))
+        except Exception as e:
+            logger.error(f'Reader for {self.ws_address} failed: {e}')
+            await client.close()
+        finally:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(AlthermaConnectionException(f'Connection to {self.ws_address} closed'))
+            pending.clear()
+            if client is self._client:
+                self._connection_lost()
+
+    async def _handle_notification(self, client, message):
+        if self._recorder is not None:
+            self._recorder.record_notification(message)
+        for handler in list(self._notification_handlers):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f'Notification handler failed: {e}')
+        rqp = message['m2m:rqp']
+        ack = {'m2m:rsp': {'rsc': 2000, 'rqi': rqp.get('rqi'), 'to': rqp.get('fr'), 'fr': rqp.get('to')}}
+        await client.send_str(codec.dumps(ack))
+
+    @staticmethod
+    def _dispatch(pending, response, response_size):
+        rqi = query_object(response, 'm2m:rsp/rqi')
+        future = pending.pop(rqi, None)
+        if future is None:
+            logger.debug('Dropping response for unknown request %s', rqi)
+        elif not future.done():
+            future.set_result((response, response_size))
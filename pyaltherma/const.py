@@ -1,6 +1,26 @@
 from enum import Enum
 
 VALID_RESPONSE_CODES = (2000, 2001)
+# Resource already exists, e.g. subscription created by a previous session
+RESPONSE_CODE_CONFLICT = 4105
+
+# oneM2M operations
+OPERATION_CREATE = 1
+OPERATION_RETRIEVE = 2
+OPERATION_DELETE = 4
+OPERATION_NOTIFY = 5
+
+# oneM2M resource types
+RESOURCE_TYPE_CONTENT_INSTANCE = 4
+RESOURCE_TYPE_SUBSCRIPTION = 23
+
+# oneM2M notification event: creation of a direct child resource, i.e. new value of a container
+NOTIFICATION_EVENT_CREATE_CHILD = 3
+
+# oneM2M result content: attributes of the target plus its child resources
+RESULT_CONTENT_ATTRIBUTES_AND_CHILD_RESOURCES = 4
+# oneM2M filter usage: conditional retrieval
+FILTER_USAGE_CONDITIONAL_RETRIEVAL = 2
 
 
 class ClimateControlMode(Enum):
@@ -14,3 +34,17 @@ class ClimateControlMode(Enum):
 class ControlConfiguration(Enum):
     WeatherDependent = 1
     Fixed = 2
+
+
+class ConnectionState(Enum):
+    Disconnected = "disconnected"
+    Connecting = "connecting"
+    Connected = "connected"
+    Reconnecting = "reconnecting"
+    Closed = "closed"
+
+
+class CircuitState(Enum):
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half_open"
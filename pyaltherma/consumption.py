@@ -0,0 +1,425 @@
+import datetime
+import logging
+import math
+import typing
+from array import array
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from pyaltherma.profile import ConsumptionType
+
+logger = logging.getLogger(__name__)
+
+# Every period array holds the previous period in its first half and the current one in its second half,
+# e.g. D: 12 two-hour buckets of yesterday followed by 12 of today
+PERIOD_DAY = 'D'
+PERIOD_WEEK = 'W'
+PERIOD_MONTH = 'M'
+
+PART_ALL = 'all'
+PART_PREVIOUS = 'previous'
+PART_CURRENT = 'current'
+
+
+def _to_array(values):
+    """
+    :return: float array of values with missing values as NaN, numpy.ndarray if numpy is installed
+    """
+    values = [math.nan if v is None else v for v in values]
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64)
+    return array('d', values)
+
+
+def _nansum(values):
+    if numpy is not None:
+        return float(numpy.nansum(values))
+    return math.fsum(v for v in values if v == v)
+
+
+class ConsumptionSeries:
+    def __init__(self, source, action, period, values, resolution=None, unit=None):
+        """
+        Consumption of one source/action/period, e.g. Electrical/Heating/D.
+        :param values: raw values as reported by the adapter, None for buckets without data
+        :param resolution: bucket size from the unit profile
+        :param unit: unit of the values, e.g. kWh
+        """
+        self._source = source
+        self._action = action
+        self._period = period
+        self._values = _to_array(values)
+        self._resolution = resolution
+        self._unit = unit
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def action(self):
+        return self._action
+
+    @property
+    def period(self):
+        return self._period
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @property
+    def unit(self):
+        return self._unit
+
+    @property
+    def values(self):
+        """
+        Float array with NaN for missing buckets
+        """
+        return self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def part(self, part=PART_ALL):
+        half = len(self._values) // 2
+        if part == PART_PREVIOUS:
+            return self._values[:half]
+        if part == PART_CURRENT:
+            return self._values[half:]
+        if part == PART_ALL:
+            return self._values
+        raise ValueError(f'Unknown part {part}')
+
+    @property
+    def previous(self):
+        return self.part(PART_PREVIOUS)
+
+    @property
+    def current(self):
+        return self.part(PART_CURRENT)
+
+    def total(self, part=PART_ALL) -> float:
+        return _nansum(self.part(part))
+
+    def reported(self, part=PART_ALL) -> int:
+        """
+        Number of buckets with data
+        """
+        values = self.part(part)
+        if numpy is not None:
+            return int(numpy.count_nonzero(~numpy.isnan(values)))
+        return sum(1 for v in values if v == v)
+
+    def delta(self) -> float:
+        """
+        Current period total minus the previous period total over the buckets reported so far,
+        e.g. today until now against yesterday until the same hour.
+        """
+        previous, current = self.previous, self.current
+        if numpy is not None:
+            reported = ~numpy.isnan(current[:len(previous)])
+            return float(numpy.nansum(current) - numpy.nansum(previous[reported]))
+        return _nansum(current) - _nansum(p for p, c in zip(previous, current) if c == c)
+
+    def to_list(self):
+        return [None if v != v else v for v in self._values]
+
+    def __repr__(self):
+        return f'ConsumptionSeries({self._source}/{self._action}/{self._period}, {len(self)} buckets)'
+
+
+class ConsumptionData:
+    def __init__(self, series: typing.Iterable[ConsumptionSeries] = ()):
+        self._series = {(s.source, s.action, s.period): s for s in series}
+
+    @classmethod
+    def from_payload(cls, payload: dict, profile: typing.Dict[str, ConsumptionType] = None):
+        """
+        :param payload: decoded Consumption resource, {source: {action: {period: [values]}}}
+        :param profile: consumption types of the unit profile providing resolution and unit
+        """
+        profile = profile or {}
+        series = []
+        for source, actions in (payload or {}).items():
+            if not isinstance(actions, dict):
+                continue
+            consumption_type = profile.get(source)
+            for action, periods in actions.items():
+                if not isinstance(periods, dict):
+                    continue
+                action_profile = consumption_type.actions.get(action) if consumption_type is not None else None
+                for period, values in periods.items():
+                    if not isinstance(values, list):
+                        continue
+                    content = action_profile.consumption_contents.get(period) if action_profile is not None else None
+                    series.append(ConsumptionSeries(
+                        source, action, period, values,
+                        resolution=content.resolution if content is not None else None,
+                        unit=consumption_type.units if consumption_type is not None else None))
+        return cls(series)
+
+    def __iter__(self):
+        return iter(self._series.values())
+
+    def __len__(self):
+        return len(self._series)
+
+    def get(self, source, action, period) -> typing.Optional[ConsumptionSeries]:
+        return self._series.get((source, action, period))
+
+    @property
+    def sources(self):
+        return sorted({source for source, _, _ in self._series})
+
+    def actions(self, source):
+        return sorted({action for s, action, _ in self._series if s == source})
+
+    def _select(self, period, source=None):
+        return [s for (src, _, p), s in self._series.items() if p == period and (source is None or src == source)]
+
+    def totals(self, period, part=PART_CURRENT) -> dict:
+        """
+        :return: dict of (source, action) to total of the period part
+        """
+        selected = self._select(period)
+        if numpy is not None and len({len(s) for s in selected}) == 1:
+            # One reduction over all series of the period
+            matrix = numpy.vstack([s.part(part) for s in selected])
+            return {(s.source, s.action): float(t) for s, t in zip(selected, numpy.nansum(matrix, axis=1))}
+        return {(s.source, s.action): s.total(part) for s in selected}
+
+    def breakdown(self, source, period, part=PART_CURRENT) -> dict:
+        """
+        :return: dict of action to total, e.g. how much of today's electricity went to heating
+        """
+        return {action: total for (src, action), total in self.totals(period, part).items() if src == source}
+
+    def total(self, source, period, part=PART_CURRENT) -> float:
+        return math.fsum(self.breakdown(source, period, part).values())
+
+    def deltas(self, period) -> dict:
+        """
+        :return: dict of (source, action) to ConsumptionSeries.delta
+        """
+        return {(s.source, s.action): s.delta() for s in self._select(period)}
+
+    def to_dict(self):
+        result = {}
+        for (source, action, period), s in self._series.items():
+            result.setdefault(source, {}).setdefault(action, {})[period] = s.to_list()
+        return result
+
+
+def _add_months(moment: datetime.datetime, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+def _window_start(period, now: datetime.datetime):
+    """
+    :return: start of the current window of a period, the second half of the adapter array
+    """
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == PERIOD_DAY:
+        return midnight
+    if period == PERIOD_WEEK:
+        return midnight - datetime.timedelta(days=midnight.weekday())
+    if period == PERIOD_MONTH:
+        return midnight.replace(month=1, day=1)
+    raise ValueError(f'Unknown consumption period {period}')
+
+
+def _bucket_bounds(period, window_start: datetime.datetime, slot, resolution):
+    """
+    :param slot: bucket index within the window
+    :return: tuple (start, end) of the bucket
+    """
+    if period == PERIOD_DAY:
+        start = window_start + datetime.timedelta(hours=slot * resolution)
+        return start, start + datetime.timedelta(hours=resolution)
+    if period == PERIOD_WEEK:
+        start = window_start + datetime.timedelta(days=slot * resolution)
+        return start, start + datetime.timedelta(days=resolution)
+    start = _add_months(window_start, slot * resolution)
+    return start, _add_months(start, resolution)
+
+
+def _previous_window(period, window_start: datetime.datetime):
+    if period == PERIOD_DAY:
+        return window_start - datetime.timedelta(days=1)
+    if period == PERIOD_WEEK:
+        return window_start - datetime.timedelta(days=7)
+    return window_start.replace(year=window_start.year - 1)
+
+
+# Buckets per window if the profile does not say
+_WINDOW_UNITS = {PERIOD_DAY: 24, PERIOD_WEEK: 7, PERIOD_MONTH: 12}
+
+
+class ConsumptionRecord:
+    def __init__(self, source, action, period, start, end, value, unit=None):
+        self._source = source
+        self._action = action
+        self._period = period
+        self._start = start
+        self._end = end
+        self._value = value
+        self._unit = unit
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def action(self):
+        return self._action
+
+    @property
+    def period(self):
+        return self._period
+
+    @property
+    def start(self) -> datetime.datetime:
+        return self._start
+
+    @property
+    def end(self) -> datetime.datetime:
+        return self._end
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def unit(self):
+        return self._unit
+
+    @property
+    def key(self):
+        return self._source, self._action, self._period, self._start
+
+    def to_dict(self):
+        return {'source': self._source, 'action': self._action, 'period': self._period,
+                'start': self._start.isoformat(), 'end': self._end.isoformat(), 'value': self._value,
+                'unit': self._unit}
+
+    def __repr__(self):
+        return f'ConsumptionRecord({self._source}/{self._action}/{self._period} {self._start.isoformat()} ' \
+               f'{self._value})'
+
+
+class ConsumptionIngester:
+    def __init__(self, partial=False):
+        """
+        Turns successive consumption reads into records of the buckets that completed or changed since the
+        previous read, so a history can be kept by appending only.
+        The adapter shifts the current window into the previous half when a day, week or year begins. Buckets
+        are dated by the local clock, unless the data shows the adapter has not rolled over yet.
+        :param partial: also emit the bucket in progress every time its value changes
+        """
+        self._partial = partial
+        self._windows = {}
+        self._emitted = {}
+
+    @property
+    def emitted(self) -> dict:
+        """
+        Last emitted value per (source, action, period, start)
+        """
+        return dict(self._emitted)
+
+    def seed(self, records: typing.Iterable[ConsumptionRecord]):
+        """
+        Mark records as already stored, e.g. after loading a persisted history on start up.
+        """
+        for record in records:
+            self._emitted[record.key] = record.value
+
+    @staticmethod
+    def _extends(old, new):
+        """
+        True if new continues old: every bucket reported before is still there with the same value, except
+        the last one which may have been in progress.
+        """
+        reported = [i for i, v in enumerate(old) if v is not None]
+        if len(reported) == 0:
+            return True
+        last = reported[-1]
+        return new[last] is not None and all(old[i] == new[i] for i in reported[:-1])
+
+    @classmethod
+    def _has_rolled(cls, previous_values, values):
+        split = len(values) - len(values) // 2
+        if len(previous_values) != len(values) or all(v is None for v in previous_values[split:]):
+            # Nothing to compare against, trust the clock
+            return True
+        # Until the adapter rolls over it keeps extending the arrays of the previous read. After the rollover
+        # buckets vanish or move, the one in progress is usually finalised in the same read.
+        return not (cls._extends(previous_values[:split], values[:split]) and
+                    cls._extends(previous_values[split:], values[split:]))
+
+    def _window(self, series_key, period, values, resolution, now):
+        window = _window_start(period, now)
+        state = self._windows.get(series_key)
+        # The adapter lags by minutes at most, after the first bucket of the new window the clock wins
+        lagging = state is not None and state[0] < window and now < _bucket_bounds(period, window, 0, resolution)[1]
+        if lagging and not self._has_rolled(state[1], values):
+            logger.debug('Consumption %s has not rolled over yet, keeping window %s', series_key, state[0])
+            window = state[0]
+        self._windows[series_key] = (window, values)
+        return window
+
+    def ingest(self, data: ConsumptionData, now: datetime.datetime = None) -> typing.List[ConsumptionRecord]:
+        """
+        :param data: consumption read from the unit
+        :param now: local time of the read
+        :return: records of new, completed or corrected buckets ordered by start
+        """
+        now = now if now is not None else datetime.datetime.now()
+        records = []
+        for series in data:
+            if series.period not in _WINDOW_UNITS:
+                continue
+            values = series.to_list()
+            half = len(values) // 2
+            if half == 0:
+                continue
+            resolution = series.resolution or max(1, _WINDOW_UNITS[series.period] // half)
+            window = self._window((series.source, series.action, series.period), series.period, values, resolution,
+                                  now)
+            previous_window = _previous_window(series.period, window)
+            for index, value in enumerate(values):
+                if value is None:
+                    continue
+                in_current = index >= len(values) - half
+                slot = index - (len(values) - half) if in_current else index
+                start, end = _bucket_bounds(series.period, window if in_current else previous_window, slot,
+                                            resolution)
+                if end > now and not self._partial:
+                    continue
+                key = (series.source, series.action, series.period, start)
+                if self._emitted.get(key) == value:
+                    continue
+                self._emitted[key] = value
+                records.append(ConsumptionRecord(series.source, series.action, series.period, start, end, value,
+                                                 series.unit))
+        self._prune()
+        records.sort(key=lambda r: (r.start, r.source, r.action, r.period))
+        return records
+
+    def _prune(self):
+        # Buckets before the previous window have left the adapter arrays for good
+        oldest = {key: _previous_window(key[2], window) for key, (window, _) in self._windows.items()}
+        self._emitted = {key: value for key, value in self._emitted.items()
+                         if key[:3] not in oldest or key[3] >= oldest[key[:3]]}
+
+    def forget_before(self, moment: datetime.datetime):
+        """
+        Drop remembered buckets starting before moment, they can no longer appear in a read.
+        """
+        self._emitted = {key: value for key, value in self._emitted.items() if key[3] >= moment}
@@ -1,22 +1,91 @@
-import json
+import asyncio
+import functools
 import logging
+import time
 import typing
 
+from pyaltherma import codec
+from pyaltherma.cache import ReadCache
 from pyaltherma.comm import DaikinWSConnection
-from pyaltherma.const import ClimateControlMode, ControlConfiguration
+from pyaltherma.consumption import ConsumptionData
+from pyaltherma.const import ClimateControlMode, ControlConfiguration, VALID_RESPONSE_CODES, \
+    RESULT_CONTENT_ATTRIBUTES_AND_CHILD_RESOURCES, FILTER_USAGE_CONDITIONAL_RETRIEVAL
 from pyaltherma.errors import AlthermaException
 from pyaltherma.profile import AlthermaUnit
-from pyaltherma.utils import query_object
+from pyaltherma.profile_cache import ProfileCache
+from pyaltherma.state import StateStore
+from pyaltherma.subscription import SubscriptionManager, Notification, NotificationServer
+from pyaltherma.utils import query_object, latest_child_contents, PathQuery
+from pyaltherma.writes import WriteCoalescer
 
 logger = logging.getLogger(__name__)
 
+# Seconds bulk reads are skipped after a bulk request failed
+BULK_READ_BACKOFF = 300
+
+DEVICE_INFO_FIELDS = PathQuery({
+    'serial_number': 'm2m:rsp/pc/m2m:dvi/dlb',
+    'manufacturer': 'm2m:rsp/pc/m2m:dvi/man',
+    'model_name': 'm2m:rsp/pc/m2m:dvi/mod',
+    'duty': 'm2m:rsp/pc/m2m:dvi/dty',
+    'miconID': 'm2m:rsp/pc/m2m:dvi/fwv',
+    'firmware': 'm2m:rsp/pc/m2m:dvi/swv',
+})
+
+
+async def gather_dict(keys, read_fn, semaphore: asyncio.Semaphore = None) -> dict:
+    """
+    Run read_fn for every key concurrently. A failing key is logged and set to None
+    instead of aborting the remaining reads.
+    :param keys: keys to read
+    :param read_fn: coroutine function taking a key
+    :param semaphore: optional semaphore bounding the number of concurrent reads
+    :return: dict of key to result
+    """
+    async def _read(key):
+        if semaphore is None:
+            return await read_fn(key)
+        async with semaphore:
+            return await read_fn(key)
+
+    keys = list(keys)
+    values = await asyncio.gather(*[_read(key) for key in keys], return_exceptions=True)
+    results = {}
+    for key, value in zip(keys, values):
+        if isinstance(value, Exception):
+            logger.warning(f'Failed to read {key}: {value}')
+            value = None
+        results[key] = value
+    return results
+
 
 class AlthermaUnitController:
-    def __init__(self, unit: AlthermaUnit, connection: DaikinWSConnection, function='generic'):
+    def __init__(self, unit: AlthermaUnit, connection: DaikinWSConnection, function='generic',
+                 semaphore: asyncio.Semaphore = None, bulk_read=False, cache: ReadCache = None,
+                 write_debounce=None):
+        """
+        :param unit: unit profile
+        :param connection: websocket connection to the adapter
+        :param function: unit function label, e.g. function/SpaceHeating
+        :param semaphore: optional semaphore bounding concurrent reads
+        :param bulk_read: read whole Sensor/Operation/UnitStatus containers in a single request.
+            Falls back to per-resource reads when the adapter rejects it, and for BULK_READ_BACKOFF seconds
+            when a bulk request fails.
+        :param cache: optional read cache, may be shared between controllers of the same adapter
+        :param write_debounce: seconds within which consecutive writes of an operation are merged into
+            a single write of the last value, None writes every value immediately
+        """
         self._connection = connection
         self._unit = unit
         self._unit.init_unit()
         self._function = function
+        self._semaphore = semaphore
+        self._bulk_read = bulk_read
+        self._bulk_retry_at = 0
+        self._cache = cache
+        self._writes = None
+        if write_debounce is not None:
+            self._writes = WriteCoalescer(self._call_operation, write_debounce, self._known_operation_value)
 
         self._unit_name = None
         self._indoor_settings = None
@@ -36,84 +105,189 @@ class AlthermaUnitController:
         resp_code = query_object(resp_obj, 'm2m:rsp/rsc')
         if resp_code != 2000:
             raise AlthermaException('Failed to refresh device')
-        _con = json.loads(query_object(resp_obj, 'm2m:rsp/pc/m2m:cin/con'))
+        _con = codec.loads(query_object(resp_obj, 'm2m:rsp/pc/m2m:cin/con'))
 
         self._unit.parse(_con)
         logger.debug(f'Unit {self._unit.unit_id}/{self._function} profile refreshed.')
 
-    async def read(self, query_type, prop=None):
+    @property
+    def cache(self) -> typing.Optional[ReadCache]:
+        return self._cache
+
+    def _read_destination(self, query_type, prop=None):
         if prop is not None:
-            destination = f'{self._dest}/{query_type}/{prop}/la'
-        else:
-            destination = f'{self._dest}/{query_type}/la'
+            return f'{self._dest}/{query_type}/{prop}/la'
+        return f'{self._dest}/{query_type}/la'
+
+    async def read(self, query_type, prop=None):
+        destination = self._read_destination(query_type, prop)
+        if self._cache is not None:
+            return await self._cache.get(
+                destination, query_type, lambda: self._read(destination, query_type, prop))
+        return await self._read(destination, query_type, prop)
+
+    async def _read(self, destination, query_type, prop):
         result = await self._connection.request(destination)
         try:
             result_value = query_object(result, 'm2m:rsp/pc/m2m:cin/con')
         except:
             raise AlthermaException(f'Failed to read {query_type} {prop} data.')
+        self.observed(query_type, prop)
         return result_value
 
+    def observed(self, query_type, prop):
+        """
+        A value was read or pushed by the adapter, it replaces the value remembered from the last write.
+        """
+        if self._writes is not None and query_type == 'Operation' and prop is not None:
+            self._writes.forget(prop)
+
+    async def read_container(self, query_type):
+        """
+        Read latest values of all resources in a container (e.g. Sensor) with a single request.
+        :param query_type: container name
+        :return: dict of resource name to value or None if the adapter does not support it
+        """
+        if not self._bulk_read or time.monotonic() < self._bulk_retry_at:
+            return None
+        resp = await self._connection.request(
+            f'{self._dest}/{query_type}',
+            result_content=RESULT_CONTENT_ATTRIBUTES_AND_CHILD_RESOURCES,
+            filter_criteria={'fu': FILTER_USAGE_CONDITIONAL_RETRIEVAL, 'lvl': 2})
+        resp_code = query_object(resp, 'm2m:rsp/rsc')
+        contents = latest_child_contents(query_object(resp, 'm2m:rsp/pc/m2m:cnt', convert_to_none=False))
+        if resp_code not in VALID_RESPONSE_CODES or len(contents) == 0:
+            logger.info(f'Adapter does not support bulk reads (response code {resp_code}), '
+                        f'unit {self._function} falls back to per resource reads.')
+            self._bulk_read = False
+            return None
+        for name, value in contents.items():
+            if self._cache is not None:
+                self._cache.put(self._read_destination(query_type, name), query_type, value)
+            self.observed(query_type, name)
+        return contents
+
+    async def _read_all(self, query_type, keys, read_fn, resource_name=None, convert=None):
+        keys = list(keys)
+        results = {}
+        try:
+            contents = await self.read_container(query_type)
+        except Exception as e:
+            # Retrying right away would add the timeout of the bulk request to every read
+            logger.warning(f'Bulk read of {query_type} failed, reading per resource for {BULK_READ_BACKOFF}s: {e}')
+            self._bulk_retry_at = time.monotonic() + BULK_READ_BACKOFF
+            contents = None
+        if contents is not None:
+            for key in keys:
+                name = key if resource_name is None else resource_name(key)
+                if name in contents:
+                    results[key] = contents[name] if convert is None else convert(contents[name])
+        missing = [key for key in keys if key not in results]
+        if len(missing) > 0:
+            results.update(await gather_dict(missing, read_fn, self._semaphore))
+        return {key: results[key] for key in keys}
+
     async def read_sensor(self, sensor):
         return await self.read(query_type='Sensor', prop=sensor)
 
     async def read_sensors(self):
-        sensors = self._unit.sensor_list
-        results = {}
-        for sensor in sensors:
-            results[sensor] = await self.read_sensor(sensor)
-        return results
+        return await self._read_all('Sensor', self._unit.sensor_list, self.read_sensor)
 
-    async def read_operation(self, operation):
+    @staticmethod
+    def _operation_resource(operation):
         # First letter must be uppercase however profile returns lower case
-        if operation == 'powerful':
-            operation = 'Powerful'
-        return await self.read(query_type='Operation', prop=operation)
+        return 'Powerful' if operation == 'powerful' else operation
+
+    async def read_operation(self, operation):
+        return await self.read(query_type='Operation', prop=self._operation_resource(operation))
 
     async def read_state(self, status):
         resp = await self.read(query_type='UnitStatus', prop=status)
         return bool(resp)
 
     async def read_states(self):
-        results = {}
-        for state in self._unit.unit_states:
-            results[state] = await self.read_state(state)
-        return results
+        return await self._read_all('UnitStatus', self._unit.unit_states, self.read_state, convert=bool)
 
     async def read_consumptions(self):
         if self.unit.consumptions_available:
             consumption_str = await self.read('Consumption')
-            return json.loads(consumption_str)
+            return codec.loads(consumption_str)
         else:
             return {}
 
-    async def read_operations(self):
-        operations = list(self._unit.operations.keys()) \
+    async def read_consumption_data(self) -> ConsumptionData:
+        """
+        Consumption history decoded into numeric arrays, see ConsumptionData
+        """
+        return ConsumptionData.from_payload(await self.read_consumptions(), self._unit.consumptions)
+
+    def _operation_names(self):
+        return list(self._unit.operations.keys()) \
             if isinstance(self._unit.operations, dict) else self._unit.operations
-        results = {}
-        for operation in operations:
-            results[operation] = await self.read_operation(operation)
-        return results
 
-    async def call_operation(self, operation, value=None, validate=True):
+    def resources(self):
+        """
+        Sensors, operations and states listed in the unit profile.
+        :return: list of (query_type, name, destination) tuples
+        """
+        resources = [('Sensor', sensor, f'{self._dest}/Sensor/{sensor}') for sensor in self._unit.sensor_list]
+        resources += [('Operation', operation, f'{self._dest}/Operation/{self._operation_resource(operation)}')
+                      for operation in self._operation_names()]
+        resources += [('UnitStatus', state, f'{self._dest}/UnitStatus/{state}') for state in self._unit.unit_states]
+        return resources
+
+    async def read_operations(self):
+        operations = self._operation_names()
+        return await self._read_all('Operation', operations, self.read_operation, self._operation_resource)
+
+    @property
+    def writes(self) -> typing.Optional[WriteCoalescer]:
+        return self._writes
+
+    def _known_operation_value(self, operation):
+        if self._cache is None:
+            return False, None
+        return self._cache.lookup(self._read_destination('Operation', operation))
+
+    def queue_operation(self, operation, value, validate=True) -> asyncio.Future:
+        """
+        Schedule a write without waiting for it. With write_debounce set, writes of the same operation
+        within the debounce window are merged and writes of the current value are skipped.
+        :return: future resolved with the adapter response, None if the write was skipped
+        """
+        if self._writes is not None:
+            return self._writes.submit(operation, value, validate)
+        return asyncio.ensure_future(self._call_operation(operation, value, validate))
+
+    async def call_operation(self, operation, value=None, validate=True, wait_for_response=True):
+        """
+        :param wait_for_response: False returns as soon as the write is sent or queued, with a future
+            resolved by the acknowledgement of the adapter instead of the response
+        """
+        if self._writes is not None and value is not None:
+            future = self._writes.submit(operation, value, validate)
+            return await future if wait_for_response else future
+        return await self._call_operation(operation, value, validate, wait_for_response)
+
+    def _acknowledged(self, destination, response):
+        if self._cache is not None and query_object(response, 'm2m:rsp/rsc') in VALID_RESPONSE_CODES:
+            self._cache.invalidate(f'{destination}/la')
+
+    def _on_acknowledgement(self, destination, ack: asyncio.Future):
+        if not ack.cancelled() and ack.exception() is None:
+            self._acknowledged(destination, ack.result())
+
+    async def _call_operation(self, operation, value=None, validate=True, wait_for_response=True):
         destination = f'{self._dest}/Operation/{operation}'
         if value is not None:
             key = operation if operation != 'Powerful' else 'powerful'
-            conf = self._unit.operation_config[key]
-
-            if 'heating' in conf and isinstance(conf, dict) and isinstance(conf['heating'], dict):
-                conf = conf['heating']
-                conf['settable'] = True
-
-            if isinstance(conf, list):
-                v = str(value) if key == 'powerful' else value
-                valid = v in conf
+            validator = self._unit.operation_validator(key)
+            if validator is None:
+                valid = False
+            elif validate or not validator.is_range:
+                valid = validator.is_valid(value)
             else:
-                if validate:
-                    if 'settable' not in conf:
-                        conf['settable'] = True
-                    valid = conf['settable'] and conf['minValue'] <= value <= conf['maxValue']
-                else:
-                    valid = True
+                valid = True
             #if validate:
             if not valid:
                 #raise AlthermaException(
@@ -125,19 +299,22 @@ class AlthermaUnitController:
             }
         else:
             payload = None
-        return await self._connection.request(destination, payload=payload)
+        if not wait_for_response:
+            ack = await self._connection.request_nowait(destination, payload=payload)
+            ack.add_done_callback(functools.partial(self._on_acknowledgement, destination))
+            return ack
+        response = await self._connection.request(destination, payload=payload)
+        self._acknowledged(destination, response)
+        return response
 
     async def get_current_state(self):
-        sensors = await self.read_sensors()
-        operations = await self.read_operations()
-        states = await self.read_states()
-        consumptions = await self.read_consumptions()
-        return {
-            'sensors': sensors,
-            'operations': operations,
-            'states': states,
-            'consumption': consumptions
+        readers = {
+            'sensors': self.read_sensors,
+            'operations': self.read_operations,
+            'states': self.read_states,
+            'consumption': self.read_consumptions
         }
+        return await gather_dict(readers.keys(), lambda key: readers[key]())
 
     @property
     def unit(self):
@@ -222,8 +399,8 @@ class AlthermaWaterTankController(AlthermaUnitController):
         current_value = str(await self.read_operation('Powerful'))
         return True if current_value == "1" else False
 
-    async def set_powerful(self, value: bool):
-        await self.call_operation('Powerful', int(value))
+    async def set_powerful(self, value: bool, wait_for_response=True):
+        return await self.call_operation('Powerful', int(value), wait_for_response=wait_for_response)
 
     @property
     async def domestic_hot_water_temperature_heating(self) -> float:
@@ -232,11 +409,11 @@ class AlthermaWaterTankController(AlthermaUnitController):
     async def set_domestic_hot_water_temperature_heating(self, value: float):
         await self.call_operation('DomesticHotWaterTemperatureHeating', value)
 
-    async def turn_on(self):
-        await self.call_operation("Power", "on")
+    async def turn_on(self, wait_for_response=True):
+        return await self.call_operation("Power", "on", wait_for_response=wait_for_response)
 
-    async def turn_off(self):
-        await self.call_operation("Power", "standby")
+    async def turn_off(self, wait_for_response=True):
+        return await self.call_operation("Power", "standby", wait_for_response=wait_for_response)
 
     @property
     async def is_turned_on(self) -> bool:
@@ -296,11 +473,11 @@ class AlthermaClimateControlController(AlthermaUnitController):
     async def leaving_water_temperature_current(self):
         return await self.read_sensor("LeavingWaterTemperatureCurrent")
 
-    async def turn_on(self):
-        await self.call_operation("Power", "on")
+    async def turn_on(self, wait_for_response=True):
+        return await self.call_operation("Power", "on", wait_for_response=wait_for_response)
 
-    async def turn_off(self):
-        await self.call_operation("Power", "standby")
+    async def turn_off(self, wait_for_response=True):
+        return await self.call_operation("Power", "standby", wait_for_response=wait_for_response)
 
     @property
     async def is_turned_on(self) -> bool:
@@ -382,24 +559,81 @@ class AlthermaClimateControlController(AlthermaUnitController):
 
 
 class AlthermaController:
-    def __init__(self, connection: DaikinWSConnection):
+    def __init__(self, connection: DaikinWSConnection, max_concurrency=8, bulk_read=False,
+                 cache: ReadCache = None, write_debounce=None):
+        """
+        :param connection: websocket connection to the adapter
+        :param max_concurrency: maximum number of concurrent reads issued by get_current_state across all units
+        :param bulk_read: let unit controllers read whole containers in one request where the adapter allows
+        :param cache: optional read cache shared by all unit controllers
+        :param write_debounce: seconds within which writes of the same operation are merged, see
+            AlthermaUnitController
+        """
         self._connection = connection
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bulk_read = bulk_read
+        self._cache = cache
+        self._write_debounce = write_debounce
         self._altherma_units = {}
         self._hot_water_tank = None
         self._climate_control = None
         self._base_unit: typing.Optional[AlthermaUnitController] = None
         self._profiles = []
+        self._subscriptions: typing.Optional[SubscriptionManager] = None
+        self._owned_server: typing.Optional[NotificationServer] = None
+        self._revalidation: typing.Optional[asyncio.Future] = None
+        self._last_state = StateStore()
+        self._snapshot_listeners = []
 
     @property
     def ws_connection(self):
         return self._connection
 
     async def get_current_state(self):
-        status = {}
-        for unit in self._altherma_units.values():
-            unit_status = await unit.get_current_state()
-            status[unit.unit_function] = unit_status
-        return status
+        units = {unit.unit_function: unit for unit in self._altherma_units.values()}
+        state = await gather_dict(units.keys(), lambda function: units[function].get_current_state())
+        timestamp = time.time()
+        for listener in list(self._snapshot_listeners):
+            try:
+                listener(state, timestamp)
+            except Exception as e:
+                logger.error(f'Snapshot listener failed: {e}')
+        return state
+
+    def add_snapshot_listener(self, listener):
+        """
+        :param listener: called with (state, timestamp) after every get_current_state, e.g.
+            TimeSeriesStore.record_state
+        """
+        self._snapshot_listeners.append(listener)
+
+    def remove_snapshot_listener(self, listener):
+        if listener in self._snapshot_listeners:
+            self._snapshot_listeners.remove(listener)
+
+    @property
+    def last_state(self) -> StateStore:
+        """
+        Last known values seen by any watch()
+        """
+        return self._last_state
+
+    async def watch(self, interval=10):
+        """
+        Async iterator yielding only values that changed since the previous snapshot of this iterator, so
+        several consumers can watch at once. The first iteration yields every value read.
+        :param interval: seconds between snapshots
+        :return: lists of StateChange
+        """
+        baseline = StateStore()
+        while True:
+            state = await self.get_current_state()
+            timestamp = time.time()
+            self._last_state.apply(state, timestamp)
+            changes = baseline.apply(state, timestamp)
+            if len(changes) > 0:
+                yield changes
+            await asyncio.sleep(interval)
 
     @property
     def hot_water_tank(self) -> AlthermaWaterTankController:
@@ -414,15 +648,8 @@ class AlthermaController:
         Information about adapter
         :return: details
         """
-        info = {}
         o = await self._connection.request('/[0]/MNCSE-node/deviceInfo')
-        info['serial_number'] = query_object(o, 'm2m:rsp/pc/m2m:dvi/dlb')
-        info['manufacturer'] = query_object(o, 'm2m:rsp/pc/m2m:dvi/man')
-        info['model_name'] = query_object(o, 'm2m:rsp/pc/m2m:dvi/mod')
-        info['duty'] = query_object(o, 'm2m:rsp/pc/m2m:dvi/dty')
-        info['miconID'] = query_object(o, 'm2m:rsp/pc/m2m:dvi/fwv')
-        info['firmware'] = query_object(o, 'm2m:rsp/pc/m2m:dvi/swv')
-        return info
+        return DEVICE_INFO_FIELDS(o)
 
     async def firmware(self):
         return await self._connection.request('/[0]/MNCSE-node/firmware')
@@ -434,24 +661,101 @@ class AlthermaController:
             except AlthermaUnitController:
                 logger.error(f'Failed to refresh profile for unit {u}')
 
+    def _create_controller(self, controller_class, unit, label='generic'):
+        return controller_class(unit, self._connection, label, semaphore=self._semaphore,
+                                bulk_read=self._bulk_read, cache=self._cache, write_debounce=self._write_debounce)
+
     async def _guess_unit(self, i, unit, label):
         if label == 'function/SpaceHeating':
             logger.info(f'Discovered unit: Climate Control with id: {i} {label}')
-            unit_controller = AlthermaClimateControlController(unit, self._connection, label)
+            unit_controller = self._create_controller(AlthermaClimateControlController, unit, label)
             self._climate_control = unit_controller
         elif label == 'function/DomesticHotWaterTank' or 'function/DomesticHotWater':
             logger.info(f'Discovered unit: Water Tank Controller with id: {i} {label}')
-            unit_controller = AlthermaWaterTankController(unit, self._connection, label)
+            unit_controller = self._create_controller(AlthermaWaterTankController, unit, label)
             self._hot_water_tank = unit_controller
         elif label == 'function/Adapter':
             logger.info(f'Discovered unit: function adapter: {i} {label}')
-            unit_controller = AlthermaUnitController(unit, self._connection, label)
+            unit_controller = self._create_controller(AlthermaUnitController, unit, label)
         else:
-            unit_controller = AlthermaUnitController(unit, self._connection, label)
+            unit_controller = self._create_controller(AlthermaUnitController, unit, label)
             logger.warning(f'Discovered unrecognized unit with id: {i} {label}')
         return unit_controller
 
-    async def discover_units(self, guess_units=True):
+    async def _add_unit(self, i, profile, label, guess_units=True, unit_name=None):
+        unit = AlthermaUnit(i, profile, label)
+        if guess_units:
+            unit_controller = await self._guess_unit(i, unit, label)
+        else:
+            unit_controller = self._create_controller(AlthermaUnitController, unit)
+        if unit_name is None:
+            unit_name = await unit_controller.unit_name
+            unit_name = unit_name if unit_name is not None else 0
+        else:
+            unit_controller._unit_name = unit_name
+
+        self._profiles.append({
+            'idx': i, 'dest': f"[0]/MNAE/{i}/UnitProfile/la", 'profile': profile, 'label': label,
+            'unit_name': unit_name
+        })
+        self._altherma_units[label] = unit_controller
+        return unit_controller
+
+    def _select_base_unit(self):
+        # Likely to be general unit
+        if 'function/Adapter' in self._altherma_units:
+            self._base_unit = self._altherma_units['function/Adapter']
+        elif 0 in self._altherma_units:
+            self._base_unit = self._altherma_units[0]
+        else:
+            self._base_unit = None
+
+    def _staging_controller(self) -> 'AlthermaController':
+        staging = AlthermaController(self._connection, bulk_read=self._bulk_read, cache=self._cache,
+                                     write_debounce=self._write_debounce)
+        # Rediscovered units keep sharing the concurrency bound of this controller
+        staging._semaphore = self._semaphore
+        return staging
+
+    def _adopt_units(self, other: 'AlthermaController'):
+        self._altherma_units = other._altherma_units
+        self._profiles = other._profiles
+        self._hot_water_tank = other._hot_water_tank
+        self._climate_control = other._climate_control
+        self._base_unit = other._base_unit
+
+    async def discover_units(self, guess_units=True, profile_cache: ProfileCache = None, parallel=False,
+                             max_probes=4):
+        """
+        Find units of the adapter.
+        :param guess_units: create specialised controllers based on unit labels
+        :param profile_cache: build units from profiles cached by a previous run. The cached profiles
+            are revalidated in the background and units are discovered again if the adapter changed.
+        :param parallel: probe unit indices concurrently instead of one after another
+        :param max_probes: maximum number of concurrent probes in parallel mode
+        """
+        if profile_cache is not None:
+            entry = profile_cache.load(self._connection.host)
+            if entry is not None:
+                for p in sorted(entry['profiles'], key=lambda p: p['idx']):
+                    await self._add_unit(p['idx'], p['profile'], p['label'], guess_units, p['unit_name'])
+                self._select_base_unit()
+                logger.debug(f'Loaded {len(self._profiles)} units of {self._connection.host} from cache')
+                self._revalidation = asyncio.ensure_future(
+                    self.revalidate_profiles(profile_cache, entry['firmware'], guess_units, parallel, max_probes))
+                return
+
+        await self._discover(guess_units, parallel, max_probes)
+        if profile_cache is not None:
+            await self._store_profiles(profile_cache)
+
+    async def _discover(self, guess_units, parallel, max_probes):
+        if parallel:
+            await self._discover_units_parallel(guess_units, max_probes)
+        else:
+            await self._discover_units(guess_units)
+
+    async def _discover_units(self, guess_units=True):
         for i in range(0, 10):
             dest = f"[0]/MNAE/{i}/UnitProfile/la"
             try:
@@ -461,34 +765,167 @@ class AlthermaController:
                     logger.debug('No more devices found')
                     break
                 logger.debug(f'Discovered unit {i}')
-                _con = json.loads(query_object(resp_obj, 'm2m:rsp/pc/m2m:cin/con'))
+                _con = codec.loads(query_object(resp_obj, 'm2m:rsp/pc/m2m:cin/con'))
 
                 req = await self._connection.request(f'[0]/MNAE/{i}')
                 label = query_object(req, 'm2m:rsp/pc/m2m:cnt/lbl')
 
-                unit = AlthermaUnit(i, _con, label)
-                if guess_units:
-                    unit_controller = await self._guess_unit(i, unit, label)
-                else:
-                    unit_controller = AlthermaUnitController(unit, self._connection)
-                unit_name = await unit_controller.unit_name
-                unit_name = unit_name if unit_name is not None else 0
-
-                self._profiles.append({
-                    'idx': i, 'dest': dest, 'profile': _con, 'label': label, 'unit_name': unit_name
-                })
-
-                self._altherma_units[label] = unit_controller
+                await self._add_unit(i, _con, label, guess_units)
             except AlthermaException:
                 logger.debug('No more devices found')
                 break
-        # Likely to be general unit
-        if 'function/Adapter' in self._altherma_units:
-            self._base_unit = self._altherma_units['function/Adapter']
-        elif 0 in self._altherma_units:
-            self._base_unit = self._altherma_units[0]
-        else:
-            self._base_unit = None
+        self._select_base_unit()
+
+    async def _probe_unit(self, i, semaphore):
+        async with semaphore:
+            resp_obj = await self._connection.request(f"[0]/MNAE/{i}/UnitProfile/la")
+            if query_object(resp_obj, 'm2m:rsp/rsc') != 2000:
+                return None
+            logger.debug(f'Discovered unit {i}')
+            _con = codec.loads(query_object(resp_obj, 'm2m:rsp/pc/m2m:cin/con'))
+            label_obj, name_obj = await asyncio.gather(
+                self._connection.request(f'[0]/MNAE/{i}'),
+                self._connection.request(f'/[0]/MNAE/{i}/UnitIdentifier/Name/la'))
+            label = query_object(label_obj, 'm2m:rsp/pc/m2m:cnt/lbl')
+            unit_name = query_object(name_obj, 'm2m:rsp/pc/m2m:cin/con')
+            return _con, label, unit_name if unit_name is not None else 0
+
+    async def _discover_units_parallel(self, guess_units=True, max_probes=4):
+        semaphore = asyncio.Semaphore(max_probes)
+        probes = [asyncio.ensure_future(self._probe_unit(i, semaphore)) for i in range(0, 10)]
+        found = []
+        try:
+            # Same result as sequential discovery: units up to the first missing index
+            for probe in probes:
+                try:
+                    result = await probe
+                except AlthermaException:
+                    result = None
+                if result is None:
+                    logger.debug('No more devices found')
+                    break
+                found.append(result)
+        finally:
+            for probe in probes:
+                probe.cancel()
+            await asyncio.gather(*probes, return_exceptions=True)
+
+        for i, (_con, label, unit_name) in enumerate(found):
+            await self._add_unit(i, _con, label, guess_units, unit_name)
+        self._select_base_unit()
+
+    async def _store_profiles(self, profile_cache: ProfileCache):
+        # The cache only speeds up the next start, failing to fill it must not fail discovery
+        try:
+            info = await self.device_info()
+            profile_cache.store(self._connection.host, info['firmware'], self._profiles)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f'Failed to cache profiles of {self._connection.host}: {e}')
+
+    async def _profiles_changed(self, firmware):
+        info = await self.device_info()
+        if info['firmware'] != firmware:
+            logger.info(f'Adapter firmware changed from {firmware} to {info["firmware"]}')
+            return True
+        for p in self._profiles:
+            resp_obj = await self._connection.request(p['dest'])
+            if query_object(resp_obj, 'm2m:rsp/rsc') != 2000:
+                return True
+            if codec.loads(query_object(resp_obj, 'm2m:rsp/pc/m2m:cin/con')) != p['profile']:
+                logger.info(f'Profile of unit {p["idx"]} {p["label"]} changed')
+                return True
+        # A unit added after the cached discovery
+        resp_obj = await self._connection.request(f"[0]/MNAE/{len(self._profiles)}/UnitProfile/la")
+        return query_object(resp_obj, 'm2m:rsp/rsc') == 2000
+
+    async def revalidate_profiles(self, profile_cache: ProfileCache, firmware, guess_units=True, parallel=False,
+                                  max_probes=4) -> bool:
+        """
+        Compare cached profiles with the adapter and discover units again if anything changed.
+        :return: True if units were discovered again
+        """
+        try:
+            changed = await self._profiles_changed(firmware)
+        except Exception as e:
+            logger.warning(f'Failed to revalidate cached profiles of {self._connection.host}: {e}')
+            return False
+        if not changed:
+            return False
+        # Units are discovered aside and swapped in at once, readers keep the cached units meanwhile
+        staging = self._staging_controller()
+        try:
+            await staging._discover(guess_units, parallel, max_probes)
+        except Exception as e:
+            logger.warning(f'Failed to discover units of {self._connection.host} again, keeping cached units: {e}')
+            return False
+        if len(staging.altherma_units) == 0:
+            logger.warning(f'No units discovered on {self._connection.host}, keeping cached units')
+            return False
+        self._adopt_units(staging)
+        await self._store_profiles(profile_cache)
+        return True
+
+    @property
+    def profile_revalidation(self) -> typing.Optional[asyncio.Future]:
+        """
+        Background revalidation started by discover_units when cached profiles were used
+        """
+        return self._revalidation
+
+    async def subscribe(self, notification_uri=None, name='pyaltherma',
+                        notification_server: NotificationServer = None) -> SubscriptionManager:
+        """
+        Subscribe to changes of every resource of discovered units.
+        :param notification_uri: url where the adapter posts notifications, None receives them over the websocket
+        :param name: resource name of the subscriptions
+        :param notification_server: receive notifications over HTTP on this server, it is started if needed
+            and its url is used as notification_uri
+        :return: subscription manager
+        """
+        if self._subscriptions is None:
+            if notification_server is not None:
+                if not notification_server.started:
+                    await notification_server.start()
+                    self._owned_server = notification_server
+                notification_uri = notification_server.url
+            self._subscriptions = SubscriptionManager(self._connection, notification_uri, name)
+            self._subscriptions.add_listener(self._on_notification)
+            if notification_server is not None:
+                notification_server.set_handler(self._subscriptions.handle)
+        for unit in self._altherma_units.values():
+            await self._subscriptions.subscribe(unit)
+        return self._subscriptions
+
+    async def unsubscribe(self):
+        if self._subscriptions is not None:
+            await self._subscriptions.unsubscribe()
+            self._subscriptions = None
+        if self._owned_server is not None:
+            await self._owned_server.stop()
+            self._owned_server = None
+
+    def add_notification_listener(self, callback):
+        if self._subscriptions is None:
+            raise AlthermaException('Not subscribed, call subscribe() first.')
+        self._subscriptions.add_listener(callback)
+
+    def notifications(self):
+        """
+        Async iterator of notifications, e.g. async for n in controller.notifications()
+        """
+        if self._subscriptions is None:
+            raise AlthermaException('Not subscribed, call subscribe() first.')
+        return self._subscriptions.notifications()
+
+    def _on_notification(self, notification: Notification):
+        # Keep the cache fresh so readers see pushed values without a round trip
+        if self._cache is not None:
+            self._cache.put(f'{notification.destination}/la', notification.query_type, notification.value)
+        unit = self._altherma_units.get(notification.unit_function)
+        if unit is not None:
+            unit.observed(notification.query_type, notification.resource)
 
     @property
     def altherma_units(self):
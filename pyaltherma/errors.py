@@ -8,3 +8,11 @@ class AlthermaException(Exception):
 
 class AlthermaResponseException(AlthermaException):
     pass
+
+
+class AlthermaConnectionException(AlthermaException):
+    pass
+
+
+class AlthermaCircuitOpenException(AlthermaException):
+    pass
@@ -0,0 +1,383 @@
+import abc
+import asyncio
+import csv
+import io
+import logging
+import sys
+import time
+import typing
+from collections import OrderedDict
+
+from aiohttp import ClientResponseError, ClientTimeout
+
+from pyaltherma.state import StateChange, StateStore
+
+logger = logging.getLogger(__name__)
+
+FORMAT_LINE_PROTOCOL = 'line'
+FORMAT_CSV = 'csv'
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_AGGREGATE = 'aggregate'
+
+CSV_COLUMNS = ('timestamp', 'measurement', 'host', 'unit', 'class', 'resource', 'field', 'value')
+
+
+class Point:
+    __slots__ = ('_measurement', '_tags', '_fields', '_timestamp')
+
+    def __init__(self, measurement, tags: dict, fields: dict, timestamp=None):
+        """
+        :param measurement: series name, e.g. altherma
+        :param tags: indexed string labels, e.g. host and resource
+        :param fields: values, float, int, bool or str
+        :param timestamp: seconds since the epoch
+        """
+        self._measurement = measurement
+        self._tags = dict(tags)
+        self._fields = dict(fields)
+        self._timestamp = timestamp if timestamp is not None else time.time()
+
+    @property
+    def measurement(self):
+        return self._measurement
+
+    @property
+    def tags(self):
+        return dict(self._tags)
+
+    @property
+    def fields(self):
+        return dict(self._fields)
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def series_key(self):
+        return self._measurement, tuple(sorted(self._tags.items()))
+
+    def to_line_protocol(self) -> str:
+        tags = ''.join(f',{_escape_key(k)}={_escape_key(str(v))}' for k, v in sorted(self._tags.items())
+                       if v is not None and v != '')
+        fields = ','.join(f'{_escape_key(k)}={_field_value(v)}' for k, v in self._fields.items())
+        return f'{_escape_key(self._measurement, measurement=True)}{tags} {fields} {int(self._timestamp * 1e9)}'
+
+    def csv_rows(self):
+        for field, value in self._fields.items():
+            yield [self._timestamp, self._measurement, self._tags.get('host', ''), self._tags.get('unit', ''),
+                   self._tags.get('class', ''), self._tags.get('resource', ''), field, value]
+
+    def __eq__(self, other):
+        return isinstance(other, Point) and (self._measurement, self._tags, self._fields, self._timestamp) == \
+            (other._measurement, other._tags, other._fields, other._timestamp)
+
+    def __repr__(self):
+        return f'Point({self.to_line_protocol()})'
+
+
+def _escape_key(key, measurement=False):
+    key = key.replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+    return key if measurement else key.replace('=', '\\=')
+
+
+def _field_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        # JSON numbers of the adapter switch between 21 and 21.5, a field must keep one type
+        return repr(float(value))
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _is_scalar(value):
+    return isinstance(value, (bool, int, float, str))
+
+
+def _point(measurement, host, unit_function, resource_class, resource, value, timestamp):
+    tags = {'unit': unit_function, 'class': resource_class, 'resource': resource}
+    if host is not None:
+        tags['host'] = host
+    return Point(measurement, tags, {'value': value}, timestamp)
+
+
+def flatten_state(state: dict, timestamp=None, host=None, measurement='altherma') -> typing.List[Point]:
+    """
+    One point per scalar value of a get_current_state snapshot. Missing values and nested structures
+    such as consumption arrays are skipped.
+    """
+    timestamp = timestamp if timestamp is not None else time.time()
+    points = []
+    for unit_function, unit_state in (state or {}).items():
+        for resource_class, values in (unit_state or {}).items():
+            for resource, value in (values or {}).items():
+                if value is not None and _is_scalar(value):
+                    points.append(_point(measurement, host, unit_function, resource_class, resource, value,
+                                         timestamp))
+    return points
+
+
+def flatten_changes(changes: typing.Iterable[StateChange], host=None, measurement='altherma') -> typing.List[Point]:
+    return [_point(measurement, host, c.unit_function, c.resource_class, c.key, c.value, c.timestamp)
+            for c in changes if _is_scalar(c.value)]
+
+
+def format_points(points: typing.Iterable[Point], output_format=FORMAT_LINE_PROTOCOL, header=False) -> str:
+    if output_format == FORMAT_LINE_PROTOCOL:
+        return ''.join(f'{point.to_line_protocol()}\n' for point in points)
+    if output_format == FORMAT_CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if header:
+            writer.writerow(CSV_COLUMNS)
+        for point in points:
+            writer.writerows(point.csv_rows())
+        return buffer.getvalue()
+    raise ValueError(f'Unknown format {output_format}')
+
+
+class Sink(abc.ABC):
+    """
+    Destination of exported batches, subclasses implement write.
+    """
+
+    @abc.abstractmethod
+    async def write(self, points: typing.List[Point]):
+        pass
+
+    def retryable(self, error: Exception) -> bool:
+        """
+        False if writing the same batch again cannot succeed, e.g. the destination rejected it.
+        """
+        return True
+
+    async def close(self):
+        pass
+
+
+class FileSink(Sink):
+    def __init__(self, path, output_format=FORMAT_LINE_PROTOCOL):
+        """
+        Appends batches to a file, one write per batch.
+        """
+        self._path = path
+        self._format = output_format
+        self._file = None
+
+    async def write(self, points):
+        if self._file is None:
+            self._file = open(self._path, 'a')
+            if self._format == FORMAT_CSV and self._file.tell() == 0:
+                self._file.write(format_points([], FORMAT_CSV, header=True))
+        self._file.write(format_points(points, self._format))
+        self._file.flush()
+
+    async def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StreamSink(Sink):
+    def __init__(self, stream=None, output_format=FORMAT_LINE_PROTOCOL):
+        """
+        :param stream: text stream, stdout by default
+        """
+        self._stream = stream
+        self._format = output_format
+
+    async def write(self, points):
+        stream = self._stream if self._stream is not None else sys.stdout
+        stream.write(format_points(points, self._format))
+        stream.flush()
+
+
+class HttpSink(Sink):
+    def __init__(self, session, url, output_format=FORMAT_LINE_PROTOCOL, headers=None, timeout=10):
+        """
+        POSTs every batch, e.g. to an InfluxDB compatible /write endpoint.
+        :param session: aiohttp client session
+        """
+        self._session = session
+        self._url = url
+        self._format = output_format
+        self._headers = headers or {}
+        self._timeout = timeout
+
+    async def write(self, points):
+        content_type = 'text/csv' if self._format == FORMAT_CSV else 'text/plain; charset=utf-8'
+        body = format_points(points, self._format, header=self._format == FORMAT_CSV)
+        async with self._session.post(self._url, data=body.encode(), timeout=ClientTimeout(total=self._timeout),
+                                      headers=dict({'Content-Type': content_type}, **self._headers)) as response:
+            response.raise_for_status()
+
+    def retryable(self, error):
+        if isinstance(error, ClientResponseError):
+            return not 400 <= error.status < 500 or error.status in (408, 429)
+        return True
+
+
+class BatchExporter:
+    def __init__(self, sink: Sink, batch_size=500, flush_interval=10, max_pending=10000, overflow=OVERFLOW_DROP,
+                 max_retries=5):
+        """
+        Buffers points and writes them to a sink in batches, when batch_size points are pending or
+        flush_interval seconds passed. At most max_pending points are buffered while the sink is slow or failing.
+        :param overflow: drop discards the oldest pending points, aggregate keeps only the latest point of
+            every series
+        :param max_retries: failed writes of a batch before it is discarded, None retries forever. Batches the
+            sink rejects as invalid are discarded right away.
+        """
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_AGGREGATE):
+            raise ValueError(f'Unknown overflow policy {overflow}')
+        self._sink = sink
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._overflow = overflow
+        self._max_retries = max_retries
+        self._retries = 0
+        self._pending = []
+        self._task = None
+        self._wakeup = None
+        self._write_lock = asyncio.Lock()
+        self._exported = 0
+        self._dropped = 0
+        self._aggregated = 0
+        self._batches = 0
+        self._failures = 0
+        self._rejected = 0
+        self._listeners = {}
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @property
+    def stats(self) -> dict:
+        return {'exported': self._exported, 'dropped': self._dropped, 'aggregated': self._aggregated,
+                'batches': self._batches, 'failures': self._failures, 'rejected': self._rejected,
+                'pending': len(self._pending)}
+
+    def add(self, points: typing.Iterable[Point]):
+        self._pending.extend(points)
+        if len(self._pending) > self._max_pending:
+            self._shed()
+        if len(self._pending) >= self._batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _shed(self):
+        if self._overflow == OVERFLOW_AGGREGATE:
+            latest = OrderedDict()
+            for point in self._pending:
+                key = point.series_key
+                latest.pop(key, None)
+                latest[key] = point
+            self._aggregated += len(self._pending) - len(latest)
+            self._pending = list(latest.values())
+        excess = len(self._pending) - self._max_pending
+        if excess > 0:
+            # Fresh values are worth more than old ones
+            del self._pending[:excess]
+            self._dropped += excess
+            logger.warning(f'Export backlog full, dropped {excess} points')
+
+    def add_state(self, state: dict, timestamp=None, host=None):
+        self.add(flatten_state(state, timestamp, host))
+
+    def attach(self, controller, host=None, changes_only=False):
+        """
+        Export every snapshot taken by an AlthermaController.
+        :param host: value of the host tag, the adapter address by default
+        :param changes_only: export only values that changed since the previous snapshot
+        """
+        host = host if host is not None else controller.ws_connection.host
+        store = StateStore() if changes_only else None
+
+        def _listener(state, timestamp):
+            if store is not None:
+                self.add(flatten_changes(store.apply(state, timestamp), host))
+            else:
+                self.add_state(state, timestamp, host)
+
+        self._listeners[id(controller)] = _listener
+        controller.add_snapshot_listener(_listener)
+
+    def detach(self, controller):
+        listener = self._listeners.pop(id(controller), None)
+        if listener is not None:
+            controller.remove_snapshot_listener(listener)
+
+    async def flush(self):
+        """
+        Write all pending points now.
+        :return: False if a batch failed or was discarded
+        """
+        written = True
+        async with self._write_lock:
+            while len(self._pending) > 0:
+                batch = self._pending[:self._batch_size]
+                del self._pending[:len(batch)]
+                try:
+                    await self._sink.write(batch)
+                except asyncio.CancelledError:
+                    self._pending[:0] = batch
+                    raise
+                except Exception as e:
+                    self._failures += 1
+                    self._retries += 1
+                    if not self._sink.retryable(e) or \
+                            (self._max_retries is not None and self._retries > self._max_retries):
+                        # A batch that keeps failing must not hold up the points behind it
+                        logger.error(f'Discarding {len(batch)} points after failed export: {e}')
+                        self._rejected += len(batch)
+                        self._retries = 0
+                        written = False
+                        continue
+                    logger.warning(f'Export of {len(batch)} points failed: {e}')
+                    # Retried with the next flush, within the max_pending bound
+                    self._pending[:0] = batch
+                    if len(self._pending) > self._max_pending:
+                        self._shed()
+                    return False
+                self._retries = 0
+                self._exported += len(batch)
+                self._batches += 1
+        return written
+
+    async def _run(self):
+        while True:
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([wakeup], timeout=self._flush_interval)
+            finally:
+                wakeup.cancel()
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def stop(self, flush=True):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        if flush:
+            await self.flush()
+        await self._sink.close()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+import typing
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+
+logger = logging.getLogger(__name__)
+
+
+class FleetResult:
+    def __init__(self, host, value=None, error: Exception = None, elapsed=None):
+        self._host = host
+        self._value = value
+        self._error = error
+        self._elapsed = elapsed
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def error(self) -> typing.Optional[Exception]:
+        return self._error
+
+    @property
+    def ok(self):
+        return self._error is None
+
+    @property
+    def elapsed(self):
+        """
+        Seconds the host took to answer
+        """
+        return self._elapsed
+
+    def __repr__(self):
+        outcome = f'error={self._error!r}' if self._error is not None else f'value={self._value!r}'
+        return f'FleetResult(host={self._host}, {outcome})'
+
+
+class AlthermaFleet:
+    def __init__(self, hosts, session: ClientSession = None, max_concurrency=16, timeout=10,
+                 connection_args: dict = None, controller_args: dict = None):
+        """
+        Manages the connections and controllers of many adapters.
+        :param hosts: addresses of the LAN adapters
+        :param session: aiohttp client session shared by all connections, the fleet opens and closes its own
+            session if None
+        :param max_concurrency: maximum number of unanswered requests across all adapters
+        :param timeout: seconds to wait for a response of an adapter
+        :param connection_args: additional DaikinWSConnection arguments, e.g. pipelined
+        :param controller_args: additional AlthermaController arguments, e.g. bulk_read
+        """
+        self._hosts = list(dict.fromkeys(hosts))
+        self._session = session
+        self._owns_session = session is None
+        self._request_slots = asyncio.Semaphore(max_concurrency)
+        self._timeout = timeout
+        self._connection_args = connection_args or {}
+        self._controller_args = controller_args or {}
+        self._controllers: typing.Dict[str, AlthermaController] = {}
+
+    @property
+    def hosts(self):
+        return list(self._hosts)
+
+    @property
+    def controllers(self) -> typing.Dict[str, AlthermaController]:
+        return dict(self._controllers)
+
+    def __getitem__(self, host) -> AlthermaController:
+        return self._controllers[host]
+
+    def __len__(self):
+        return len(self._hosts)
+
+    async def start(self):
+        if self._session is None:
+            self._session = ClientSession()
+        for host in self._hosts:
+            if host not in self._controllers:
+                self._controllers[host] = self._create_controller(host)
+        return self
+
+    def _create_controller(self, host):
+        connection = DaikinWSConnection(self._session, host, timeout=self._timeout,
+                                        request_slots=self._request_slots, **self._connection_args)
+        return AlthermaController(connection, **self._controller_args)
+
+    def add_host(self, host) -> typing.Optional[AlthermaController]:
+        """
+        :return: controller of the host, None until the fleet is started
+        """
+        if host not in self._hosts:
+            self._hosts.append(host)
+        if self._session is not None and host not in self._controllers:
+            self._controllers[host] = self._create_controller(host)
+        return self._controllers.get(host)
+
+    async def remove_host(self, host):
+        if host in self._hosts:
+            self._hosts.remove(host)
+        controller = self._controllers.pop(host, None)
+        if controller is not None:
+            await controller.ws_connection.close()
+
+    async def close(self):
+        await asyncio.gather(*[controller.ws_connection.close() for controller in self._controllers.values()],
+                             return_exceptions=True)
+        self._controllers = {}
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def map(self, fn, hosts=None, deadline=None):
+        """
+        Run fn on every controller concurrently, results are yielded as soon as each host is done so a slow
+        adapter does not hold back the others. A failing host yields a result carrying the error.
+        :param fn: coroutine function taking an AlthermaController
+        :param hosts: subset of hosts, all by default
+        :param deadline: seconds after which a host is given up with asyncio.TimeoutError
+        :return: async iterator of FleetResult
+        """
+        async def _run(host):
+            started = time.monotonic()
+            try:
+                value = await asyncio.wait_for(fn(self._controllers[host]), deadline)
+                return FleetResult(host, value, elapsed=time.monotonic() - started)
+            except Exception as e:
+                logger.warning(f'{host} failed: {e!r}')
+                return FleetResult(host, error=e, elapsed=time.monotonic() - started)
+
+        hosts = self._hosts if hosts is None else hosts
+        tasks = [asyncio.ensure_future(_run(host)) for host in hosts]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def discover(self, hosts=None, deadline=None, **discover_args):
+        """
+        Discover the units of every adapter concurrently.
+        :param discover_args: arguments of AlthermaController.discover_units
+        :return: async iterator of FleetResult with the discovered controller as value
+        """
+        async def _discover(controller: AlthermaController):
+            await controller.discover_units(**discover_args)
+            return controller
+
+        async for result in self.map(_discover, hosts, deadline):
+            yield result
+
+    async def snapshots(self, hosts=None, deadline=None):
+        """
+        Read the current state of every adapter concurrently.
+        :return: async iterator of FleetResult with the state of AlthermaController.get_current_state as value
+        """
+        async for result in self.map(lambda controller: controller.get_current_state(), hosts, deadline):
+            yield result
+
+    async def get_current_state(self, hosts=None, deadline=None) -> dict:
+        """
+        :return: dict of host to state, None for hosts that failed
+        """
+        return {result.host: result.value async for result in self.snapshots(hosts, deadline)}
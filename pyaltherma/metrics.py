@@ -0,0 +1,198 @@
+import bisect
+from collections import defaultdict
+
+OPERATION_NAMES = {1: 'create', 2: 'retrieve', 3: 'update', 4: 'delete', 5: 'notify'}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+class ConnectionObserver:
+    """
+    Instrumentation hooks of DaikinWSConnection. Every hook is a no-op, subclasses override what they need.
+    """
+
+    def on_request(self, dest, operation, lock_wait, latency, request_size, response_size, response_code):
+        """
+        :param dest: request destination
+        :param operation: oneM2M operation name, e.g. retrieve
+        :param lock_wait: seconds spent waiting for the connection before sending
+        :param latency: seconds between sending and receiving the response, None if not awaited
+        :param request_size: bytes sent
+        :param response_size: bytes received, None if not awaited
+        :param response_code: oneM2M response code or None
+        """
+
+    def on_timeout(self, dest, operation, elapsed):
+        pass
+
+    def on_connect(self, address, reconnect):
+        pass
+
+    def on_state_change(self, state):
+        pass
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        return self._sum / self._count if self._count > 0 else None
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def cumulative(self):
+        """
+        :return: list of (upper bound, count of observations <= bound), the last bound is +Inf
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self._buckets + (float('inf'),), self._counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket containing the q-quantile
+        """
+        if self._count == 0:
+            return None
+        rank = q * self._count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+    def to_dict(self):
+        return {'count': self._count, 'sum': self._sum,
+                'buckets': {str(bound): total for bound, total in self.cumulative()}}
+
+
+def _labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+class MetricsCollector(ConnectionObserver):
+    def __init__(self, latency_buckets=LATENCY_BUCKETS, size_buckets=SIZE_BUCKETS):
+        """
+        Keeps request metrics of a connection in memory, export with to_dict or to_prometheus.
+        """
+        self._latency_buckets = latency_buckets
+        self._size_buckets = size_buckets
+        self._latency = defaultdict(lambda: Histogram(self._latency_buckets))
+        self._lock_wait = Histogram(self._latency_buckets)
+        self._request_size = Histogram(self._size_buckets)
+        self._response_size = Histogram(self._size_buckets)
+        self._response_codes = defaultdict(int)
+        self._timeouts = defaultdict(int)
+        self._connects = 0
+        self._reconnects = 0
+        self._state = None
+
+    @staticmethod
+    def _destination(dest):
+        dest = dest.strip('/')
+        return dest[:-3] if dest.endswith('/la') else dest
+
+    def on_request(self, dest, operation, lock_wait, latency, request_size, response_size, response_code):
+        self._lock_wait.observe(lock_wait)
+        self._request_size.observe(request_size)
+        if latency is not None:
+            self._latency[(self._destination(dest), operation)].observe(latency)
+        if response_size is not None:
+            self._response_size.observe(response_size)
+        if response_code is not None:
+            self._response_codes[response_code] += 1
+
+    def on_timeout(self, dest, operation, elapsed):
+        self._timeouts[(self._destination(dest), operation)] += 1
+
+    def on_connect(self, address, reconnect):
+        self._connects += 1
+        if reconnect:
+            self._reconnects += 1
+
+    def on_state_change(self, state):
+        self._state = state
+
+    def latency(self, dest, operation='retrieve') -> Histogram:
+        return self._latency.get((self._destination(dest), operation))
+
+    @property
+    def lock_wait(self) -> Histogram:
+        return self._lock_wait
+
+    @property
+    def reconnects(self):
+        return self._reconnects
+
+    @property
+    def timeouts(self):
+        return sum(self._timeouts.values())
+
+    @property
+    def response_codes(self):
+        return dict(self._response_codes)
+
+    def to_dict(self):
+        return {
+            'latency': {f'{operation} {dest}': histogram.to_dict()
+                        for (dest, operation), histogram in self._latency.items()},
+            'lock_wait': self._lock_wait.to_dict(),
+            'request_size': self._request_size.to_dict(),
+            'response_size': self._response_size.to_dict(),
+            'response_codes': dict(self._response_codes),
+            'timeouts': {f'{operation} {dest}': count for (dest, operation), count in self._timeouts.items()},
+            'connects': self._connects,
+            'reconnects': self._reconnects,
+            'state': None if self._state is None else self._state.value,
+        }
+
+    @staticmethod
+    def _prometheus_histogram(name, histogram, labels=()):
+        lines = []
+        for bound, total in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else str(bound)
+            lines.append(f'{name}_bucket{{{_labels(tuple(labels) + (("le", le),))}}} {total}')
+        suffix = f'{{{_labels(labels)}}}' if len(labels) > 0 else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum}')
+        lines.append(f'{name}_count{suffix} {histogram.count}')
+        return lines
+
+    def to_prometheus(self, prefix='pyaltherma'):
+        """
+        :return: metrics in Prometheus text exposition format
+        """
+        lines = [f'# TYPE {prefix}_request_latency_seconds histogram']
+        for (dest, operation), histogram in sorted(self._latency.items()):
+            lines += self._prometheus_histogram(f'{prefix}_request_latency_seconds', histogram,
+                                                (('destination', dest), ('operation', operation)))
+        for name, histogram in [('lock_wait_seconds', self._lock_wait), ('request_size_bytes', self._request_size),
+                                ('response_size_bytes', self._response_size)]:
+            lines.append(f'# TYPE {prefix}_{name} histogram')
+            lines += self._prometheus_histogram(f'{prefix}_{name}', histogram)
+        lines.append(f'# TYPE {prefix}_responses_total counter')
+        for code, count in sorted(self._response_codes.items()):
+            lines.append(f'{prefix}_responses_total{{code="{code}"}} {count}')
+        lines.append(f'# TYPE {prefix}_timeouts_total counter')
+        for (dest, operation), count in sorted(self._timeouts.items()):
+            lines.append(f'{prefix}_timeouts_total{{destination="{dest}",operation="{operation}"}} {count}')
+        lines.append(f'# TYPE {prefix}_reconnects_total counter')
+        lines.append(f'{prefix}_reconnects_total {self._reconnects}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+import typing
+
+from pyaltherma.controllers import AlthermaController, AlthermaUnitController
+from pyaltherma.errors import AlthermaException
+from pyaltherma.state import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls of each resource class, None disables polling of the class
+DEFAULT_INTERVALS = {
+    'sensors': 10,
+    'operations': 30,
+    'states': 30,
+    'consumption': 300,
+}
+
+PRIORITY_WRITE = 0
+PRIORITY_POLL = 10
+
+
+class AdaptiveInterval:
+    def __init__(self, min_interval, max_interval, threshold=0.01, slowdown=1.5, speedup=0.5):
+        """
+        Polling interval of a single value that shrinks while the value moves and grows while it is stable.
+        :param min_interval: shortest interval in seconds
+        :param max_interval: longest interval in seconds
+        :param threshold: rate of change (units per second) above which a value counts as moving.
+            Non numeric values count as moving whenever they change.
+        :param slowdown: factor applied to the interval after a stable observation
+        :param speedup: factor applied to the interval after a moving observation
+        """
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._threshold = threshold
+        self._slowdown = slowdown
+        self._speedup = speedup
+        self._interval = min_interval
+        self._last_value = None
+        self._last_time = None
+        self._boost_until = 0
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def _moving(self, value, now):
+        if self._last_time is None:
+            return True
+        if isinstance(value, (int, float)) and isinstance(self._last_value, (int, float)):
+            elapsed = max(now - self._last_time, 1e-6)
+            return abs(value - self._last_value) / elapsed >= self._threshold
+        return value != self._last_value
+
+    def observe(self, value, now=None):
+        now = now if now is not None else time.monotonic()
+        if now < self._boost_until:
+            self._interval = self._min_interval
+        elif self._moving(value, now):
+            self._interval = max(self._min_interval, self._interval * self._speedup)
+        else:
+            self._interval = min(self._max_interval, self._interval * self._slowdown)
+        self._last_value = value
+        self._last_time = now
+        return self._interval
+
+    def boost(self, duration, now=None):
+        """
+        Poll at the shortest interval for the next duration seconds.
+        """
+        now = now if now is not None else time.monotonic()
+        self._boost_until = now + duration
+        self._interval = self._min_interval
+
+
+class AlthermaPoller:
+    def __init__(self, controller: AlthermaController, intervals: dict = None, jitter=0.1, workers=1,
+                 store: StateStore = None, adaptive_bounds=None, change_threshold=0.01, write_boost=60):
+        """
+        Polls discovered units in the background and keeps the latest values in a StateStore.
+        :param controller: controller with discovered units
+        :param intervals: seconds per resource class, overrides DEFAULT_INTERVALS
+        :param jitter: relative random deviation of every interval, spreads polls of different classes
+        :param workers: number of requests issued at the same time
+        :param store: state store to fill, a new one is created by default
+        :param adaptive_bounds: (min, max) seconds. When set every sensor is polled on its own AdaptiveInterval
+            instead of the fixed sensors interval.
+        :param change_threshold: rate of change per second above which a sensor is polled faster
+        :param write_boost: seconds the sensors of a unit are polled at the shortest interval after a write
+        """
+        self._controller = controller
+        self._intervals = dict(DEFAULT_INTERVALS)
+        if intervals is not None:
+            self._intervals.update(intervals)
+        self._jitter = jitter
+        self._workers = workers
+        self._store = store if store is not None else StateStore()
+        self._queue: typing.Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._tasks = []
+        self._adaptive_bounds = adaptive_bounds
+        self._change_threshold = change_threshold
+        self._write_boost = write_boost
+        self._trackers = {}
+        self._wakeups = {}
+
+    @property
+    def store(self) -> StateStore:
+        return self._store
+
+    @property
+    def running(self):
+        return len(self._tasks) > 0
+
+    def get(self, unit_function, resource_class, key, default=None):
+        """
+        Latest polled value without any I/O
+        """
+        return self._store.get(unit_function, resource_class, key, default)
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self._jitter, self._jitter))
+
+    @staticmethod
+    def _reader(unit: AlthermaUnitController, resource_class):
+        return {
+            'sensors': unit.read_sensors,
+            'operations': unit.read_operations,
+            'states': unit.read_states,
+            'consumption': unit.read_consumptions,
+        }[resource_class]
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self._workers)]
+        for unit in self._controller.altherma_units.values():
+            self._wakeups[unit.unit_function] = asyncio.Event()
+            for resource_class, interval in self._intervals.items():
+                if interval is None:
+                    continue
+                if resource_class == 'sensors' and self._adaptive_bounds is not None:
+                    for sensor in unit.sensors:
+                        self._tasks.append(asyncio.ensure_future(self._schedule_adaptive(unit, sensor)))
+                else:
+                    self._tasks.append(asyncio.ensure_future(self._schedule(unit, resource_class, interval)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Requests still queued would otherwise never be answered
+        while self._queue is not None and not self._queue.empty():
+            _, _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(AlthermaException('Poller stopped.'))
+
+    def _submit(self, priority, fn) -> asyncio.Future:
+        if not self.running:
+            raise AlthermaException('Poller is not running.')
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((priority, next(self._sequence), fn, future))
+        return future
+
+    async def _worker(self):
+        while True:
+            _, _, fn, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_exception(AlthermaException('Poller stopped.'))
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def poll(self, unit: AlthermaUnitController, resource_class, priority=PRIORITY_POLL):
+        """
+        Queue an immediate poll of a resource class and store the result.
+        """
+        values = await self._submit(priority, self._reader(unit, resource_class))
+        self._store.update(unit.unit_function, resource_class, values)
+        return values
+
+    async def _schedule(self, unit: AlthermaUnitController, resource_class, interval):
+        # Spread the first polls so units and classes do not fire together
+        await asyncio.sleep(random.uniform(0, interval * self._jitter))
+        while True:
+            try:
+                await self.poll(unit, resource_class)
+            except Exception as e:
+                logger.warning(f'Polling {resource_class} of {unit} failed: {e}')
+            await asyncio.sleep(self._jittered(interval))
+
+    def interval(self, unit_function, sensor):
+        """
+        Current adaptive interval of a sensor or None when adaptive polling is off
+        """
+        tracker = self._trackers.get((unit_function, sensor))
+        return None if tracker is None else tracker.interval
+
+    async def _sleep(self, unit_function, delay):
+        # Returns early when the unit is boosted. asyncio.wait is used since wait_for may swallow a cancellation
+        # arriving together with the wakeup.
+        wakeup = asyncio.ensure_future(self._wakeups[unit_function].wait())
+        try:
+            await asyncio.wait([wakeup], timeout=delay)
+        finally:
+            wakeup.cancel()
+
+    async def _schedule_adaptive(self, unit: AlthermaUnitController, sensor):
+        min_interval, max_interval = self._adaptive_bounds
+        tracker = AdaptiveInterval(min_interval, max_interval, self._change_threshold)
+        self._trackers[(unit.unit_function, sensor)] = tracker
+        await asyncio.sleep(random.uniform(0, min_interval * self._jitter))
+        while True:
+            try:
+                value = await self._submit(PRIORITY_POLL, lambda: unit.read_sensor(sensor))
+                tracker.observe(value)
+                self._store.update(unit.unit_function, 'sensors', {sensor: value})
+            except Exception as e:
+                logger.warning(f'Polling sensor {sensor} of {unit} failed: {e}')
+            await self._sleep(unit.unit_function, self._jittered(tracker.interval))
+
+    def boost(self, unit_function, duration=None):
+        """
+        Poll sensors of the unit at the shortest interval, e.g. after changing one of its operations.
+        """
+        duration = duration if duration is not None else self._write_boost
+        for (function, _), tracker in self._trackers.items():
+            if function == unit_function:
+                tracker.boost(duration)
+        wakeup = self._wakeups.get(unit_function)
+        if wakeup is not None:
+            wakeup.set()
+            wakeup.clear()
+
+    async def call_operation(self, unit_function, operation, value=None):
+        """
+        Write an operation ahead of queued background polls. Sensors of the unit are polled faster afterwards.
+        """
+        unit = self._controller.altherma_units[unit_function]
+        result = await self._submit(PRIORITY_WRITE, lambda: unit.call_operation(operation, value))
+        self.boost(unit_function)
+        return result
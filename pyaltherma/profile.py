@@ -1,3 +1,113 @@
+import types
+import typing
+
+
+class OperationValidator:
+    __slots__ = ('_name', '_allowed', '_value_type', '_min_value', '_max_value', '_step', '_settable')
+
+    def __init__(self, name, allowed=None, value_type=None, min_value=None, max_value=None, step=None,
+                 settable=True):
+        """
+        Immutable validation rule of a single operation, either a set of allowed values or a range.
+        :param name: operation name as used in the unit profile
+        :param allowed: allowed values, None for range operations
+        :param value_type: type values are converted to before they are compared against allowed values
+        :param min_value: lowest settable value of a range
+        :param max_value: highest settable value of a range
+        :param step: distance between settable values of a range
+        :param settable: False if the unit rejects writes of the operation
+        """
+        self._name = name
+        self._allowed = frozenset(allowed) if allowed is not None else None
+        self._value_type = value_type
+        self._min_value = min_value
+        self._max_value = max_value
+        self._step = step
+        self._settable = settable
+
+    @classmethod
+    def from_profile(cls, name, conf):
+        if isinstance(conf, list):
+            value_types = {type(v) for v in conf}
+            return cls(name, allowed=conf, value_type=value_types.pop() if len(value_types) == 1 else None)
+        if isinstance(conf, dict) and isinstance(conf.get('heating'), dict):
+            # Heating setpoints were always treated as settable, whatever the profile says
+            return cls(name, min_value=conf['heating'].get('minValue'), max_value=conf['heating'].get('maxValue'),
+                       step=conf['heating'].get('stepValue'))
+        if isinstance(conf, dict):
+            return cls(name, min_value=conf.get('minValue'), max_value=conf.get('maxValue'),
+                       step=conf.get('stepValue'), settable=conf.get('settable', True))
+        return cls(name, settable=False)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def allowed(self):
+        return self._allowed
+
+    @property
+    def value_type(self):
+        return self._value_type
+
+    @property
+    def min_value(self):
+        return self._min_value
+
+    @property
+    def max_value(self):
+        return self._max_value
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def settable(self):
+        return self._settable
+
+    @property
+    def is_range(self):
+        return self._allowed is None
+
+    def is_valid(self, value):
+        if self._allowed is not None:
+            if self._value_type is not None and not isinstance(value, self._value_type):
+                try:
+                    value = self._value_type(value)
+                except (TypeError, ValueError):
+                    return False
+            return value in self._allowed
+        if not self._settable:
+            return False
+        try:
+            if self._min_value is not None and value < self._min_value:
+                return False
+            if self._max_value is not None and value > self._max_value:
+                return False
+            if self._step and self._min_value is not None:
+                steps = (value - self._min_value) / self._step
+                return abs(steps - round(steps)) < 1e-6
+        except TypeError:
+            return False
+        return True
+
+    def __repr__(self):
+        if self._allowed is not None:
+            return f'OperationValidator({self._name}, allowed={sorted(self._allowed, key=str)})'
+        return f'OperationValidator({self._name}, {self._min_value}..{self._max_value} step {self._step}, ' \
+               f'settable={self._settable})'
+
+
+def compile_operations(operations: dict):
+    """
+    :return: read-only mapping of operation name to OperationValidator
+    """
+    return types.MappingProxyType(
+        {name: OperationValidator.from_profile(name, conf) for name, conf in operations.items()})
+
+
 class ConsumptionContent:
     def __init__(self, period, profile):
         self._profile = profile
@@ -49,6 +159,7 @@ class ConsumptionType:
         self.parse()
 
     def parse(self):
+        self._unit = self._profile.get('unit')
         for action, details in self._profile.items():
             if isinstance(details, dict):
                 consumption_action = ConsumptionAction(action, details)
@@ -79,6 +190,7 @@ class AlthermaUnit:
         self._sensors = []
         self._unit_status = []
         self._operations = {}
+        self._validators = compile_operations({})
         self._initialized = False
         self._consumptions = {}
         self._unit_function = unit_function
@@ -100,6 +212,8 @@ class AlthermaUnit:
         if 'UnitStatus' in profile:
             self._unit_status = profile['UnitStatus']
         if 'Operation' in profile:
+            if profile['Operation'] != self._operations:
+                self._validators = compile_operations(profile['Operation'])
             self._operations = profile['Operation']
 
         if 'Consumption' in profile:
@@ -137,6 +251,16 @@ class AlthermaUnit:
     def operation_config(self):
         return self._operations
 
+    @property
+    def operation_validators(self):
+        """
+        Validation rules compiled from the profile, rebuilt only when the operations of the profile change
+        """
+        return self._validators
+
+    def operation_validator(self, operation) -> typing.Optional[OperationValidator]:
+        return self._validators.get(operation)
+
     @property
     def sensor_list(self):
         return self._sensors
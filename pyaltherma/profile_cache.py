@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    def __init__(self, path):
+        """
+        Local file remembering discovered unit profiles per adapter so startup can skip discovery.
+        :param path: json file, created on first store
+        """
+        self._path = path
+
+    @property
+    def path(self):
+        return self._path
+
+    def _read(self) -> dict:
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable profile cache {self._path}: {e}')
+            return {}
+
+    def _write(self, content):
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp_path, self._path)
+
+    def load(self, host):
+        """
+        :return: dict with firmware and profiles of the adapter or None
+        """
+        entry = self._read().get(host)
+        if not isinstance(entry, dict) or 'profiles' not in entry:
+            return None
+        return entry
+
+    def store(self, host, firmware, profiles):
+        content = self._read()
+        content[host] = {'firmware': firmware, 'profiles': profiles, 'updated': time.time()}
+        self._write(content)
+        logger.debug(f'Stored {len(profiles)} profiles of {host} in {self._path}')
+
+    def invalidate(self, host):
+        content = self._read()
+        if content.pop(host, None) is not None:
+            self._write(content)
@@ -1,20 +1,45 @@
 import uuid
-import json
+
+from pyaltherma import codec
+
+from pyaltherma.const import OPERATION_CREATE, OPERATION_RETRIEVE, RESOURCE_TYPE_CONTENT_INSTANCE, \
+    RESOURCE_TYPE_SUBSCRIPTION
+
+RESOURCE_TYPE_NAMES = {
+    RESOURCE_TYPE_CONTENT_INSTANCE: 'm2m:cin',
+    RESOURCE_TYPE_SUBSCRIPTION: 'm2m:sub',
+}
 
 
 class Request:
-    def __init__(self, dest, payload=None, user_agent='pyaltherma'):
-        request = {'fr': user_agent, 'rqi': uuid.uuid4().hex[0:5], 'op': 2, 'to': dest}
+    def __init__(self, dest, payload=None, user_agent='pyaltherma', result_content=None, filter_criteria=None,
+                 resource_type=RESOURCE_TYPE_CONTENT_INSTANCE, operation=None):
+        self._rqi = uuid.uuid4().hex[0:5]
+        request = {'fr': user_agent, 'rqi': self._rqi, 'op': OPERATION_RETRIEVE, 'to': dest}
         if payload:
-            request['op'] = 1
-            request['ty'] = 4
+            request['op'] = OPERATION_CREATE
+            request['ty'] = resource_type
             request['pc'] = {
-                'm2m:cin': payload
+                RESOURCE_TYPE_NAMES[resource_type]: payload
             }
+        if operation is not None:
+            request['op'] = operation
+        if result_content is not None:
+            request['rcn'] = result_content
+        if filter_criteria is not None:
+            request['fc'] = filter_criteria
         self._request = {
             'm2m:rqp': request
         }
 
+    @property
+    def rqi(self):
+        return self._rqi
+
+    @property
+    def message(self) -> dict:
+        return self._request['m2m:rqp']
+
     def serialize(self) -> str:
-        o = json.dumps(self._request)
+        o = codec.dumps(self._request)
         return o
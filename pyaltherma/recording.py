@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+
+from aiohttp import WSMessage, WSMsgType
+
+logger = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+
+# Failures of requests recorded without response
+ERROR_TIMEOUT = 'timeout'
+ERROR_CONNECTION = 'connection'
+
+
+class SessionRecorder:
+    def __init__(self, path, host=None):
+        """
+        Appends every exchange of a connection to a JSON lines file.
+        A session starts with a header line, every other line is either an exchange
+        {"t": offset, "d": latency, "q": request, "r": response} or an unsolicited message {"t": offset, "n": message}.
+        Requests that failed carry the failure instead of a response, {"t": offset, "d": elapsed, "q": request,
+        "e": "timeout"} or "e": "connection".
+        :param path: file to append to
+        :param host: adapter address stored in the header
+        """
+        self._path = path
+        self._host = host
+        self._file = None
+        self._started = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def _open(self, now):
+        self._file = open(self._path, 'a')
+        self._started = now
+        self._write({'version': RECORDING_VERSION, 'host': self._host, 'started': time.time()})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')))
+        self._file.write('\n')
+        self._file.flush()
+
+    def record(self, request: dict, response, sent_at, received_at=None, error=None):
+        """
+        :param request: m2m:rqp message sent
+        :param response: m2m:rsp message received or None
+        :param sent_at: time.monotonic() when the request was sent
+        :param received_at: time.monotonic() when the response arrived or the request failed
+        :param error: ERROR_TIMEOUT or ERROR_CONNECTION if the request failed
+        """
+        if self._file is None:
+            self._open(sent_at)
+        record = {'t': round(sent_at - self._started, 6), 'q': request}
+        if response is not None:
+            record['d'] = round(received_at - sent_at, 6)
+            record['r'] = response
+        elif error is not None:
+            record['d'] = round(received_at - sent_at, 6)
+            record['e'] = error
+        self._write(record)
+
+    def record_notification(self, message: dict, received_at=None):
+        received_at = received_at if received_at is not None else time.monotonic()
+        if self._file is None:
+            self._open(received_at)
+        self._write({'t': round(received_at - self._started, 6), 'n': message})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_recording(path):
+    """
+    :return: tuple (header, records)
+    """
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    header = lines[0] if len(lines) > 0 and 'version' in lines[0] else {}
+    records = [line for line in lines if 'q' in line or 'n' in line]
+    return header, records
+
+
+def _request_key(rqp):
+    return rqp.get('op'), rqp.get('to', '').strip('/')
+
+
+class ReplayWebSocket:
+    def __init__(self, records, speed=1.0):
+        self._speed = speed
+        self._exchanges = defaultdict(list)
+        self._positions = defaultdict(int)
+        for record in records:
+            if 'q' in record and ('r' in record or 'e' in record):
+                self._exchanges[_request_key(record['q'])].append(record)
+        self._notifications = [record for record in records if 'n' in record]
+        self._messages = asyncio.Queue()
+        self._closed = False
+        self._handles = []
+        loop = asyncio.get_event_loop()
+        for record in self._notifications:
+            self._handles.append(loop.call_later(self._scale(record['t']), self._deliver, record['n']))
+
+    def _scale(self, delay):
+        return 0 if not self._speed else delay / self._speed
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _deliver(self, message):
+        if not self._closed:
+            self._messages.put_nowait(WSMessage(WSMsgType.TEXT, json.dumps(message), None))
+
+    def _next_exchange(self, rqp):
+        key = _request_key(rqp)
+        exchanges = self._exchanges.get(key)
+        if not exchanges:
+            return None
+        # Recorded exchanges of the same request are replayed in order and cycled when exhausted
+        position = self._positions[key]
+        self._positions[key] = position + 1
+        return exchanges[position % len(exchanges)]
+
+    async def send_str(self, data):
+        if self._closed:
+            raise ConnectionResetError('Replay websocket is closed')
+        rqp = json.loads(data)['m2m:rqp']
+        exchange = self._next_exchange(rqp)
+        if exchange is None:
+            logger.debug(f'No recorded response for {rqp.get("to")}')
+            response, delay = {'m2m:rsp': {'rsc': 4004, 'to': rqp.get('fr')}}, 0
+        elif 'e' in exchange:
+            # A timed out request is never answered, a dropped connection closes the socket
+            if exchange['e'] == ERROR_CONNECTION:
+                self._handles.append(asyncio.get_event_loop().call_later(
+                    self._scale(exchange.get('d', 0)), self._drop))
+            return
+        else:
+            response, delay = json.loads(json.dumps(exchange['r'])), exchange.get('d', 0)
+        response.setdefault('m2m:rsp', {})['rqi'] = rqp.get('rqi')
+        self._handles.append(asyncio.get_event_loop().call_later(self._scale(delay), self._deliver, response))
+
+    async def receive(self, timeout=None):
+        if self._closed and self._messages.empty():
+            return WSMessage(WSMsgType.CLOSED, None, None)
+        return await asyncio.wait_for(self._messages.get(), timeout)
+
+    async def receive_str(self, *, timeout=None):
+        msg = await self.receive(timeout)
+        if msg.type != WSMsgType.TEXT:
+            raise TypeError(f'Received message {msg.type} is not a text message')
+        return msg.data
+
+    async def ping(self, message=b''):
+        pass
+
+    def _drop(self):
+        if not self._closed:
+            self._closed = True
+            self._messages.put_nowait(WSMessage(WSMsgType.CLOSED, None, None))
+
+    async def close(self, **kwargs):
+        self._closed = True
+        for handle in self._handles:
+            handle.cancel()
+        self._messages.put_nowait(WSMessage(WSMsgType.CLOSED, None, None))
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        msg = await self.receive()
+        if msg.type == WSMsgType.CLOSED:
+            raise StopAsyncIteration
+        return msg
+
+
+class ReplaySession:
+    def __init__(self, path, speed=1.0):
+        """
+        Stands in for aiohttp ClientSession, DaikinWSConnection(ReplaySession(path), host) answers requests
+        from a recording without an adapter.
+        :param path: recording written by SessionRecorder
+        :param speed: latency divisor, 1 replays recorded timing, 10 ten times faster, 0 without delay
+        """
+        self._header, self._records = load_recording(path)
+        self._speed = speed
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def records(self):
+        return self._records
+
+    async def ws_connect(self, url, **kwargs):
+        return ReplayWebSocket(self._records, self._speed)
+
+    async def close(self):
+        pass
+
+
+async def replay_traffic(connection, path, speed=1.0):
+    """
+    Send recorded requests through a connection at their recorded offsets, e.g. to load a fake adapter with
+    production traffic patterns.
+    :param connection: DaikinWSConnection to send through
+    :param path: recording written by SessionRecorder
+    :param speed: time divisor, 0 sends everything at once
+    :return: list of (destination, latency in seconds, response or the exception of a failed request)
+    """
+    _, records = load_recording(path)
+    started = time.monotonic()
+
+    async def _send(record):
+        rqp = record['q']
+        if speed:
+            await asyncio.sleep(max(0, record['t'] / speed - (time.monotonic() - started)))
+        sent_at = time.monotonic()
+        payload = next(iter(rqp['pc'].values())) if 'pc' in rqp else None
+        request_args = {'operation': rqp.get('op'), 'result_content': rqp.get('rcn'),
+                        'filter_criteria': rqp.get('fc')}
+        if 'ty' in rqp:
+            request_args['resource_type'] = rqp['ty']
+        try:
+            response = await connection.request(rqp['to'], payload, wait_for_response='r' in record or 'e' in record,
+                                                **request_args)
+        except Exception as e:
+            if 'e' not in record:
+                raise
+            response = e
+        return rqp['to'], time.monotonic() - sent_at, response
+
+    return await asyncio.gather(*[_send(record) for record in records if 'q' in record])
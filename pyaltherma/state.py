@@ -0,0 +1,102 @@
+import time
+
+
+class StateChange:
+    def __init__(self, unit_function, resource_class, key, value, previous, timestamp):
+        self._unit_function = unit_function
+        self._resource_class = resource_class
+        self._key = key
+        self._value = value
+        self._previous = previous
+        self._timestamp = timestamp
+
+    @property
+    def unit_function(self):
+        return self._unit_function
+
+    @property
+    def resource_class(self):
+        return self._resource_class
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def previous(self):
+        """
+        Value before the change, None for the first observation
+        """
+        return self._previous
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    def __repr__(self):
+        return f'StateChange({self._unit_function} {self._resource_class}/{self._key}: ' \
+               f'{self._previous!r} -> {self._value!r})'
+
+
+class StateStore:
+    def __init__(self):
+        """
+        Latest known values of unit resources, keyed by unit function, resource class
+        (sensors, operations, states, consumption) and resource name.
+        """
+        self._values = {}
+
+    def update(self, unit_function, resource_class, values: dict, timestamp=None):
+        """
+        Keys that failed to read (None) keep their last known value.
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        for key, value in values.items():
+            if value is None:
+                continue
+            self._values[(unit_function, resource_class, key)] = (value, timestamp)
+
+    def apply(self, state: dict, timestamp=None) -> list:
+        """
+        Update the store from a get_current_state snapshot.
+        Keys that failed to read (None) keep their last known value.
+        :return: list of StateChange for new or changed values
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        changes = []
+        for unit_function, unit_state in state.items():
+            for resource_class, values in (unit_state or {}).items():
+                for key, value in (values or {}).items():
+                    if value is None:
+                        continue
+                    entry_key = (unit_function, resource_class, key)
+                    entry = self._values.get(entry_key)
+                    if entry is None or entry[0] != value:
+                        changes.append(StateChange(unit_function, resource_class, key, value,
+                                                   None if entry is None else entry[0], timestamp))
+                    self._values[entry_key] = (value, timestamp)
+        return changes
+
+    def get(self, unit_function, resource_class, key, default=None):
+        entry = self._values.get((unit_function, resource_class, key))
+        return default if entry is None else entry[0]
+
+    def timestamp(self, unit_function, resource_class, key):
+        entry = self._values.get((unit_function, resource_class, key))
+        return None if entry is None else entry[1]
+
+    def snapshot(self) -> dict:
+        """
+        :return: values in the same shape as AlthermaController.get_current_state
+        """
+        status = {}
+        for (unit_function, resource_class, key), (value, _) in self._values.items():
+            status.setdefault(unit_function, {}).setdefault(resource_class, {})[key] = value
+        return status
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import web
+
+from pyaltherma.const import VALID_RESPONSE_CODES, RESPONSE_CODE_CONFLICT, RESOURCE_TYPE_SUBSCRIPTION, \
+    OPERATION_DELETE, NOTIFICATION_EVENT_CREATE_CHILD
+from pyaltherma.utils import query_object
+
+logger = logging.getLogger(__name__)
+
+# Addresses the adapter cannot post to
+WILDCARD_HOSTS = ('0.0.0.0', '::', '')
+
+
+class Notification:
+    def __init__(self, unit_function, query_type, resource, destination, value, timestamp=None):
+        self._unit_function = unit_function
+        self._query_type = query_type
+        self._resource = resource
+        self._destination = destination
+        self._value = value
+        self._timestamp = timestamp if timestamp is not None else time.time()
+
+    @property
+    def unit_function(self):
+        return self._unit_function
+
+    @property
+    def query_type(self):
+        return self._query_type
+
+    @property
+    def resource(self):
+        return self._resource
+
+    @property
+    def destination(self):
+        return self._destination
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    def __repr__(self):
+        return f'Notification({self._unit_function} {self._query_type}/{self._resource}={self._value!r})'
+
+
+class NotificationServer:
+    def __init__(self, handler=None, host='0.0.0.0', port=0, path='/notify', advertised_host=None):
+        """
+        Minimal HTTP endpoint the adapter can post oneM2M notifications to.
+        :param handler: callable receiving the decoded notification body, set by AlthermaController.subscribe
+            if omitted
+        :param host: interface to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param path: url path of the endpoint
+        :param advertised_host: address the adapter should use to reach this machine, defaults to host and is
+            required when listening on all interfaces
+        """
+        if advertised_host is None and host in WILDCARD_HOSTS:
+            raise ValueError(f'advertised_host is required when listening on {host!r}')
+        self._handler = handler
+        self._host = host
+        self._port = port
+        self._path = path
+        self._advertised_host = advertised_host if advertised_host is not None else host
+        self._runner = None
+
+    @property
+    def url(self):
+        return f'http://{self._advertised_host}:{self._port}{self._path}'
+
+    @property
+    def started(self):
+        return self._runner is not None
+
+    def set_handler(self, handler):
+        self._handler = handler
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self._path, self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        self._port = self._runner.addresses[0][1]
+        logger.debug(f'Listening for notifications on {self.url}')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        try:
+            message = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if self._handler is None:
+            return web.Response(status=503)
+        self._handler(message)
+        return web.Response(status=200, headers={'X-M2M-RSC': '2000', 'X-M2M-RI': request.headers.get('X-M2M-RI', '')})
+
+
+class SubscriptionManager:
+    def __init__(self, connection, notification_uri=None, name='pyaltherma'):
+        """
+        Creates m2m:sub resources on unit resources and turns incoming notifications into Notification objects.
+        :param connection: websocket connection to the adapter
+        :param notification_uri: where the adapter sends notifications, e.g. NotificationServer.url.
+            None delivers them over the websocket, which requires the connection in pipelined mode to receive
+            notifications while idle.
+        :param name: resource name of created subscriptions
+        """
+        self._connection = connection
+        self._notification_uri = notification_uri
+        self._name = name
+        self._subscriptions = {}
+        self._listeners = []
+        if notification_uri is None:
+            connection.add_notification_handler(self.handle)
+
+    @property
+    def subscriptions(self):
+        return list(self._subscriptions.keys())
+
+    def add_listener(self, callback):
+        """
+        :param callback: called with every Notification, coroutine functions are scheduled as tasks
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    async def notifications(self):
+        """
+        Async iterator of notifications received from now on.
+        """
+        queue = asyncio.Queue()
+        self.add_listener(queue.put_nowait)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.remove_listener(queue.put_nowait)
+
+    async def subscribe(self, unit_controller):
+        """
+        Subscribe to every sensor, operation and status of the unit.
+        """
+        uri = self._notification_uri if self._notification_uri is not None else 'pyaltherma'
+        payload = {'rn': self._name, 'enc': {'net': [NOTIFICATION_EVENT_CREATE_CHILD]}, 'nu': [uri], 'nct': 1}
+        resources = unit_controller.resources()
+        responses = await asyncio.gather(
+            *[self._connection.request(target, payload, resource_type=RESOURCE_TYPE_SUBSCRIPTION)
+              for _, _, target in resources], return_exceptions=True)
+        for (query_type, resource, target), response in zip(resources, responses):
+            resp_code = None if isinstance(response, Exception) else query_object(response, 'm2m:rsp/rsc')
+            if resp_code not in VALID_RESPONSE_CODES and resp_code != RESPONSE_CODE_CONFLICT:
+                logger.warning(f'Failed to subscribe to {target}: {response}')
+                continue
+            self._subscriptions[f'{target}/{self._name}'.strip('/')] = (
+                unit_controller.unit_function, query_type, resource, target)
+
+    async def unsubscribe(self):
+        subscriptions = list(self._subscriptions.keys())
+        self._subscriptions.clear()
+        await asyncio.gather(*[self._connection.request(f'/{path}', operation=OPERATION_DELETE)
+                               for path in subscriptions], return_exceptions=True)
+        if self._notification_uri is None:
+            self._connection.remove_notification_handler(self.handle)
+
+    def _lookup(self, subscription_reference):
+        sur = (subscription_reference or '').strip('/')
+        if sur == '':
+            return None
+        if sur in self._subscriptions:
+            return self._subscriptions[sur]
+        # Adapter may prefix or shorten the reference with the CSE id, whole path segments have to match
+        segments = sur.split('/')
+        for path, target in self._subscriptions.items():
+            path_segments = path.split('/')
+            shorter, longer = sorted((segments, path_segments), key=len)
+            if longer[len(longer) - len(shorter):] == shorter:
+                return target
+        return None
+
+    def handle(self, message):
+        """
+        Process notification received over websocket (m2m:rqp) or HTTP (m2m:sgn).
+        """
+        if 'm2m:rqp' in message:
+            sgn = query_object(message, 'm2m:rqp/pc/m2m:sgn')
+        else:
+            sgn = message.get('m2m:sgn')
+        # Verification requests and deletion notices carry no event
+        if not isinstance(sgn, dict) or 'nev' not in sgn:
+            return
+        target = self._lookup(sgn.get('sur', ''))
+        if target is None:
+            logger.debug(f'Notification for unknown subscription {sgn.get("sur")}')
+            return
+        unit_function, query_type, resource, destination = target
+        value = query_object(sgn, 'nev/rep/m2m:cin/con')
+        if query_type == 'UnitStatus':
+            value = bool(value)
+        notification = Notification(unit_function, query_type, resource, destination, value)
+        for listener in list(self._listeners):
+            result = listener(notification)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
@@ -0,0 +1,243 @@
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import threading
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController, AlthermaUnitController
+from pyaltherma.errors import AlthermaException
+
+logger = logging.getLogger(__name__)
+
+# Marks a call waiting call_timeout seconds, None waits forever
+_CALL_TIMEOUT = object()
+
+
+def _to_concurrent(future: asyncio.Future) -> concurrent.futures.Future:
+    result = concurrent.futures.Future()
+
+    def _done(f):
+        if f.cancelled():
+            result.cancel()
+        elif f.exception() is not None:
+            result.set_exception(f.exception())
+        else:
+            result.set_result(f.result())
+
+    future.add_done_callback(_done)
+    return result
+
+
+class SyncIterator:
+    def __init__(self, client, iterator, timeout=None):
+        """
+        Blocking iterator over an async iterator living on the loop of the client, e.g. controller.watch().
+        :param timeout: seconds to wait for the next item, None waits forever. A step that times out ends the
+            iterator.
+        """
+        self._client = client
+        self._iterator = iterator
+        self._timeout = timeout
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self._client.call(self._iterator.__anext__, self._timeout)
+        except StopAsyncIteration:
+            raise StopIteration
+
+    def close(self):
+        if hasattr(self._iterator, 'aclose'):
+            self._client.call(self._iterator.aclose)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SyncProxy:
+    def __init__(self, client, target):
+        """
+        Blocking view of a controller. Attribute access, including async properties, and method calls run on
+        the loop of the client and return their awaited result.
+        """
+        object.__setattr__(self, '_client', client)
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        client, target = self._client, self._target
+        if callable(inspect.getattr_static(target, name, None)):
+            def _method(*args, **kwargs):
+                return client.call(lambda: getattr(target, name)(*args, **kwargs))
+            _method.__name__ = name
+            return _method
+        return client.call(lambda: getattr(target, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read only')
+
+    def __dir__(self):
+        return [name for name in dir(self._target) if not name.startswith('_')]
+
+    def __repr__(self):
+        return f'SyncProxy({self._target})'
+
+
+class AlthermaSyncClient:
+    def __init__(self, host, timeout=10, call_timeout=60, connection_args: dict = None,
+                 controller_args: dict = None, discover_args: dict = None, iterator_timeout=None):
+        """
+        Blocking client for scripts and threaded applications. It owns a background thread running one event
+        loop with a single long lived connection and discovered controller, so calls do not reconnect or
+        rediscover. Every method may be called from any number of threads at once.
+        :param host: address of the LAN adapter
+        :param timeout: seconds to wait for a response of the adapter
+        :param call_timeout: seconds a blocking call waits for its result, None waits forever
+        :param connection_args: additional DaikinWSConnection arguments, e.g. auto_reconnect
+        :param controller_args: additional AlthermaController arguments, e.g. cache
+        :param discover_args: arguments of AlthermaController.discover_units
+        :param iterator_timeout: seconds an iterator such as watch() waits for its next item, None waits
+            forever since items may be minutes apart
+        """
+        self._host = host
+        self._timeout = timeout
+        self._call_timeout = call_timeout
+        self._connection_args = connection_args or {}
+        self._controller_args = controller_args or {}
+        self._discover_args = discover_args or {}
+        self._iterator_timeout = iterator_timeout
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._controller = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._start_lock:
+            if self.running:
+                return self
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name=f'pyaltherma-{self._host}', daemon=True)
+            self._thread.start()
+        try:
+            self.call(self._setup)
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            tasks = [task for task in asyncio.all_tasks(self._loop) if not task.done()]
+            for task in tasks:
+                task.cancel()
+            if len(tasks) > 0:
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _setup(self):
+        # Everything bound to the loop is created on it
+        self._session = ClientSession()
+        connection = DaikinWSConnection(self._session, self._host, timeout=self._timeout, **self._connection_args)
+        self._controller = AlthermaController(connection, **self._controller_args)
+        await self._controller.discover_units(**self._discover_args)
+
+    async def _teardown(self):
+        if self._controller is not None:
+            await self._controller.ws_connection.close()
+            self._controller = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self):
+        with self._start_lock:
+            if self._thread is None:
+                return
+            try:
+                if self._thread.is_alive():
+                    self.call(self._teardown)
+            except Exception as e:
+                logger.warning(f'Closing connection to {self._host} failed: {e}')
+            finally:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._thread = None
+                self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _wrap(self, value):
+        if isinstance(value, (AlthermaController, AlthermaUnitController)):
+            return SyncProxy(self, value)
+        if isinstance(value, asyncio.Future):
+            return _to_concurrent(value)
+        if inspect.isasyncgen(value):
+            return SyncIterator(self, value, self._iterator_timeout)
+        return value
+
+    def call(self, fn, timeout=_CALL_TIMEOUT):
+        """
+        Run fn on the loop thread and wait for its result. Awaitables returned by fn are awaited, futures of
+        fire-and-forget calls are returned as concurrent.futures.Future.
+        :param fn: function without arguments, e.g. lambda: controller.climate_control.indoor_temperature
+        :param timeout: seconds to wait, None waits forever, call_timeout by default
+        """
+        if self._loop is None:
+            raise AlthermaException('Client is not started')
+        if threading.current_thread() is self._thread:
+            raise AlthermaException('Blocking calls are not allowed on the client loop thread')
+
+        async def _invoke():
+            result = fn()
+            if asyncio.iscoroutine(result):
+                result = await result
+            return self._wrap(result)
+
+        future = asyncio.run_coroutine_threadsafe(_invoke(), self._loop)
+        try:
+            return future.result(self._call_timeout if timeout is _CALL_TIMEOUT else timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    @property
+    def controller(self) -> SyncProxy:
+        if self._controller is None:
+            raise AlthermaException('Client is not started')
+        return SyncProxy(self, self._controller)
+
+    @property
+    def climate_control(self) -> SyncProxy:
+        return self.controller.climate_control
+
+    @property
+    def hot_water_tank(self) -> SyncProxy:
+        return self.controller.hot_water_tank
+
+    def get_current_state(self):
+        return self.controller.get_current_state()
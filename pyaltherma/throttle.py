@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+
+from pyaltherma.const import CircuitState
+from pyaltherma.errors import AlthermaCircuitOpenException
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """
+        Limits requests to rate per second on average while allowing short bursts.
+        :param rate: tokens added per second
+        :param burst: bucket size, rate rounded up by default
+        :param clock: monotonic time source
+        """
+        if rate <= 0:
+            raise ValueError(f'Rate must be positive, got {rate}')
+        self._rate = rate
+        self._burst = burst if burst is not None else max(1, int(rate + 0.999))
+        self._clock = clock
+        self._tokens = self._burst
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @property
+    def tokens(self):
+        self._refill()
+        return self._tokens
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """
+        :return: True if a token was taken, False if the bucket is empty
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """
+        Wait until a token is available. Waiters are served in arrival order.
+        :return: seconds spent waiting
+        """
+        started = self._clock()
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+        return self._clock() - started
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, recovery_timeout=30, half_open_requests=1, clock=time.monotonic):
+        """
+        Stops sending to an adapter that keeps failing. After failure_threshold consecutive failures the circuit
+        opens and requests fail fast. Once recovery_timeout passed, half_open_requests probes are let through,
+        the circuit closes again if they succeed and re-opens if one fails.
+        :param failure_threshold: consecutive failures opening the circuit
+        :param recovery_timeout: seconds the circuit stays open before probing
+        :param half_open_requests: concurrent probes allowed while half open
+        :param clock: monotonic time source
+        """
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._half_open_requests = half_open_requests
+        self._clock = clock
+        self._state = CircuitState.Closed
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._listeners = []
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.Open and self._clock() - self._opened_at >= self._recovery_timeout:
+            self._set_state(CircuitState.HalfOpen)
+        return self._state
+
+    @property
+    def failures(self):
+        return self._failures
+
+    def add_listener(self, listener):
+        """
+        :param listener: called with the new CircuitState on every change
+        """
+        self._listeners.append(listener)
+
+    def _set_state(self, state: CircuitState):
+        if state == self._state:
+            return
+        self._state = state
+        self._probes = 0
+        if state == CircuitState.Open:
+            self._opened_at = self._clock()
+        for listener in list(self._listeners):
+            try:
+                listener(state)
+            except Exception as e:
+                logger.error(f'Circuit breaker listener failed: {e}')
+
+    def before_request(self):
+        """
+        Raises AlthermaCircuitOpenException when the request must not be sent, every admitted request has to be
+        followed by record_success or record_failure.
+        """
+        state = self.state
+        if state == CircuitState.Open:
+            remaining = self._recovery_timeout - (self._clock() - self._opened_at)
+            raise AlthermaCircuitOpenException(f'Circuit open, retry in {remaining:.1f}s')
+        if state == CircuitState.HalfOpen:
+            if self._probes >= self._half_open_requests:
+                raise AlthermaCircuitOpenException('Circuit half open, waiting for probe requests')
+            self._probes += 1
+
+    def release(self):
+        """
+        Return an admitted request whose outcome says nothing about the adapter, e.g. a cancelled one.
+        """
+        if self._state == CircuitState.HalfOpen and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self):
+        self._failures = 0
+        self._set_state(CircuitState.Closed)
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == CircuitState.HalfOpen or self._failures >= self._failure_threshold:
+            if self._state != CircuitState.Open:
+                logger.warning(f'Opening circuit after {self._failures} consecutive failures')
+            self._set_state(CircuitState.Open)
@@ -0,0 +1,238 @@
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PATS'
+VERSION = 1
+# magic, version, record size, capacity, records written
+HEADER = struct.Struct('<4sHHQQ')
+HEADER_SIZE = 32
+# timestamp, value
+RECORD = struct.Struct('<dd')
+
+# Containers of get_current_state stored by TimeSeriesStore.record_state
+DEFAULT_CLASSES = ('sensors', 'operations')
+
+
+class TimeSeries:
+    def __init__(self, path, capacity=100000):
+        """
+        Fixed-width (timestamp, value) records in a single memory mapped file. Once capacity records are
+        written the oldest ones are overwritten, so the file never grows beyond its initial size.
+        :param path: file, created if missing
+        :param capacity: records kept, ignored for existing files
+        """
+        self._path = path
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+        if not exists:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0).ljust(HEADER_SIZE, b'\0'))
+                f.truncate(HEADER_SIZE + capacity * RECORD.size)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, record_size, self._capacity, self._written = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f'{path} is not a time series file')
+        self._last = self._timestamp(len(self) - 1) if self._written > 0 else None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return min(self._written, self._capacity)
+
+    def _offset(self, index):
+        """
+        :param index: position from the oldest record kept
+        """
+        first = self._written - len(self)
+        return HEADER_SIZE + ((first + index) % self._capacity) * RECORD.size
+
+    def _timestamp(self, index):
+        return RECORD.unpack_from(self._map, self._offset(index))[0]
+
+    def append(self, timestamp, value):
+        """
+        Records older than the last one are dropped to keep the file ordered.
+        :return: True if the record was stored
+        """
+        if self._last is not None and timestamp < self._last:
+            logger.debug(f'Dropping out of order value {value} at {timestamp} for {self._path}')
+            return False
+        RECORD.pack_into(self._map, HEADER_SIZE + (self._written % self._capacity) * RECORD.size,
+                         timestamp, value)
+        self._written += 1
+        # The count is updated after the record so a crash never exposes a half written record
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, self._capacity, self._written)
+        self._last = timestamp
+        return True
+
+    def _bisect(self, timestamp):
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start=None, end=None) -> typing.List[tuple]:
+        """
+        :return: list of (timestamp, value) with start <= timestamp < end
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = len(self) if end is None else self._bisect(end)
+        return [RECORD.unpack_from(self._map, self._offset(i)) for i in range(first, last)]
+
+    def last(self) -> typing.Optional[tuple]:
+        return RECORD.unpack_from(self._map, self._offset(len(self) - 1)) if len(self) > 0 else None
+
+    def downsample(self, interval, start=None, end=None, aggregate='mean') -> typing.List[tuple]:
+        """
+        :param interval: bucket width in seconds
+        :param aggregate: mean, min, max or last
+        :return: list of (bucket start, aggregated value) for buckets with data
+        """
+        if aggregate not in ('mean', 'min', 'max', 'last'):
+            raise ValueError(f'Unknown aggregate {aggregate}')
+        result = []
+        bucket, values = None, []
+        for timestamp, value in self.range(start, end):
+            if math.isnan(value):
+                continue
+            current = timestamp - timestamp % interval
+            if current != bucket and len(values) > 0:
+                result.append((bucket, self._aggregate(values, aggregate)))
+                values = []
+            bucket = current
+            values.append(value)
+        if len(values) > 0:
+            result.append((bucket, self._aggregate(values, aggregate)))
+        return result
+
+    @staticmethod
+    def _aggregate(values, aggregate):
+        if aggregate == 'mean':
+            return math.fsum(values) / len(values)
+        if aggregate == 'min':
+            return min(values)
+        if aggregate == 'max':
+            return max(values)
+        return values[-1]
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _file_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+class TimeSeriesStore:
+    def __init__(self, directory, capacity=100000, classes=DEFAULT_CLASSES):
+        """
+        History of numeric unit values with one TimeSeries file per unit and resource.
+        Disk use is bounded by capacity * 16 bytes per resource.
+        :param directory: directory holding the files, created if missing
+        :param capacity: records kept per resource
+        :param classes: containers of get_current_state to record, e.g. sensors and operations
+        """
+        self._directory = directory
+        self._capacity = capacity
+        self._classes = tuple(classes)
+        self._series: typing.Dict[tuple, TimeSeries] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _path(self, unit_function, resource):
+        return os.path.join(self._directory, _file_name(unit_function), f'{_file_name(resource)}.ts')
+
+    def series(self, unit_function, resource, create=True) -> typing.Optional[TimeSeries]:
+        key = (unit_function, resource)
+        if key not in self._series:
+            path = self._path(unit_function, resource)
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._series[key] = TimeSeries(path, self._capacity)
+        return self._series[key]
+
+    def resources(self, unit_function):
+        directory = os.path.join(self._directory, _file_name(unit_function))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-3] for name in os.listdir(directory) if name.endswith('.ts'))
+
+    def append(self, unit_function, resource, value, timestamp=None):
+        """
+        Store a value, only numbers and booleans are kept.
+        :return: True if the value was stored
+        """
+        if isinstance(value, bool):
+            value = float(value)
+        if not isinstance(value, (int, float)):
+            return False
+        timestamp = timestamp if timestamp is not None else time.time()
+        return self.series(unit_function, resource).append(timestamp, float(value))
+
+    def record_state(self, state: dict, timestamp=None):
+        """
+        Store a snapshot as returned by AlthermaController.get_current_state.
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        for unit_function, unit_state in (state or {}).items():
+            for resource_class in self._classes:
+                for resource, value in ((unit_state or {}).get(resource_class) or {}).items():
+                    self.append(unit_function, resource, value, timestamp)
+
+    def attach(self, controller):
+        """
+        Record every snapshot taken by the controller.
+        """
+        controller.add_snapshot_listener(self.record_state)
+
+    def detach(self, controller):
+        controller.remove_snapshot_listener(self.record_state)
+
+    def range(self, unit_function, resource, start=None, end=None):
+        series = self.series(unit_function, resource, create=False)
+        return series.range(start, end) if series is not None else []
+
+    def downsample(self, unit_function, resource, interval, start=None, end=None, aggregate='mean'):
+        series = self.series(unit_function, resource, create=False)
+        return series.downsample(interval, start, end, aggregate) if series is not None else []
+
+    def flush(self):
+        for series in self._series.values():
+            series.flush()
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series = {}
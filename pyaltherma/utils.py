@@ -1,26 +1,115 @@
-import json
+import functools
 
+from pyaltherma import codec
 from pyaltherma.const import VALID_RESPONSE_CODES
 from pyaltherma.errors import PathException, AlthermaResponseException
 
 
+@functools.lru_cache(maxsize=256)
+def compile_path(json_path) -> tuple:
+    """
+    :return: location steps of json_path, cached since the same literal paths are queried for every response
+    """
+    return tuple(json_path.split('/'))
+
+
 def query_object(o, json_path, raise_exception=False, convert_to_none=True):
-    location_steps = json_path.split('/')
-    if isinstance(o, str):
-        o = json.loads(o)
+    location_steps = compile_path(json_path)
+    if isinstance(o, (str, bytes)):
+        o = codec.loads(o)
+    last = len(location_steps) - 1
     for idx, step in enumerate(location_steps):
         if step not in o:
             if raise_exception:
                 raise PathException(f'{json_path} step: {step} not found in object')
 
-            if idx == len(location_steps) - 1 and convert_to_none:
+            if idx == last and convert_to_none:
                 return None
         o = o.get(step, {})
 
     return o
 
 
+class PathQuery:
+    def __init__(self, paths: dict):
+        """
+        Extracts several fields from an object in one pass, the common prefix of the paths is walked only once.
+        :param paths: dict of field name to json path
+        """
+        self._paths = dict(paths)
+        steps = [compile_path(path) for path in self._paths.values()]
+        prefix = []
+        for step_group in zip(*steps):
+            if len(set(step_group)) != 1:
+                break
+            prefix.append(step_group[0])
+        # At least the last step of every path stays in the suffix
+        prefix = prefix[:min(len(s) for s in steps) - 1] if len(steps) > 0 else []
+        self._prefix = tuple(prefix)
+        self._suffixes = [(name, s[len(prefix):]) for name, s in zip(self._paths.keys(), steps)]
+
+    @property
+    def paths(self):
+        return dict(self._paths)
+
+    def __call__(self, o) -> dict:
+        """
+        :return: dict of field name to value, None for missing fields
+        """
+        if isinstance(o, (str, bytes)):
+            o = codec.loads(o)
+        for step in self._prefix:
+            o = o.get(step) if isinstance(o, dict) else None
+            if o is None:
+                return {name: None for name in self._paths}
+        result = {}
+        for name, suffix in self._suffixes:
+            value = o
+            for step in suffix:
+                value = value.get(step) if isinstance(value, dict) else None
+                if value is None:
+                    break
+            result[name] = value
+        return result
+
+
+@functools.lru_cache(maxsize=64)
+def _path_query(paths: tuple) -> PathQuery:
+    return PathQuery(dict(paths))
+
+
+def query_fields(o, paths: dict) -> dict:
+    """
+    query_object for several paths at once, see PathQuery.
+    :param paths: dict of field name to json path
+    """
+    return _path_query(tuple(paths.items()))(o)
+
+
 def assert_response(request, response):
     resp_code = query_object(response, 'm2m:rsp/rsc')
     if resp_code not in VALID_RESPONSE_CODES:
         raise AlthermaResponseException(f'Response code {resp_code} is invalid.')
+
+
+def _as_list(o):
+    if o is None:
+        return []
+    return o if isinstance(o, list) else [o]
+
+
+def latest_child_contents(container) -> dict:
+    """
+    Extract latest content instance value of every child container from a oneM2M container
+    retrieved with child resources (rcn=4).
+    :param container: m2m:cnt resource representation
+    :return: dict of child resource name to its latest content
+    """
+    contents = {}
+    for child in _as_list(container.get('m2m:cnt')):
+        instances = _as_list(child.get('m2m:cin'))
+        if 'rn' not in child or len(instances) == 0:
+            continue
+        latest = sorted(instances, key=lambda cin: cin.get('ct', ''))[-1]
+        contents[child['rn']] = latest.get('con')
+    return contents
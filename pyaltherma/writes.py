@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+
+from pyaltherma.const import VALID_RESPONSE_CODES
+from pyaltherma.utils import query_object
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingWrite:
+    def __init__(self, operation, value, validate):
+        self.operation = operation
+        self.value = value
+        self.validate = validate
+        self.futures = []
+        self.handle = None
+
+
+class WriteCoalescer:
+    def __init__(self, write_fn, window=0.3, known_value_fn=None, remember=30):
+        """
+        Collapses bursts of writes to the same operation into a single write of the last value.
+        A write is sent once no newer value arrived for window seconds, every caller of the burst gets the
+        response of that write.
+        :param write_fn: coroutine function (operation, value, validate) sending the write
+        :param window: debounce window in seconds
+        :param known_value_fn: optional function returning (found, value) of the current value of an operation,
+            writes of the current value are skipped
+        :param remember: seconds an acknowledged value is trusted to still be the current one
+        """
+        self._write_fn = write_fn
+        self._window = window
+        self._known_value_fn = known_value_fn
+        self._remember = remember
+        self._pending = {}
+        self._written = {}
+        self._tasks = set()
+        self._sent = 0
+        self._skipped = 0
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def sent(self):
+        return self._sent
+
+    @property
+    def skipped(self):
+        """
+        Number of submitted values that never reached the adapter
+        """
+        return self._skipped
+
+    @property
+    def pending(self):
+        return list(self._pending.keys())
+
+    def _known_value(self, operation):
+        # A fresh read is newer than the last write, the write invalidated what was read before it
+        if self._known_value_fn is not None:
+            found, value = self._known_value_fn(operation)
+            if found:
+                return True, value
+        if operation in self._written:
+            value, written_at = self._written[operation]
+            if time.monotonic() - written_at < self._remember:
+                return True, value
+            del self._written[operation]
+        return False, None
+
+    def submit(self, operation, value, validate=True) -> asyncio.Future:
+        """
+        :return: future resolved with the adapter response of the merged write, None if the write was skipped
+            because the operation already has the value
+        """
+        future = asyncio.get_event_loop().create_future()
+        pending = self._pending.get(operation)
+        if pending is None:
+            found, known = self._known_value(operation)
+            if found and known == value:
+                self._skipped += 1
+                future.set_result(None)
+                return future
+            pending = self._pending[operation] = _PendingWrite(operation, value, validate)
+        else:
+            self._skipped += 1
+            pending.handle.cancel()
+            pending.value = value
+            pending.validate = validate
+        pending.futures.append(future)
+        pending.handle = asyncio.get_event_loop().call_later(self._window, self._start, operation)
+        return future
+
+    def _start(self, operation):
+        task = asyncio.ensure_future(self._write(self._pending.pop(operation)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, pending: _PendingWrite):
+        try:
+            response = await self._write_fn(pending.operation, pending.value, pending.validate)
+        except Exception as e:
+            for future in pending.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._sent += 1
+        if query_object(response, 'm2m:rsp/rsc') in VALID_RESPONSE_CODES:
+            self._written[pending.operation] = (pending.value, time.monotonic())
+        else:
+            self._written.pop(pending.operation, None)
+        for future in pending.futures:
+            if not future.done():
+                future.set_result(response)
+
+    def forget(self, operation=None):
+        """
+        Drop the remembered value of an operation, e.g. after it was read or changed on the unit itself.
+        """
+        if operation is None:
+            self._written = {}
+        else:
+            self._written.pop(operation, None)
+
+    async def flush(self):
+        """
+        Send all pending writes now and wait until every write in progress is done.
+        """
+        for operation, pending in list(self._pending.items()):
+            pending.handle.cancel()
+            self._start(operation)
+        if len(self._tasks) > 0:
+            await asyncio.wait(list(self._tasks))
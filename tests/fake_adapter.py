@@ -0,0 +1,273 @@
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import WSMsgType, web
+
+from pyaltherma.const import OPERATION_CREATE, OPERATION_RETRIEVE, OPERATION_DELETE, OPERATION_NOTIFY, \
+    RESOURCE_TYPE_CONTENT_INSTANCE, RESOURCE_TYPE_SUBSCRIPTION, RESULT_CONTENT_ATTRIBUTES_AND_CHILD_RESOURCES
+
+CONSUMPTION_PROFILE = {
+    'unit': 'kWh',
+    'Heating': {
+        'D': {'contentCount': 24, 'resolution': 2},
+        'W': {'contentCount': 14, 'resolution': 1},
+        'M': {'contentCount': 24, 'resolution': 1}
+    }
+}
+
+ADAPTER_UNIT = {
+    'label': 'function/Adapter',
+    'name': 'Adapter',
+    'profile': {'SyncStatus': 'reboot'},
+    'values': {}
+}
+
+SPACE_HEATING_UNIT = {
+    'label': 'function/SpaceHeating',
+    'name': 'Climate control',
+    'profile': {
+        'SyncStatus': 'reboot',
+        'Sensor': ['IndoorTemperature', 'OutdoorTemperature', 'LeavingWaterTemperatureCurrent'],
+        'UnitStatus': ['ErrorState', 'InstallerState', 'WarningState', 'EmergencyState',
+                       'TargetTemperatureOverruledState'],
+        'Operation': {
+            'Power': ['on', 'standby'],
+            'OperationMode': ['heating', 'cooling', 'auto'],
+            'LeavingWaterTemperatureOffsetHeating': {
+                'heating': {'settable': True, 'maxValue': 10, 'minValue': -10, 'stepValue': 1}},
+            'LeavingWaterTemperatureOffsetCooling': {
+                'cooling': {'settable': True, 'maxValue': 10, 'minValue': -10, 'stepValue': 1}},
+        },
+        'Consumption': {'Electrical': CONSUMPTION_PROFILE}
+    },
+    'values': {
+        'Sensor': {'IndoorTemperature': 21.5, 'OutdoorTemperature': 4, 'LeavingWaterTemperatureCurrent': 35},
+        'UnitStatus': {'ErrorState': 0, 'InstallerState': 0, 'WarningState': 0, 'EmergencyState': 0,
+                       'TargetTemperatureOverruledState': 0},
+        'Operation': {'Power': 'on', 'OperationMode': 'heating', 'LeavingWaterTemperatureOffsetHeating': 0,
+                      'LeavingWaterTemperatureOffsetCooling': 0},
+        'Consumption': {'Electrical': {'Heating': {
+            'D': [None] * 12 + [0, 0, 1, 2, 1, 1, 0, 0, 1, 2, None, None],
+            'W': [5, 6, 7, 6, 5, 4, 6, 7, 8, 6, None, None, None, None],
+            'M': [150, 130, 110, 80, 40, 20, 10, 10, 30, 70, 110, 140, 160, 120, 100] + [None] * 9,
+        }}},
+    }
+}
+
+HOT_WATER_TANK_UNIT = {
+    'label': 'function/DomesticHotWaterTank',
+    'name': 'Hot water tank',
+    'profile': {
+        'SyncStatus': 'reboot',
+        'Sensor': ['TankTemperature'],
+        'UnitStatus': ['ErrorState', 'InstallerState', 'WarningState', 'EmergencyState', 'WeatherDependentState'],
+        'Operation': {
+            'Power': ['on', 'standby'],
+            'powerful': ['0', '1'],
+            'TargetTemperature': {'heating': {'settable': False, 'maxValue': 60, 'minValue': 30, 'stepValue': 1}},
+        },
+        'Consumption': {'Electrical': CONSUMPTION_PROFILE}
+    },
+    'values': {
+        'Sensor': {'TankTemperature': 47},
+        'UnitStatus': {'ErrorState': 0, 'InstallerState': 0, 'WarningState': 0, 'EmergencyState': 0,
+                       'WeatherDependentState': 0},
+        'Operation': {'Power': 'on', 'Powerful': 0, 'TargetTemperature': 48},
+        'Consumption': {'Electrical': {'Heating': {
+            'D': [None] * 12 + [1, 0, 0, 1, 0, 0, 0, 1, 1, 0, None, None],
+            'W': [2, 3, 2, 2, 3, 2, 3, 2, 3, 2, None, None, None, None],
+            'M': [60, 55, 50, 45, 40, 35, 35, 35, 40, 45, 50, 55, 60, 55, 52] + [None] * 9,
+        }}},
+    }
+}
+
+DEFAULT_UNITS = [ADAPTER_UNIT, SPACE_HEATING_UNIT, HOT_WATER_TANK_UNIT]
+
+DEVICE_INFO = {'dlb': '1234567', 'man': 'Daikin', 'mod': 'BRP069A62', 'dty': 'LAN adapter',
+               'fwv': '1.0', 'swv': '100.0.0'}
+
+UNIT_INFO = {
+    'Version/IndoorSettings': '1.0', 'Version/IndoorSoftware': '2.0', 'Version/OutdoorSoftware': '3.0',
+    'Version/RemoconSettings': '4.0', 'Version/RemoconSoftware': '5.0', 'ModelNumber': 'EHBH08'
+}
+
+
+class FakeAdapter:
+    def __init__(self, units=None, latency=0.0, jitter=0.0, error_rate=0.0, drop_rate=0.0, seed=None,
+                 bulk_read=True, device_info=None):
+        """
+        In-process stand-in for the LAN adapter websocket endpoint (/mca).
+        :param units: unit definitions (label, name, profile, values), DEFAULT_UNITS by default
+        :param latency: seconds before every response
+        :param jitter: additional random delay up to given seconds
+        :param error_rate: probability of answering with response code 5000
+        :param drop_rate: probability of never answering
+        :param seed: random seed for reproducible jitter and errors
+        :param bulk_read: answer container reads with child resources (rcn=4)
+        :param device_info: overrides of DEVICE_INFO fields
+        """
+        self._units = json.loads(json.dumps(units if units is not None else DEFAULT_UNITS))
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._bulk_read = bulk_read
+        self._device_info = dict(DEVICE_INFO, **(device_info or {}))
+        self._runner = None
+        self._sockets = []
+        self._subscriptions = {}
+        self.requests = []
+        self.host = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_get('/mca', self._ws_handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.host = f'{host}:{self._runner.addresses[0][1]}'
+        return self
+
+    async def stop(self):
+        for ws in list(self._sockets):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def disconnect_clients(self):
+        """
+        Drop every open websocket as an adapter reboot would, the server keeps accepting connections.
+        """
+        for ws in list(self._sockets):
+            await ws.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    def value(self, unit_id, query_type, prop):
+        return self._units[unit_id]['values'][query_type][prop]
+
+    def set_value(self, unit_id, query_type, prop, value):
+        """
+        Change a resource as if the heat pump did, subscribers are notified.
+        """
+        self._units[unit_id]['values'].setdefault(query_type, {})[prop] = value
+        path = f'[0]/MNAE/{unit_id}/{query_type}/{prop}'
+        for sub_path, (ws, originator) in list(self._subscriptions.items()):
+            if sub_path.rsplit('/', 1)[0] == path and not ws.closed:
+                asyncio.ensure_future(self._notify(ws, originator, sub_path, value))
+
+    async def _notify(self, ws, originator, sub_path, value):
+        await ws.send_str(json.dumps({'m2m:rqp': {
+            'op': OPERATION_NOTIFY, 'fr': '/[0]', 'to': originator, 'rqi': f'n{self._random.randint(0, 9999)}',
+            'pc': {'m2m:sgn': {'sur': f'/{sub_path}', 'nev': {'net': 3, 'rep': {'m2m:cin': {'con': value}}}}}}}))
+
+    async def _ws_handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._sockets.append(ws)
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                if 'm2m:rqp' in message:
+                    asyncio.ensure_future(self._respond(ws, message['m2m:rqp']))
+        finally:
+            self._sockets.remove(ws)
+        return ws
+
+    async def _respond(self, ws, rqp):
+        self.requests.append((time.monotonic(), rqp))
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter > 0 else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.drop_rate > 0 and self._random.random() < self.drop_rate:
+            return
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            rsc, pc = 5000, None
+        else:
+            rsc, pc = self._handle(ws, rqp)
+        response = {'rsc': rsc, 'rqi': rqp.get('rqi'), 'to': rqp.get('fr'), 'fr': '/[0]'}
+        if pc is not None:
+            response['pc'] = pc
+        if not ws.closed:
+            await ws.send_str(json.dumps({'m2m:rsp': response}))
+
+    def _handle(self, ws, rqp):
+        path = rqp.get('to', '').strip('/')
+        op = rqp.get('op')
+        if op == OPERATION_CREATE and rqp.get('ty') == RESOURCE_TYPE_SUBSCRIPTION:
+            sub_path = f"{path}/{rqp['pc']['m2m:sub']['rn']}"
+            self._subscriptions[sub_path] = (ws, rqp.get('fr'))
+            return 2001, {'m2m:sub': {'rn': rqp['pc']['m2m:sub']['rn']}}
+        if op == OPERATION_CREATE and rqp.get('ty') == RESOURCE_TYPE_CONTENT_INSTANCE:
+            return self._write(path, rqp['pc']['m2m:cin']['con'])
+        if op == OPERATION_DELETE:
+            return (2002, None) if self._subscriptions.pop(path, None) is not None else (4004, None)
+        if op != OPERATION_RETRIEVE:
+            return 4000, None
+        if rqp.get('rcn') == RESULT_CONTENT_ATTRIBUTES_AND_CHILD_RESOURCES:
+            return self._container(path)
+        return self._retrieve(path)
+
+    def _unit(self, steps):
+        if len(steps) < 3 or steps[:2] != ['[0]', 'MNAE'] or not steps[2].isdigit():
+            return None, None
+        unit_id = int(steps[2])
+        return unit_id, self._units[unit_id] if unit_id < len(self._units) else None
+
+    @staticmethod
+    def _cin(con):
+        return 2000, {'m2m:cin': {'con': con, 'cnf': 'text/plain:0'}}
+
+    def _retrieve(self, path):
+        if path == '[0]/MNCSE-node/deviceInfo':
+            return 2000, {'m2m:dvi': self._device_info}
+        if path == '[0]/MNCSE-node/firmware':
+            return 2000, {'m2m:fwr': {'vr': self._device_info['swv']}}
+        steps = path.split('/')
+        unit_id, unit = self._unit(steps)
+        if unit is None:
+            return 4004, None
+        if len(steps) == 3:
+            return 2000, {'m2m:cnt': {'rn': str(unit_id), 'lbl': unit['label']}}
+        if steps[-1] != 'la':
+            return 4004, None
+        resource = '/'.join(steps[3:-1])
+        if resource == 'UnitProfile':
+            return self._cin(json.dumps(unit['profile']))
+        if resource == 'UnitIdentifier/Name':
+            return self._cin(unit['name'])
+        if resource.startswith('UnitInfo/') and resource[len('UnitInfo/'):] in UNIT_INFO:
+            return self._cin(UNIT_INFO[resource[len('UnitInfo/'):]])
+        if resource == 'Consumption' and 'Consumption' in unit['values']:
+            return self._cin(json.dumps(unit['values']['Consumption']))
+        query_type, _, prop = resource.partition('/')
+        values = unit['values'].get(query_type, {})
+        if prop not in values:
+            return 4004, None
+        return self._cin(values[prop])
+
+    def _container(self, path):
+        steps = path.split('/')
+        _, unit = self._unit(steps)
+        if not self._bulk_read or unit is None or len(steps) != 4 or steps[3] not in unit['values']:
+            return 4000, None
+        children = [{'rn': prop, 'm2m:cin': [{'con': value}]} for prop, value in unit['values'][steps[3]].items()]
+        return 2000, {'m2m:cnt': {'rn': steps[3], 'm2m:cnt': children}}
+
+    def _write(self, path, value):
+        steps = path.split('/')
+        unit_id, unit = self._unit(steps)
+        if unit is None or len(steps) != 5 or steps[3] != 'Operation' or steps[4] not in unit['values']['Operation']:
+            return 4004, None
+        self.set_value(unit_id, 'Operation', steps[4], value)
+        return 2001, None
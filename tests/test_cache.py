@@ -0,0 +1,71 @@
+import asyncio
+from unittest import TestCase
+
+from pyaltherma.cache import ReadCache
+
+
+class Test_Read_Cache(TestCase):
+    def test_concurrent_reads_share_one_fetch(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 21.5
+
+        async def _test():
+            cache = ReadCache()
+            values = await asyncio.gather(*[cache.get('/Sensor/IndoorTemperature/la', 'Sensor', fetch)
+                                            for _ in range(5)])
+            cached = await cache.get('/Sensor/IndoorTemperature/la', 'Sensor', fetch)
+            return values, cached
+
+        values, cached = asyncio.run(_test())
+        assert values == [21.5] * 5
+        assert cached == 21.5
+        assert len(calls) == 1
+
+    def test_expired_and_invalidated_entries_are_refetched(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return len(calls)
+
+        async def _test():
+            cache = ReadCache(ttl={'Sensor': 0.01})
+            await cache.get('a', 'Sensor', fetch)
+            await asyncio.sleep(0.02)
+            await cache.get('a', 'Sensor', fetch)
+            await cache.get('b', 'UnitInfo', fetch)
+            cache.invalidate('b')
+            return await cache.get('b', 'UnitInfo', fetch)
+
+        assert asyncio.run(_test()) == 4
+
+    def test_lru_is_bounded(self):
+        async def fetch():
+            return 1
+
+        async def _test():
+            cache = ReadCache(max_entries=2)
+            for key in ['a', 'b', 'c']:
+                await cache.get(key, 'UnitInfo', fetch)
+            return cache
+
+        cache = asyncio.run(_test())
+        assert len(cache) == 2
+        assert cache.lookup('a') == (False, None)
+        assert cache.lookup('c') == (True, 1)
+
+    def test_failed_fetch_is_not_cached(self):
+        async def fetch():
+            raise asyncio.TimeoutError()
+
+        async def _test():
+            cache = ReadCache()
+            with self.assertRaises(asyncio.TimeoutError):
+                await cache.get('a', 'Sensor', fetch)
+            return cache
+
+        assert len(asyncio.run(_test())) == 0
@@ -0,0 +1,175 @@
+import asyncio
+import time
+import json
+from unittest import TestCase
+
+from aiohttp import ClientSession, WSMsgType, web
+from aiohttp.test_utils import TestServer
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.const import ConnectionState
+from pyaltherma.errors import AlthermaConnectionException
+from tests.fake_adapter import FakeAdapter
+
+
+async def _delayed_echo(ws, request):
+    rqp = request['m2m:rqp']
+    # Later requests are answered first to force out of order responses
+    await asyncio.sleep(0.05 if rqp['to'] == 'first' else 0.01)
+    await ws.send_str(json.dumps({'m2m:rsp': {'rsc': 2000, 'rqi': rqp['rqi'], 'to': rqp['to']}}))
+
+
+async def _ws_handler(request):
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    async for msg in ws:
+        if msg.type == WSMsgType.TEXT:
+            asyncio.ensure_future(_delayed_echo(ws, json.loads(msg.data)))
+    return ws
+
+
+def run_with_server(fn):
+    async def _run():
+        app = web.Application()
+        app.router.add_get('/mca', _ws_handler)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            async with ClientSession() as session:
+                return await fn(session, f'{server.host}:{server.port}')
+        finally:
+            await server.close()
+    return asyncio.run(_run())
+
+
+class Test_Pipelined_Connection(TestCase):
+    def test_responses_are_routed_by_rqi(self):
+        async def _test(session, host):
+            conn = DaikinWSConnection(session, host, timeout=5, pipelined=True)
+            responses = await asyncio.gather(
+                conn.request('first'), conn.request('second'), conn.request('third'))
+            await conn.close()
+            return responses
+
+        responses = run_with_server(_test)
+        assert [r['m2m:rsp']['to'] for r in responses] == ['first', 'second', 'third']
+
+    def test_serial_mode_still_works(self):
+        async def _test(session, host):
+            conn = DaikinWSConnection(session, host, timeout=5)
+            response = await conn.request('first')
+            await conn.close()
+            return response
+
+        assert run_with_server(_test)['m2m:rsp']['to'] == 'first'
+
+
+class Test_Connection_Health(TestCase):
+    def _run(self, fn, **kwargs):
+        async def _run():
+            async with FakeAdapter(**kwargs) as adapter, ClientSession() as session:
+                return await fn(adapter, session)
+        return asyncio.run(_run())
+
+    def test_auto_reconnect_after_drop(self):
+        async def _test(adapter, session):
+            states = []
+            conn = DaikinWSConnection(session, adapter.host, timeout=5, pipelined=True, auto_reconnect=True,
+                                      backoff_base=0.01)
+            conn.add_state_listener(states.append)
+            await conn.connect()
+            await adapter.disconnect_clients()
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if states[-1] == ConnectionState.Connected and len(states) > 2:
+                    break
+            response = await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+            await conn.close()
+            return states, response
+
+        states, response = self._run(_test)
+        assert states == [ConnectionState.Connecting, ConnectionState.Connected, ConnectionState.Reconnecting,
+                          ConnectionState.Connected, ConnectionState.Closed]
+        assert response['m2m:rsp']['rsc'] == 2000
+
+    def test_serial_request_fails_on_closed_socket(self):
+        async def _test(adapter, session):
+            conn = DaikinWSConnection(session, adapter.host, timeout=5)
+            await conn.connect()
+            await adapter.disconnect_clients()
+            with self.assertRaises(AlthermaConnectionException):
+                await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+            state = conn.state
+            await conn.close()
+            return state
+
+        assert self._run(_test) == ConnectionState.Disconnected
+
+    def test_retry_deadline_survives_drop(self):
+        async def _test(adapter, session):
+            conn = DaikinWSConnection(session, adapter.host, timeout=5, retry_deadline=2, backoff_base=0.01)
+            await conn.connect()
+            await adapter.disconnect_clients()
+            response = await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+            await conn.close()
+            return response
+
+        assert self._run(_test)['m2m:rsp']['rsc'] == 2000
+
+
+class Test_Fire_And_Forget(TestCase):
+    TEMPERATURE = '/[0]/MNAE/1/Sensor/IndoorTemperature/la'
+    POWER = '/[0]/MNAE/1/Operation/Power'
+
+    def _run(self, fn, **kwargs):
+        async def _run():
+            async with FakeAdapter(latency=0.05) as adapter, ClientSession() as session:
+                return await fn(adapter, session)
+        return asyncio.run(_run())
+
+    def test_late_response_does_not_reach_next_caller(self):
+        async def _test(adapter, session):
+            results = []
+            for pipelined in [False, True]:
+                conn = DaikinWSConnection(session, adapter.host, timeout=5, pipelined=pipelined)
+                sent = await conn.request(self.POWER, {'con': 'standby', 'cnf': 'text/plain:0'},
+                                          wait_for_response=False)
+                response = await conn.request(self.TEMPERATURE)
+                await conn.close()
+                results.append((sent, response['m2m:rsp']['pc']['m2m:cin']['con']))
+            return results
+
+        assert self._run(_test) == [(None, 21.5), (None, 21.5)]
+
+    def test_dropped_acknowledgement_does_not_stall_serial_requests(self):
+        async def _test():
+            async with FakeAdapter() as adapter, ClientSession() as session:
+                conn = DaikinWSConnection(session, adapter.host, timeout=3)
+                adapter.drop_rate = 1.0
+                await conn.request(self.POWER, {'con': 'standby', 'cnf': 'text/plain:0'}, wait_for_response=False)
+                # The adapter swallowed the request, the drain is waiting for its acknowledgement
+                await asyncio.sleep(0.05)
+                adapter.drop_rate = 0.0
+                started = time.monotonic()
+                response = await conn.request(self.TEMPERATURE)
+                elapsed = time.monotonic() - started
+                await conn.close()
+                return response['m2m:rsp']['pc']['m2m:cin']['con'], elapsed
+
+        value, elapsed = asyncio.run(_test())
+        assert value == 21.5
+        assert elapsed < 0.5
+
+    def test_nowait_future_resolves_with_acknowledgement(self):
+        async def _test(adapter, session):
+            results = []
+            for pipelined in [False, True]:
+                conn = DaikinWSConnection(session, adapter.host, timeout=5, pipelined=pipelined)
+                ack = await conn.request_nowait(self.POWER, {'con': 'standby', 'cnf': 'text/plain:0'})
+                done_after_send = ack.done()
+                response = await asyncio.wait_for(ack, 5)
+                await conn.close()
+                results.append((done_after_send, response['m2m:rsp']['rsc']))
+            return results
+
+        assert self._run(_test) == [(False, 2001), (False, 2001)]
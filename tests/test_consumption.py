@@ -0,0 +1,110 @@
+import asyncio
+import math
+from datetime import datetime
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.consumption import ConsumptionData, ConsumptionIngester, PART_PREVIOUS, PART_ALL
+from pyaltherma.controllers import AlthermaController
+from pyaltherma.profile import ConsumptionType
+from tests.fake_adapter import CONSUMPTION_PROFILE, FakeAdapter
+
+PAYLOAD = {'Electrical': {
+    'Heating': {
+        'D': [1, 2, 0, 0, 1, 1, 0, 0, 1, 2, 0, 0] + [0, 0, 1, 2, 1, 1] + [None] * 6,
+        'W': [5, 6, 7, 6, 5, 4, 6, 7, 8, 6, None, None, None, None],
+    },
+    'Cooling': {
+        'D': [0] * 12 + [1, 1, 0, 0, 0, 0] + [None] * 6,
+        'W': [0] * 14,
+    },
+}}
+
+
+class Test_ConsumptionData(TestCase):
+    def setUp(self):
+        profile = dict(CONSUMPTION_PROFILE, Cooling=CONSUMPTION_PROFILE['Heating'])
+        self.data = ConsumptionData.from_payload(PAYLOAD, {'Electrical': ConsumptionType('Electrical', profile)})
+
+    def test_series_are_numeric_arrays(self):
+        heating = self.data.get('Electrical', 'Heating', 'D')
+        assert len(heating) == 24 and heating.resolution == 2 and heating.unit == 'kWh'
+        assert math.isnan(heating.values[23])
+        assert heating.to_list() == PAYLOAD['Electrical']['Heating']['D']
+        assert heating.reported() == 18 and heating.reported(PART_PREVIOUS) == 12
+        assert (heating.total(PART_PREVIOUS), heating.total(), heating.total(PART_ALL)) == (8, 13, 13)
+        assert self.data.to_dict() == PAYLOAD
+
+    def test_totals_breakdown_and_deltas(self):
+        assert self.data.totals('D') == {('Electrical', 'Heating'): 5, ('Electrical', 'Cooling'): 2}
+        assert self.data.breakdown('Electrical', 'W', PART_PREVIOUS) == {'Heating': 39, 'Cooling': 0}
+        assert self.data.total('Electrical', 'D') == 7
+        # Today until now against yesterday until the same bucket
+        assert self.data.deltas('D') == {('Electrical', 'Heating'): 0, ('Electrical', 'Cooling'): 2}
+        assert self.data.deltas('W')[('Electrical', 'Heating')] == 21 - 18
+        assert self.data.actions('Electrical') == ['Cooling', 'Heating']
+
+    def test_controller_reads_consumption_data(self):
+        async def _test():
+            async with FakeAdapter() as adapter, ClientSession() as session:
+                conn = DaikinWSConnection(session, adapter.host, timeout=5)
+                controller = AlthermaController(conn)
+                await controller.discover_units()
+                data = await controller.hot_water_tank.read_consumption_data()
+                await conn.close()
+                return data
+
+        data = asyncio.run(_test())
+        assert data.totals('M') == {('Electrical', 'Heating'): 167}
+        assert data.get('Electrical', 'Heating', 'W').resolution == 1
+
+
+def _day(previous, current):
+    return ConsumptionData.from_payload({'Electrical': {'Heating': {'D': previous + current}}})
+
+
+class Test_ConsumptionIngester(TestCase):
+    def test_only_new_buckets_are_emitted_across_rollover(self):
+        ingester = ConsumptionIngester()
+        yesterday = [1] * 12
+
+        first = ingester.ingest(_day(yesterday, [2, 3, 1] + [None] * 9), datetime(2024, 3, 5, 5, 30))
+        # 12 buckets of yesterday and the two completed ones of today, 04:00-06:00 is still running
+        assert len(first) == 14
+        assert (first[0].start, first[0].end) == (datetime(2024, 3, 4, 0), datetime(2024, 3, 4, 2))
+        assert [(r.start.hour, r.value) for r in first[-2:]] == [(0, 2), (2, 3)]
+
+        second = ingester.ingest(_day(yesterday, [2, 3, 2] + [None] * 9), datetime(2024, 3, 5, 6, 10))
+        assert [(r.start, r.value) for r in second] == [(datetime(2024, 3, 5, 4), 2)]
+
+        today = [2, 3, 2, 1, 1, 2, 2, 1, 1, 2, 1, 1]
+        # The clock passed midnight but the adapter still reports the old day
+        late = ingester.ingest(_day(yesterday, today), datetime(2024, 3, 6, 0, 1))
+        assert [r.start for r in late] == [datetime(2024, 3, 5, 2 * i) for i in range(3, 12)]
+
+        rolled = ingester.ingest(_day(today, [1] + [None] * 11), datetime(2024, 3, 6, 2, 30))
+        assert [(r.start, r.value) for r in rolled] == [(datetime(2024, 3, 6, 0), 1)]
+        assert not any(key[3] < datetime(2024, 3, 5) for key in ingester.emitted)
+
+    def test_rollover_finalising_the_last_bucket(self):
+        ingester = ConsumptionIngester()
+        ingester.ingest(_day([1] * 12, [2] * 11 + [1]), datetime(2025, 12, 31, 23, 50))
+        # The 22:00 bucket is completed in the first read of the new day
+        rolled = ingester.ingest(_day([2] * 11 + [3], [0] + [None] * 11), datetime(2026, 1, 1, 0, 10))
+        assert [(r.start, r.value) for r in rolled] == [(datetime(2025, 12, 31, 22), 3)]
+        later = ingester.ingest(_day([2] * 11 + [3], [0, 1] + [None] * 10), datetime(2026, 1, 1, 2, 10))
+        assert [(r.start, r.value) for r in later] == [(datetime(2026, 1, 1, 0), 0)]
+
+    def test_corrections_and_months(self):
+        ingester = ConsumptionIngester()
+        months = [10] * 12 + [5, 7] + [None] * 10
+        data = ConsumptionData.from_payload({'Electrical': {'Heating': {'M': months}}})
+        records = ingester.ingest(data, datetime(2024, 2, 20))
+        assert [(r.start, r.end) for r in records[-2:]] == [(datetime(2023, 12, 1), datetime(2024, 1, 1)),
+                                                             (datetime(2024, 1, 1), datetime(2024, 2, 1))]
+        months[12] = 6
+        corrected = ingester.ingest(ConsumptionData.from_payload({'Electrical': {'Heating': {'M': months}}}),
+                                    datetime(2024, 2, 21))
+        assert [(r.start, r.value) for r in corrected] == [(datetime(2024, 1, 1), 6)]
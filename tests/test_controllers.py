@@ -0,0 +1,280 @@
+import asyncio
+import json
+from unittest import TestCase
+
+from pyaltherma.cache import ReadCache
+from pyaltherma.controllers import AlthermaUnitController, AlthermaController
+from pyaltherma.profile import AlthermaUnit
+
+PROFILE = {
+    'SyncStatus': 'reboot',
+    'Sensor': ['IndoorTemperature', 'OutdoorTemperature'],
+    'UnitStatus': ['ErrorState'],
+    'Operation': {'Power': ['on', 'standby']}
+}
+
+
+class FakeConnection:
+    def __init__(self, values, failing=(), containers=None, resources=None):
+        self.values = values
+        self.failing = set(failing)
+        self.containers = containers or {}
+        self.resources = resources or {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, dest, payload=None, wait_for_response=True, assert_response_fn=None, **kwargs):
+        self.requests.append(dest)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if dest in self.failing:
+            raise asyncio.TimeoutError()
+        if payload is not None:
+            return {'m2m:rsp': {'rsc': 2001}}
+        if dest in self.resources:
+            return {'m2m:rsp': {'rsc': 2000, 'pc': self.resources[dest]}}
+        if 'result_content' in kwargs:
+            if dest not in self.containers:
+                return {'m2m:rsp': {'rsc': 4000}}
+            return {'m2m:rsp': {'rsc': 2000, 'pc': {'m2m:cnt': self.containers[dest]}}}
+        if dest not in self.values:
+            return {'m2m:rsp': {'rsc': 4004}}
+        return {'m2m:rsp': {'rsc': 2000, 'pc': {'m2m:cin': {'con': self.values[dest]}}}}
+
+
+def unit_values(unit_id=1):
+    prefix = f'/[0]/MNAE/{unit_id}'
+    return {
+        f'{prefix}/Sensor/IndoorTemperature/la': 21.5,
+        f'{prefix}/Sensor/OutdoorTemperature/la': 4,
+        f'{prefix}/UnitStatus/ErrorState/la': 0,
+        f'{prefix}/Operation/Power/la': 'on',
+    }
+
+
+def adapter_values(labels, profile=PROFILE, firmware='1.0'):
+    """
+    Discovery responses of an adapter with one unit per label
+    """
+    values = {}
+    resources = {'/[0]/MNCSE-node/deviceInfo': {'m2m:dvi': {'swv': firmware}}}
+    for i, label in enumerate(labels):
+        values[f'[0]/MNAE/{i}/UnitProfile/la'] = json.dumps(profile)
+        values[f'/[0]/MNAE/{i}/UnitIdentifier/Name/la'] = f'unit {i}'
+        values.update(unit_values(i))
+        resources[f'[0]/MNAE/{i}'] = {'m2m:cnt': {'lbl': label}}
+    return values, resources
+
+
+class Test_Current_State(TestCase):
+    def test_reads_run_concurrently_and_respect_limit(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = AlthermaUnitController(
+                AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating', asyncio.Semaphore(2))
+            return await controller.get_current_state()
+
+        state = asyncio.run(_test())
+        assert state == {
+            'sensors': {'IndoorTemperature': 21.5, 'OutdoorTemperature': 4},
+            'operations': {'Power': 'on'},
+            'states': {'ErrorState': False},
+            'consumption': {}
+        }
+        assert conn.max_in_flight == 2
+
+    def test_partial_failure_is_reported_per_key(self):
+        conn = FakeConnection(unit_values(), failing=['/[0]/MNAE/1/Sensor/OutdoorTemperature/la'])
+
+        async def _test():
+            controller = AlthermaController(conn)
+            unit = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating')
+            controller.altherma_units['function/SpaceHeating'] = unit
+            return await controller.get_current_state()
+
+        state = asyncio.run(_test())
+        unit_state = state['function/SpaceHeating']
+        assert unit_state['sensors'] == {'IndoorTemperature': 21.5, 'OutdoorTemperature': None}
+        assert unit_state['operations'] == {'Power': 'on'}
+
+
+class Test_Bulk_Read(TestCase):
+    def test_container_is_read_in_one_request(self):
+        sensors = {'rn': 'Sensor', 'm2m:cnt': [
+            {'rn': 'IndoorTemperature', 'm2m:cin': [{'con': 20, 'ct': '20210101T000000'},
+                                                    {'con': 21.5, 'ct': '20210101T000100'}]},
+            {'rn': 'OutdoorTemperature', 'm2m:cin': {'con': 4}},
+        ]}
+        conn = FakeConnection(unit_values(), containers={'/[0]/MNAE/1/Sensor': sensors})
+
+        async def _test():
+            controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, bulk_read=True)
+            return await controller.read_sensors()
+
+        assert asyncio.run(_test()) == {'IndoorTemperature': 21.5, 'OutdoorTemperature': 4}
+        assert conn.requests == ['/[0]/MNAE/1/Sensor']
+
+    def test_falls_back_when_adapter_rejects_bulk_reads(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, bulk_read=True)
+            first = await controller.read_sensors()
+            second = await controller.read_sensors()
+            return first, second
+
+        first, second = asyncio.run(_test())
+        assert first == second == {'IndoorTemperature': 21.5, 'OutdoorTemperature': 4}
+        # Rejected once, afterwards only per resource reads are issued
+        assert conn.requests.count('/[0]/MNAE/1/Sensor') == 1
+        assert len(conn.requests) == 5
+
+    def test_failing_bulk_request_is_not_repeated_every_read(self):
+        conn = FakeConnection(unit_values(), failing=['/[0]/MNAE/1/Sensor'])
+
+        async def _test():
+            controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, bulk_read=True)
+            first = await controller.read_sensors()
+            second = await controller.read_sensors()
+            return first, second
+
+        first, second = asyncio.run(_test())
+        assert first == second == {'IndoorTemperature': 21.5, 'OutdoorTemperature': 4}
+        assert conn.requests.count('/[0]/MNAE/1/Sensor') == 1
+        assert len(conn.requests) == 5
+
+
+class Test_Cached_Reads(TestCase):
+    def test_write_invalidates_cached_operation(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, cache=ReadCache())
+            await controller.read_operation('Power')
+            await controller.read_operation('Power')
+            await controller.call_operation('Power', 'standby')
+            return await controller.read_operation('Power')
+
+        asyncio.run(_test())
+        assert conn.requests == ['/[0]/MNAE/1/Operation/Power/la', '/[0]/MNAE/1/Operation/Power',
+                                 '/[0]/MNAE/1/Operation/Power/la']
+
+
+class Test_Write_Coalescing(TestCase):
+    def test_burst_is_merged_into_last_value(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, write_debounce=0.05)
+            futures = [controller.queue_operation('Power', value) for value in ['standby', 'on', 'standby']]
+            responses = await asyncio.gather(*futures)
+            # Writing the acknowledged value again is skipped
+            repeated = await controller.call_operation('Power', 'standby')
+            return responses, repeated, controller.writes
+
+        responses, repeated, writes = asyncio.run(_test())
+        assert conn.requests == ['/[0]/MNAE/1/Operation/Power']
+        assert responses == [{'m2m:rsp': {'rsc': 2001}}] * 3
+        assert repeated is None
+        assert (writes.sent, writes.skipped) == (1, 3)
+
+    def test_cached_value_is_not_written(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, cache=ReadCache(),
+                                                write_debounce=0.01)
+            await controller.read_operation('Power')
+            unchanged = await controller.call_operation('Power', 'on')
+            changed = await controller.call_operation('Power', 'standby')
+            return unchanged, changed
+
+        unchanged, changed = asyncio.run(_test())
+        assert unchanged is None and changed == {'m2m:rsp': {'rsc': 2001}}
+        assert conn.requests == ['/[0]/MNAE/1/Operation/Power/la', '/[0]/MNAE/1/Operation/Power']
+
+    def test_fresh_read_overrides_remembered_write(self):
+        for cache in (ReadCache(), None):
+            values = unit_values()
+            conn = FakeConnection(values)
+
+            async def _test():
+                controller = AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, cache=cache,
+                                                    write_debounce=0.01)
+                await controller.call_operation('Power', 'standby')
+                # Changed back on the unit itself
+                values['/[0]/MNAE/1/Operation/Power/la'] = 'on'
+                read = await controller.read_operation('Power')
+                return read, await controller.call_operation('Power', 'standby')
+
+            read, written = asyncio.run(_test())
+            assert read == 'on'
+            assert written == {'m2m:rsp': {'rsc': 2001}}
+            assert conn.requests.count('/[0]/MNAE/1/Operation/Power') == 2
+
+
+class Test_Discovery(TestCase):
+    def test_parallel_discovery_matches_sequential(self):
+        labels = ['function/Adapter', 'function/SpaceHeating', 'function/DomesticHotWaterTank']
+        values, resources = adapter_values(labels)
+        # Unit 4 is behind a gap and must be ignored like sequential discovery does
+        values['[0]/MNAE/4/UnitProfile/la'] = json.dumps(PROFILE)
+
+        async def _discover(parallel):
+            conn = FakeConnection(values, resources=resources)
+            controller = AlthermaController(conn)
+            await controller.discover_units(parallel=parallel)
+            return controller, conn
+
+        sequential, _ = asyncio.run(_discover(False))
+        parallel, conn = asyncio.run(_discover(True))
+        assert parallel.profiles == sequential.profiles
+        assert list(parallel.altherma_units.keys()) == list(sequential.altherma_units.keys()) == labels
+        assert conn.max_in_flight > 1
+
+
+class Test_Watch(TestCase):
+    def test_only_changed_values_are_yielded(self):
+        values = unit_values()
+        conn = FakeConnection(values)
+
+        async def _test():
+            controller = AlthermaController(conn)
+            controller.altherma_units['function/SpaceHeating'] = AlthermaUnitController(
+                AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating')
+            watch = controller.watch(interval=0.01)
+            first = await watch.__anext__()
+            values['/[0]/MNAE/1/Sensor/OutdoorTemperature/la'] = 5
+            second = await watch.__anext__()
+            await watch.aclose()
+            return first, second
+
+        first, second = asyncio.run(_test())
+        assert len(first) == 4
+        assert [(c.key, c.previous, c.value) for c in second] == [('OutdoorTemperature', 4, 5)]
+
+    def test_concurrent_watchers_see_every_change(self):
+        values = unit_values()
+        conn = FakeConnection(values)
+
+        async def _test():
+            controller = AlthermaController(conn)
+            controller.altherma_units['function/SpaceHeating'] = AlthermaUnitController(
+                AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating')
+            mqtt, database = controller.watch(interval=0.01), controller.watch(interval=0.01)
+            first = await mqtt.__anext__()
+            late_first = await database.__anext__()
+            values['/[0]/MNAE/1/Sensor/OutdoorTemperature/la'] = 5
+            changes = await asyncio.gather(mqtt.__anext__(), database.__anext__())
+            await mqtt.aclose()
+            await database.aclose()
+            return first, late_first, changes, controller.last_state
+
+        first, late_first, changes, last_state = asyncio.run(_test())
+        assert len(first) == len(late_first) == 4
+        assert [[(c.key, c.value) for c in batch] for batch in changes] == [[('OutdoorTemperature', 5)]] * 2
+        assert last_state.get('function/SpaceHeating', 'sensors', 'OutdoorTemperature') == 5
@@ -0,0 +1,182 @@
+import asyncio
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+from pyaltherma.export import BatchExporter, FileSink, HttpSink, Point, Sink, StreamSink, flatten_state, \
+    FORMAT_CSV, OVERFLOW_AGGREGATE
+from tests.fake_adapter import FakeAdapter
+
+STATE = {'function/SpaceHeating': {
+    'sensors': {'IndoorTemperature': 21.5, 'OutdoorTemperature': None},
+    'operations': {'Power': 'on', 'LeavingWaterTemperatureOffsetHeating': 2},
+    'states': {'ErrorState': False},
+    'consumption': {'Electrical': {'Heating': {'D': [1, 2]}}},
+}}
+
+
+class FailingSink(Sink):
+    def __init__(self):
+        self.batches = []
+        self.fail = True
+
+    async def write(self, points):
+        if self.fail:
+            raise ConnectionError('sink down')
+        self.batches.append(points)
+
+
+class Test_Points(TestCase):
+    def test_flatten_and_line_protocol(self):
+        points = flatten_state(STATE, timestamp=1.5, host='10.0.0.1')
+        assert [p.to_line_protocol() for p in points] == [
+            'altherma,class=sensors,host=10.0.0.1,resource=IndoorTemperature,unit=function/SpaceHeating '
+            'value=21.5 1500000000',
+            'altherma,class=operations,host=10.0.0.1,resource=Power,unit=function/SpaceHeating '
+            'value="on" 1500000000',
+            'altherma,class=operations,host=10.0.0.1,resource=LeavingWaterTemperatureOffsetHeating,'
+            'unit=function/SpaceHeating value=2.0 1500000000',
+            'altherma,class=states,host=10.0.0.1,resource=ErrorState,unit=function/SpaceHeating '
+            'value=false 1500000000',
+        ]
+        assert Point('a b', {'t': 'x,y'}, {'v': 1.0}, 0).to_line_protocol() == 'a\\ b,t=x\\,y v=1.0 0'
+        # Integral readings keep the float type of the field
+        assert Point('m', {}, {'v': 21}, 0).to_line_protocol() == Point('m', {}, {'v': 21.0}, 0).to_line_protocol()
+
+
+class Test_BatchExporter(TestCase):
+    def test_batches_by_size_to_file(self):
+        async def _test(directory):
+            path = os.path.join(directory, 'export.csv')
+            exporter = BatchExporter(FileSink(path, FORMAT_CSV), batch_size=4, flush_interval=60)
+            async with exporter:
+                exporter.add_state(STATE, timestamp=1, host='h')
+                exporter.add_state(STATE, timestamp=2, host='h')
+                await asyncio.sleep(0.05)
+                stats = exporter.stats
+            with open(path) as f:
+                return stats, f.read().splitlines(), exporter.stats
+
+        with tempfile.TemporaryDirectory() as directory:
+            stats, lines, final = asyncio.run(_test(directory))
+        # A full batch is written right away, the rest when the exporter stops
+        assert (stats['batches'], stats['pending']) == (2, 0)
+        assert lines[0] == 'timestamp,measurement,host,unit,class,resource,field,value'
+        assert lines[1] == '1,altherma,h,function/SpaceHeating,sensors,IndoorTemperature,value,21.5'
+        assert len(lines) == 9 and final['exported'] == 8
+
+    def test_backpressure_aggregates_then_drops(self):
+        async def _test():
+            sink = FailingSink()
+            exporter = BatchExporter(sink, batch_size=100, max_pending=5, overflow=OVERFLOW_AGGREGATE)
+            for timestamp in range(3):
+                exporter.add_state(STATE, timestamp=timestamp)
+            assert exporter.pending == 4
+            assert not await exporter.flush()
+            exporter.add([Point('other', {'resource': str(i)}, {'value': i}, 10) for i in range(3)])
+            stats = exporter.stats
+            sink.fail = False
+            await exporter.flush()
+            return stats, sink.batches
+
+        stats, batches = asyncio.run(_test())
+        assert (stats['aggregated'], stats['dropped'], stats['failures']) == (8, 2, 1)
+        assert [p.timestamp for p in batches[0]] == [2, 2, 10, 10, 10]
+
+    def test_rejected_batches_do_not_block_the_pipeline(self):
+        statuses = [400, 204, 503, 204]
+        received = []
+
+        async def _write(request):
+            received.append(await request.text())
+            return web.Response(status=statuses.pop(0))
+
+        async def _test():
+            app = web.Application()
+            app.router.add_post('/write', _write)
+            server = TestServer(app)
+            await server.start_server()
+            try:
+                async with ClientSession() as session:
+                    exporter = BatchExporter(HttpSink(session, f'http://{server.host}:{server.port}/write'),
+                                             batch_size=1)
+                    exporter.add([Point('m', {}, {'v': i}, i) for i in range(2)])
+                    rejected = await exporter.flush()
+                    exporter.add([Point('m', {}, {'v': 2}, 2)])
+                    retried = await exporter.flush()
+                    await exporter.flush()
+                    return rejected, retried, exporter.stats
+            finally:
+                await server.close()
+
+        rejected, retried, stats = asyncio.run(_test())
+        assert not rejected and not retried
+        # The invalid batch is dropped, the failing one is sent again
+        assert (stats['rejected'], stats['exported'], stats['failures'], stats['pending']) == (1, 2, 2, 0)
+        assert [line.split(' ')[1] for line in received] == ['v=0.0', 'v=1.0', 'v=2.0', 'v=2.0']
+
+    def test_batch_is_discarded_after_max_retries(self):
+        async def _test():
+            sink = FailingSink()
+            exporter = BatchExporter(sink, batch_size=1, max_retries=2)
+            exporter.add([Point('m', {}, {'v': 1}, 1)])
+            results = [await exporter.flush() for _ in range(3)]
+            return results, exporter.stats
+
+        results, stats = asyncio.run(_test())
+        assert results == [False] * 3
+        assert (stats['failures'], stats['rejected'], stats['pending']) == (3, 1, 0)
+
+    def test_controller_changes_to_http(self):
+        received = []
+
+        async def _write(request):
+            received.append(await request.text())
+            return web.Response(status=204)
+
+        async def _test():
+            app = web.Application()
+            app.router.add_post('/write', _write)
+            server = TestServer(app)
+            await server.start_server()
+            try:
+                async with FakeAdapter() as adapter, ClientSession() as session:
+                    conn = DaikinWSConnection(session, adapter.host, timeout=5)
+                    controller = AlthermaController(conn)
+                    await controller.discover_units()
+                    exporter = BatchExporter(HttpSink(session, f'http://{server.host}:{server.port}/write'))
+                    exporter.attach(controller, host='heatpump', changes_only=True)
+                    await controller.get_current_state()
+                    adapter.set_value(1, 'Sensor', 'IndoorTemperature', 23.0)
+                    await controller.get_current_state()
+                    exporter.detach(controller)
+                    await exporter.stop()
+                    await conn.close()
+                    return exporter.stats
+            finally:
+                await server.close()
+
+        stats = asyncio.run(_test())
+        lines = received[0].splitlines()
+        assert stats['batches'] == 1 and len(lines) == stats['exported']
+        indoor = [line for line in lines if 'resource=IndoorTemperature,' in line]
+        assert [line.split(' ')[1] for line in indoor] == ['value=21.5', 'value=23.0']
+        assert all(',host=heatpump,' in line for line in lines)
+
+    def test_sink_without_write_cannot_be_created(self):
+        class IncompleteSink(Sink):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSink()
+
+    def test_stream_sink(self):
+        stream = io.StringIO()
+        asyncio.run(StreamSink(stream).write([Point('m', {}, {'v': True}, 2)]))
+        assert stream.getvalue() == 'm v=true 2000000000\n'
@@ -0,0 +1,55 @@
+import asyncio
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+from tests.fake_adapter import FakeAdapter
+
+
+def run_with_adapter(fn, **adapter_args):
+    async def _run():
+        async with FakeAdapter(**adapter_args) as adapter:
+            async with ClientSession() as session:
+                return await fn(adapter, session)
+    return asyncio.run(_run())
+
+
+class Test_Fake_Adapter(TestCase):
+    def test_discovery_and_state(self):
+        async def _test(adapter, session):
+            results = []
+            for pipelined in [False, True]:
+                conn = DaikinWSConnection(session, adapter.host, timeout=5, pipelined=pipelined)
+                controller = AlthermaController(conn)
+                await controller.discover_units()
+                results.append(await controller.get_current_state())
+                await conn.close()
+            return results
+
+        serial, pipelined = run_with_adapter(_test)
+        assert serial == pipelined
+        assert serial['function/SpaceHeating']['sensors']['IndoorTemperature'] == 21.5
+        assert serial['function/DomesticHotWaterTank']['operations']['powerful'] == 0
+        assert serial['function/DomesticHotWaterTank']['states']['ErrorState'] is False
+
+    def test_writes_and_websocket_notifications(self):
+        async def _test(adapter, session):
+            conn = DaikinWSConnection(session, adapter.host, timeout=5, pipelined=True)
+            controller = AlthermaController(conn)
+            await controller.discover_units()
+            await controller.subscribe()
+            notifications = controller.notifications()
+            pending = asyncio.ensure_future(notifications.__anext__())
+            await controller.climate_control.set_leaving_water_temperature_offset_heating(3)
+            notification = await asyncio.wait_for(pending, 5)
+            await notifications.aclose()
+            value = await controller.climate_control.leaving_water_temperature_offset_heating
+            await controller.unsubscribe()
+            await conn.close()
+            return notification, value
+
+        notification, value = run_with_adapter(_test)
+        assert (notification.resource, notification.value) == ('LeavingWaterTemperatureOffsetHeating', 3)
+        assert value == 3
@@ -0,0 +1,37 @@
+import asyncio
+from unittest import TestCase
+
+from pyaltherma.fleet import AlthermaFleet
+from tests.fake_adapter import FakeAdapter
+
+
+class Test_AlthermaFleet(TestCase):
+    def test_results_stream_in_completion_order(self):
+        async def _test():
+            async with FakeAdapter(latency=0.02) as slow, FakeAdapter() as fast:
+                async with AlthermaFleet([slow.host, fast.host, '127.0.0.1:1'], timeout=5) as fleet:
+                    discovered = [result async for result in fleet.discover()]
+                    snapshots = [result async for result in fleet.snapshots(deadline=5)]
+                    state = await fleet.get_current_state()
+                return slow.host, fast.host, discovered, snapshots, state
+
+        slow, fast, discovered, snapshots, state = asyncio.run(_test())
+        assert [result.host for result in discovered] == ['127.0.0.1:1', fast, slow]
+        assert not discovered[0].ok
+        assert discovered[1].value.climate_control is not None
+        assert [result.host for result in snapshots[1:]] == [fast, slow]
+        assert snapshots[1].value['function/SpaceHeating']['sensors']['IndoorTemperature'] == 21.5
+        assert state[slow]['function/SpaceHeating'] == state[fast]['function/SpaceHeating']
+        # Without discovered units there is nothing to read
+        assert state['127.0.0.1:1'] == {}
+
+    def test_deadline_gives_up_slow_host(self):
+        async def _test():
+            async with FakeAdapter(latency=0.5) as slow, FakeAdapter() as fast:
+                async with AlthermaFleet([slow.host, fast.host], timeout=5) as fleet:
+                    return [result async for result in fleet.discover(deadline=0.3)], fast.host
+
+        results, fast = asyncio.run(_test())
+        assert [result.ok for result in results] == [True, False]
+        assert results[0].host == fast
+        assert isinstance(results[1].error, asyncio.TimeoutError)
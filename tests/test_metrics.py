@@ -0,0 +1,55 @@
+import asyncio
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+from pyaltherma.metrics import Histogram, MetricsCollector
+from tests.fake_adapter import FakeAdapter
+
+
+class Test_Histogram(TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram(buckets=(1, 2))
+        for value in [0.5, 1, 1.5, 3]:
+            histogram.observe(value)
+        assert histogram.cumulative() == [(1, 2), (2, 3), (float('inf'), 4)]
+        assert histogram.quantile(0.5) == 1
+        assert histogram.mean == 1.5
+
+
+class Test_Metrics_Collector(TestCase):
+    def collect(self, pipelined):
+        metrics = MetricsCollector()
+
+        async def _test():
+            async with FakeAdapter(latency=0.01) as adapter:
+                async with ClientSession() as session:
+                    conn = DaikinWSConnection(session, adapter.host, timeout=0.2, pipelined=pipelined,
+                                              observer=metrics)
+                    controller = AlthermaController(conn)
+                    await controller.discover_units()
+                    await controller.get_current_state()
+                    adapter.drop_rate = 1
+                    with self.assertRaises(asyncio.TimeoutError):
+                        await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+                    await conn.close()
+
+        asyncio.run(_test())
+        return metrics
+
+    def test_requests_and_timeouts_are_recorded(self):
+        for pipelined in [False, True]:
+            metrics = self.collect(pipelined)
+            latency = metrics.latency('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+            assert latency.count == 1
+            assert latency.mean >= 0.01
+            assert metrics.timeouts == 1
+            assert metrics.response_codes[2000] > 10
+            assert metrics.to_dict()['connects'] == 1
+            text = metrics.to_prometheus()
+            assert 'pyaltherma_request_latency_seconds_bucket{destination="[0]/MNAE/1/Sensor/IndoorTemperature",' \
+                   'operation="retrieve",le="+Inf"} 1' in text
+            assert 'pyaltherma_timeouts_total{destination="[0]/MNAE/1/Sensor/IndoorTemperature",' \
+                   'operation="retrieve"} 1' in text
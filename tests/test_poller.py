@@ -0,0 +1,133 @@
+import asyncio
+from unittest import TestCase
+
+from pyaltherma.controllers import AlthermaController, AlthermaUnitController
+from pyaltherma.errors import AlthermaException
+from pyaltherma.poller import AlthermaPoller, AdaptiveInterval
+from pyaltherma.profile import AlthermaUnit
+from tests.test_controllers import FakeConnection, PROFILE, unit_values
+
+
+def controller_with_unit(conn):
+    controller = AlthermaController(conn)
+    controller.altherma_units['function/SpaceHeating'] = AlthermaUnitController(
+        AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating')
+    return controller
+
+
+class Test_Poller(TestCase):
+    def test_polls_fill_the_store(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            poller = AlthermaPoller(controller_with_unit(conn),
+                                    intervals={'sensors': 0.05, 'operations': 0.05, 'states': None})
+            await poller.start()
+            await asyncio.sleep(0.2)
+            await poller.stop()
+            return poller
+
+        poller = asyncio.run(_test())
+        assert poller.get('function/SpaceHeating', 'sensors', 'IndoorTemperature') == 21.5
+        assert poller.store.snapshot() == {'function/SpaceHeating': {
+            'sensors': {'IndoorTemperature': 21.5, 'OutdoorTemperature': 4},
+            'operations': {'Power': 'on'}
+        }}
+        assert conn.requests.count('/[0]/MNAE/1/Sensor/IndoorTemperature/la') > 1
+        assert '/[0]/MNAE/1/UnitStatus/ErrorState/la' not in conn.requests
+
+    def test_writes_jump_ahead_of_polls(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = controller_with_unit(conn)
+            unit = controller.altherma_units['function/SpaceHeating']
+            poller = AlthermaPoller(controller, intervals={key: None for key in
+                                                           ['sensors', 'operations', 'states', 'consumption']})
+            await poller.start()
+            polls = [asyncio.ensure_future(poller.poll(unit, 'states')) for _ in range(3)]
+            write = asyncio.ensure_future(poller.call_operation('function/SpaceHeating', 'Power', 'standby'))
+            await asyncio.gather(*polls, write)
+            await poller.stop()
+
+        asyncio.run(_test())
+        write_index = conn.requests.index('/[0]/MNAE/1/Operation/Power')
+        assert write_index < len(conn.requests) - 1
+
+    def test_failed_read_keeps_last_known_value(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = controller_with_unit(conn)
+            unit = controller.altherma_units['function/SpaceHeating']
+            poller = AlthermaPoller(controller, intervals={key: None for key in
+                                                           ['sensors', 'operations', 'states', 'consumption']})
+            await poller.start()
+            await poller.poll(unit, 'sensors')
+            conn.failing.add('/[0]/MNAE/1/Sensor/OutdoorTemperature/la')
+            conn.values['/[0]/MNAE/1/Sensor/IndoorTemperature/la'] = 22
+            await poller.poll(unit, 'sensors')
+            await poller.stop()
+            return poller
+
+        poller = asyncio.run(_test())
+        assert poller.get('function/SpaceHeating', 'sensors', 'IndoorTemperature') == 22
+        assert poller.get('function/SpaceHeating', 'sensors', 'OutdoorTemperature') == 4
+
+    def test_stop_fails_queued_requests(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            controller = controller_with_unit(conn)
+            unit = controller.altherma_units['function/SpaceHeating']
+            poller = AlthermaPoller(controller, intervals={key: None for key in
+                                                           ['sensors', 'operations', 'states', 'consumption']})
+            await poller.start()
+            pending = [asyncio.ensure_future(poller.poll(unit, 'sensors')) for _ in range(3)]
+            pending.append(asyncio.ensure_future(poller.call_operation('function/SpaceHeating', 'Power', 'on')))
+            await asyncio.sleep(0.005)
+            await poller.stop()
+            results = await asyncio.wait_for(asyncio.gather(*pending, return_exceptions=True), 1)
+            with self.assertRaises(AlthermaException):
+                await poller.poll(unit, 'sensors')
+            return results
+
+        results = asyncio.run(_test())
+        assert len(results) == 4
+        assert all(isinstance(result, AlthermaException) for result in results)
+
+
+class Test_Adaptive_Interval(TestCase):
+    def test_interval_follows_rate_of_change(self):
+        tracker = AdaptiveInterval(5, 60, threshold=0.01)
+        tracker.observe(40.0, now=0)
+        for t in range(1, 10):
+            tracker.observe(40.0, now=t * 100)
+        assert tracker.interval == 60
+        tracker.observe(45.0, now=1000)
+        tracker.observe(50.0, now=1030)
+        assert tracker.interval == 15
+        tracker.boost(120, now=1030)
+        assert tracker.interval == 5
+        tracker.observe(50.0, now=1100)
+        assert tracker.interval == 5
+        tracker.observe(50.0, now=1200)
+        assert tracker.interval == 7.5
+
+    def test_write_boosts_unit_sensors(self):
+        conn = FakeConnection(unit_values())
+
+        async def _test():
+            poller = AlthermaPoller(controller_with_unit(conn), intervals={'operations': None, 'states': None},
+                                    adaptive_bounds=(0.01, 10), change_threshold=1000)
+            await poller.start()
+            await asyncio.sleep(0.3)
+            slowed = poller.interval('function/SpaceHeating', 'IndoorTemperature')
+            await poller.call_operation('function/SpaceHeating', 'Power', 'standby')
+            boosted = poller.interval('function/SpaceHeating', 'IndoorTemperature')
+            await poller.stop()
+            return slowed, boosted
+
+        slowed, boosted = asyncio.run(_test())
+        assert slowed > 0.01
+        assert boosted == 0.01
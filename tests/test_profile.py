@@ -0,0 +1,47 @@
+import copy
+from unittest import TestCase
+
+from pyaltherma.profile import AlthermaUnit
+
+PROFILE = {
+    'Operation': {
+        'Power': ['on', 'standby'],
+        'powerful': ['0', '1'],
+        'TargetTemperature': {'heating': {'settable': False, 'maxValue': 60, 'minValue': 30, 'stepValue': 1}},
+        'LeavingWaterTemperatureOffsetHeating': {'settable': True, 'maxValue': 10, 'minValue': -10, 'stepValue': 1},
+        'LeavingWaterTemperatureCooling': {'settable': False, 'maxValue': 22, 'minValue': 5, 'stepValue': 1},
+    }
+}
+
+
+class Test_Operation_Validators(TestCase):
+    def test_allowed_values_and_ranges(self):
+        unit = AlthermaUnit(1, copy.deepcopy(PROFILE))
+        unit.parse()
+        power, powerful = unit.operation_validator('Power'), unit.operation_validator('powerful')
+        assert power.is_valid('on') and not power.is_valid('off')
+        assert powerful.is_valid(1) and not powerful.is_valid(2)
+
+        offset = unit.operation_validator('LeavingWaterTemperatureOffsetHeating')
+        assert offset.is_valid(-10) and offset.is_valid(3)
+        assert not offset.is_valid(11) and not offset.is_valid(2.5)
+        # Heating setpoints are settable regardless of the profile flag
+        assert unit.operation_validator('TargetTemperature').is_valid(45)
+        assert not unit.operation_validator('LeavingWaterTemperatureCooling').is_valid(10)
+        assert unit.operation_validator('Unknown') is None
+        assert unit.operation_config == PROFILE['Operation']
+
+    def test_validators_are_rebuilt_only_on_change(self):
+        unit = AlthermaUnit(1, copy.deepcopy(PROFILE))
+        unit.parse()
+        validators = unit.operation_validators
+        unit.parse(copy.deepcopy(PROFILE))
+        assert unit.operation_validators is validators
+
+        changed = copy.deepcopy(PROFILE)
+        changed['Operation']['Power'] = ['on', 'standby', 'eco']
+        unit.parse(changed)
+        assert unit.operation_validators is not validators
+        assert unit.operation_validator('Power').is_valid('eco')
+        with self.assertRaises(TypeError):
+            unit.operation_validators['Power'] = None
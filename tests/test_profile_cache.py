@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from pyaltherma.controllers import AlthermaController
+from pyaltherma.profile_cache import ProfileCache
+from tests.test_controllers import FakeConnection, adapter_values
+
+LABELS = ['function/Adapter', 'function/SpaceHeating']
+
+
+class CachedConnection(FakeConnection):
+    host = '192.168.1.10'
+
+
+class Test_Profile_Cache(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache = ProfileCache(os.path.join(self._dir.name, 'profiles.json'))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_cached_profiles_skip_discovery(self):
+        values, resources = adapter_values(LABELS)
+
+        async def _test():
+            await AlthermaController(CachedConnection(values, resources=resources)).discover_units(
+                profile_cache=self.cache)
+            conn = CachedConnection(values, resources=resources)
+            controller = AlthermaController(conn)
+            await controller.discover_units(profile_cache=self.cache)
+            requests_before_revalidation = list(conn.requests)
+            changed = await controller.profile_revalidation
+            return controller, requests_before_revalidation, changed
+
+        controller, requests, changed = asyncio.run(_test())
+        assert requests == []
+        assert changed is False
+        assert list(controller.altherma_units.keys()) == LABELS
+        assert controller.climate_control is not None
+        assert [p['unit_name'] for p in controller.profiles] == ['unit 0', 'unit 1']
+
+    def test_changed_profile_triggers_discovery(self):
+        values, resources = adapter_values(LABELS)
+
+        async def _test():
+            await AlthermaController(CachedConnection(values, resources=resources)).discover_units(
+                profile_cache=self.cache)
+            values['[0]/MNAE/1/UnitProfile/la'] = json.dumps({'Sensor': ['IndoorTemperature']})
+            controller = AlthermaController(CachedConnection(values, resources=resources))
+            await controller.discover_units(profile_cache=self.cache)
+            return controller, await controller.profile_revalidation
+
+        controller, changed = asyncio.run(_test())
+        assert changed is True
+        assert controller.climate_control.sensors == ['IndoorTemperature']
+        assert self.cache.load('192.168.1.10')['profiles'][1]['profile'] == {'Sensor': ['IndoorTemperature']}
+
+    def test_failed_rediscovery_keeps_cached_units(self):
+        values, resources = adapter_values(LABELS)
+        seen_during_discovery = []
+        controller = None
+
+        class WatchedConnection(CachedConnection):
+            async def request(self, dest, payload=None, **kwargs):
+                if dest == '[0]/MNAE/1':
+                    seen_during_discovery.append(list(controller.altherma_units.keys()))
+                return await super().request(dest, payload, **kwargs)
+
+        async def _test():
+            nonlocal controller
+            await AlthermaController(CachedConnection(values, resources=resources)).discover_units(
+                profile_cache=self.cache)
+            resources['/[0]/MNCSE-node/deviceInfo'] = {'m2m:dvi': {'swv': '2.0'}}
+            controller = AlthermaController(WatchedConnection(values, failing=['[0]/MNAE/1'], resources=resources))
+            await controller.discover_units(profile_cache=self.cache)
+            return await controller.profile_revalidation
+
+        changed = asyncio.run(_test())
+        assert changed is False
+        assert seen_during_discovery == [LABELS]
+        assert list(controller.altherma_units.keys()) == LABELS
+        assert controller.climate_control is not None
+        assert self.cache.load('192.168.1.10')['firmware'] == '1.0'
+
+    def test_failing_cache_write_does_not_fail_discovery(self):
+        values, resources = adapter_values(LABELS)
+        unwritable = ProfileCache(os.path.join(self._dir.name, 'missing', 'profiles.json'))
+
+        async def _test():
+            written = AlthermaController(CachedConnection(values, resources=resources))
+            await written.discover_units(profile_cache=unwritable)
+            # Device info times out
+            no_info = AlthermaController(CachedConnection(values, resources=resources,
+                                                          failing=['/[0]/MNCSE-node/deviceInfo']))
+            await no_info.discover_units(profile_cache=self.cache)
+            return written, no_info
+
+        written, no_info = asyncio.run(_test())
+        assert list(written.altherma_units.keys()) == list(no_info.altherma_units.keys()) == LABELS
+        assert self.cache.load('192.168.1.10') is None
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+from pyaltherma.errors import AlthermaConnectionException
+from pyaltherma.recording import ERROR_CONNECTION, ERROR_TIMEOUT, SessionRecorder, ReplaySession, load_recording, \
+    replay_traffic
+from tests.fake_adapter import FakeAdapter
+
+
+class Test_Record_Replay(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'session.jsonl')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def record_session(self):
+        async def _record():
+            async with FakeAdapter(latency=0.01) as adapter:
+                async with ClientSession() as session:
+                    recorder = SessionRecorder(self.path, adapter.host)
+                    conn = DaikinWSConnection(session, adapter.host, timeout=5, recorder=recorder)
+                    controller = AlthermaController(conn)
+                    await controller.discover_units()
+                    state = await controller.get_current_state()
+                    await conn.close()
+                    recorder.close()
+                    return state
+        return asyncio.run(_record())
+
+    def test_replay_answers_like_the_adapter(self):
+        recorded_state = self.record_session()
+        header, records = load_recording(self.path)
+        assert header['version'] == 1
+        assert all(record['d'] >= 0.01 for record in records)
+
+        async def _replay(pipelined):
+            conn = DaikinWSConnection(ReplaySession(self.path, speed=0), 'replay', timeout=5, pipelined=pipelined)
+            controller = AlthermaController(conn)
+            await controller.discover_units()
+            state = await controller.get_current_state()
+            await conn.close()
+            return state
+
+        assert asyncio.run(_replay(False)) == recorded_state
+        assert asyncio.run(_replay(True)) == recorded_state
+
+    def test_replay_traffic_against_adapter(self):
+        self.record_session()
+
+        async def _replay():
+            async with FakeAdapter() as adapter:
+                async with ClientSession() as session:
+                    conn = DaikinWSConnection(session, adapter.host, timeout=5, pipelined=True)
+                    results = await replay_traffic(conn, self.path, speed=10)
+                    await conn.close()
+                    return results, len(adapter.requests)
+
+        results, served = asyncio.run(_replay())
+        assert len(results) == served == len(load_recording(self.path)[1])
+
+    def test_failed_requests_are_recorded_and_replayed(self):
+        async def _record(pipelined):
+            async with FakeAdapter() as adapter:
+                async with ClientSession() as session:
+                    recorder = SessionRecorder(self.path, adapter.host)
+                    conn = DaikinWSConnection(session, adapter.host, timeout=0.1, recorder=recorder,
+                                              pipelined=pipelined)
+                    await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+                    adapter.drop_rate = 1.0
+                    with self.assertRaises(asyncio.TimeoutError):
+                        await conn.request('/[0]/MNAE/1/Sensor/OutdoorTemperature/la')
+                    adapter.drop_rate, adapter.latency = 0.0, 0.05
+                    dropped = asyncio.ensure_future(conn.request('/[0]/MNAE/1/Operation/Power/la'))
+                    await asyncio.sleep(0.02)
+                    await adapter.disconnect_clients()
+                    with self.assertRaises(AlthermaConnectionException):
+                        await dropped
+                    await conn.close()
+                    recorder.close()
+
+        async def _replay():
+            conn = DaikinWSConnection(ReplaySession(self.path, speed=0), 'replay', timeout=0.1)
+            results = []
+            for dest in ['/[0]/MNAE/1/Sensor/OutdoorTemperature/la', '/[0]/MNAE/1/Operation/Power/la']:
+                try:
+                    await conn.request(dest)
+                except Exception as e:
+                    results.append(type(e))
+            await conn.close()
+            return results
+
+        for pipelined in (False, True):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            asyncio.run(_record(pipelined))
+            _, records = load_recording(self.path)
+            assert [record.get('e') for record in records] == [None, ERROR_TIMEOUT, ERROR_CONNECTION]
+            assert records[1]['d'] >= 0.1 and 'r' not in records[1]
+            assert asyncio.run(_replay()) == [asyncio.TimeoutError, AlthermaConnectionException]
@@ -0,0 +1,133 @@
+import asyncio
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.cache import ReadCache
+from pyaltherma.controllers import AlthermaController, AlthermaUnitController
+from pyaltherma.profile import AlthermaUnit
+from pyaltherma.subscription import NotificationServer, SubscriptionManager
+from tests.test_controllers import FakeConnection, PROFILE, unit_values
+
+
+class SubscribingConnection(FakeConnection):
+    def __init__(self, values):
+        super().__init__(values)
+        self.handlers = []
+        self.payloads = []
+
+    async def request(self, dest, payload=None, **kwargs):
+        self.payloads.append(payload)
+        return await super().request(dest, payload, **kwargs)
+
+    def add_notification_handler(self, handler):
+        self.handlers.append(handler)
+
+    def remove_notification_handler(self, handler):
+        self.handlers.remove(handler)
+
+
+def ws_notification(sur, value):
+    return {'m2m:rqp': {'op': 5, 'rqi': 'abcde', 'pc': {'m2m:sgn': {
+        'sur': sur, 'nev': {'net': 3, 'rep': {'m2m:cin': {'con': value}}}}}}}
+
+
+class Test_Subscriptions(TestCase):
+    def test_websocket_notifications_reach_iterator_and_cache(self):
+        conn = SubscribingConnection(unit_values())
+
+        async def _test():
+            cache = ReadCache()
+            controller = AlthermaController(conn, cache=cache)
+            controller.altherma_units['function/SpaceHeating'] = AlthermaUnitController(
+                AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating', cache=cache)
+            manager = await controller.subscribe()
+            notifications = controller.notifications()
+            pending = asyncio.ensure_future(notifications.__anext__())
+            await asyncio.sleep(0)
+            for handler in conn.handlers:
+                handler({'m2m:rqp': {'op': 5, 'pc': {'m2m:sgn': {'vrq': True}}}})
+                handler(ws_notification('/[0]/MNAE/1/Sensor/IndoorTemperature/pyaltherma', 22.5))
+            notification = await asyncio.wait_for(pending, 1)
+            await notifications.aclose()
+            cached = cache.lookup('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+            return manager, notification, cached
+
+        manager, notification, cached = asyncio.run(_test())
+        assert len(manager.subscriptions) == 4
+        assert notification.unit_function == 'function/SpaceHeating'
+        assert (notification.query_type, notification.resource, notification.value) == \
+               ('Sensor', 'IndoorTemperature', 22.5)
+        assert cached == (True, 22.5)
+
+    def test_http_notification_server(self):
+        conn = SubscribingConnection(unit_values())
+        received = []
+
+        async def _test():
+            manager = SubscriptionManager(conn, notification_uri='http://127.0.0.1/notify')
+            manager.add_listener(received.append)
+            await manager.subscribe(AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating'))
+            server = NotificationServer(manager.handle, host='127.0.0.1')
+            await server.start()
+            try:
+                async with ClientSession() as session:
+                    body = ws_notification('[0]/MNAE/1/UnitStatus/ErrorState/pyaltherma', 1)['m2m:rqp']['pc']
+                    async with session.post(server.url, json=body) as resp:
+                        return resp.status, resp.headers['X-M2M-RSC']
+            finally:
+                await server.stop()
+
+        assert asyncio.run(_test()) == (200, '2000')
+        assert len(conn.handlers) == 0
+        assert [(n.query_type, n.resource, n.value) for n in received] == [('UnitStatus', 'ErrorState', True)]
+
+    def test_subscribe_wires_notification_server(self):
+        conn = SubscribingConnection(unit_values())
+
+        async def _test():
+            controller = AlthermaController(conn)
+            controller.altherma_units['function/SpaceHeating'] = AlthermaUnitController(
+                AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating')
+            server = NotificationServer(host='127.0.0.1')
+            await controller.subscribe(notification_server=server)
+            notifications = controller.notifications()
+            pending = asyncio.ensure_future(notifications.__anext__())
+            async with ClientSession() as session:
+                body = ws_notification('[0]/MNAE/1/Sensor/IndoorTemperature/pyaltherma', 23)['m2m:rqp']['pc']
+                async with session.post(server.url, json=body) as resp:
+                    status = resp.status
+            notification = await asyncio.wait_for(pending, 1)
+            await notifications.aclose()
+            subscribed_uri = conn.payloads[-1]['nu'][0]
+            url = server.url
+            await controller.unsubscribe()
+            return status, notification, subscribed_uri, url, server.started
+
+        status, notification, subscribed_uri, url, started = asyncio.run(_test())
+        assert status == 200
+        assert (notification.resource, notification.value) == ('IndoorTemperature', 23)
+        assert subscribed_uri == url and not url.endswith(':0/notify')
+        assert len(conn.handlers) == 0
+        assert not started
+
+    def test_wildcard_host_requires_advertised_host(self):
+        with self.assertRaises(ValueError):
+            NotificationServer(host='0.0.0.0')
+        server = NotificationServer(host='0.0.0.0', port=8080, advertised_host='192.168.1.5')
+        assert server.url == 'http://192.168.1.5:8080/notify'
+
+    def test_subscription_reference_matches_whole_segments(self):
+        conn = SubscribingConnection(unit_values())
+        received = []
+
+        async def _test():
+            manager = SubscriptionManager(conn)
+            manager.add_listener(received.append)
+            await manager.subscribe(AlthermaUnitController(AlthermaUnit(1, PROFILE), conn, 'function/SpaceHeating'))
+            for sur in ['', None, 'Temperature/pyaltherma', '/mn-cse/[0]/MNAE/1/Sensor/OutdoorTemperature/pyaltherma',
+                        'Sensor/IndoorTemperature/pyaltherma']:
+                manager.handle(ws_notification(sur, 1))
+
+        asyncio.run(_test())
+        assert [n.resource for n in received] == ['OutdoorTemperature', 'IndoorTemperature']
@@ -0,0 +1,79 @@
+import asyncio
+import concurrent.futures
+import threading
+from unittest import TestCase
+
+from pyaltherma.errors import AlthermaException
+from pyaltherma.sync import AlthermaSyncClient, SyncIterator, SyncProxy
+from tests.fake_adapter import FakeAdapter
+
+
+class _AdapterThread:
+    """
+    FakeAdapter served from its own loop thread, as a real adapter lives outside the client.
+    """
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.adapter = self.run(FakeAdapter(latency=0.005).start())
+        return self
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(10)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.run(self.adapter.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class Test_AlthermaSyncClient(TestCase):
+    def test_blocking_controller_surface(self):
+        with _AdapterThread() as server, AlthermaSyncClient(server.adapter.host, timeout=5) as client:
+            climate_control = client.climate_control
+            assert isinstance(climate_control, SyncProxy)
+            assert climate_control.indoor_temperature == 21.5
+            assert climate_control.is_turned_on
+            climate_control.set_leaving_water_temperature_offset_heating(3)
+            assert climate_control.leaving_water_temperature_offset_heating == 3
+            assert server.adapter.value(1, 'Operation', 'LeavingWaterTemperatureOffsetHeating') == 3
+            ack = climate_control.call_operation('LeavingWaterTemperatureOffsetHeating', 4,
+                                                 wait_for_response=False)
+            assert isinstance(ack, concurrent.futures.Future)
+            ack.result(5)
+            assert client.get_current_state()['function/SpaceHeating']['operations'][
+                'LeavingWaterTemperatureOffsetHeating'] == 4
+            with client.controller.watch(interval=0.01) as changes:
+                assert isinstance(changes, SyncIterator)
+                assert len(next(changes)) > 0
+        assert not client.running
+        with self.assertRaises(AlthermaException):
+            client.climate_control
+
+    def test_iterator_outlives_call_timeout(self):
+        with _AdapterThread() as server, AlthermaSyncClient(server.adapter.host, timeout=5,
+                                                            call_timeout=0.3) as client:
+            # Items are further apart than a blocking call may take
+            with client.controller.watch(interval=0.6) as changes:
+                assert len(next(changes)) > 0
+                server.loop.call_soon_threadsafe(server.adapter.set_value, 1, 'Sensor', 'OutdoorTemperature', 6)
+                assert [change.value for change in next(changes)] == [6]
+
+    def test_many_threads_share_one_connection(self):
+        with _AdapterThread() as server, AlthermaSyncClient(server.adapter.host, timeout=5) as client:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                temperatures = list(executor.map(lambda _: client.climate_control.indoor_temperature, range(32)))
+                states = list(executor.map(lambda _: client.get_current_state(), range(8)))
+            sockets = len(server.adapter._sockets)
+        assert temperatures == [21.5] * 32
+        assert all(state == states[0] for state in states)
+        assert sockets == 1
+
+    def test_unreachable_adapter_fails_start(self):
+        client = AlthermaSyncClient('127.0.0.1:1', timeout=1)
+        with self.assertRaises(Exception):
+            client.start()
+        assert not client.running
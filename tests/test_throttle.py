@@ -0,0 +1,94 @@
+import asyncio
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.const import CircuitState
+from pyaltherma.errors import AlthermaCircuitOpenException
+from pyaltherma.throttle import CircuitBreaker, TokenBucket
+from tests.fake_adapter import FakeAdapter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Test_TokenBucket(TestCase):
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+        clock.now = 0.5
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()
+        clock.now = 10
+        assert bucket.tokens == 3
+
+    def test_acquire_waits_for_token(self):
+        async def _test():
+            bucket = TokenBucket(rate=50, burst=1)
+            waited = [await bucket.acquire() for _ in range(3)]
+            return waited
+
+        waited = asyncio.run(_test())
+        assert waited[0] < 0.01
+        assert sum(waited) >= 0.03
+
+
+class Test_CircuitBreaker(TestCase):
+    def test_open_half_open_close(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10, clock=clock)
+        states = []
+        breaker.add_listener(states.append)
+        for _ in range(2):
+            breaker.before_request()
+            breaker.record_failure()
+        assert breaker.state == CircuitState.Open
+        with self.assertRaises(AlthermaCircuitOpenException):
+            breaker.before_request()
+
+        clock.now = 10
+        breaker.before_request()
+        # Only one probe at a time while half open
+        with self.assertRaises(AlthermaCircuitOpenException):
+            breaker.before_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.Open
+
+        clock.now = 20
+        breaker.before_request()
+        breaker.record_success()
+        assert breaker.state == CircuitState.Closed
+        assert states == [CircuitState.Open, CircuitState.HalfOpen, CircuitState.Open, CircuitState.HalfOpen,
+                          CircuitState.Closed]
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.Closed
+
+    def test_connection_fails_fast_on_adapter_errors(self):
+        async def _test():
+            async with FakeAdapter(error_rate=1.0) as adapter, ClientSession() as session:
+                breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+                conn = DaikinWSConnection(session, adapter.host, timeout=5, circuit_breaker=breaker,
+                                          rate_limiter=TokenBucket(rate=100, burst=5))
+                codes = [(await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la'))['m2m:rsp']['rsc']
+                         for _ in range(3)]
+                sent = len(adapter.requests)
+                with self.assertRaises(AlthermaCircuitOpenException):
+                    await conn.request('/[0]/MNAE/1/Sensor/IndoorTemperature/la')
+                await conn.close()
+                return codes, sent, len(adapter.requests)
+
+        codes, sent, total = asyncio.run(_test())
+        assert codes == [5000, 5000, 5000]
+        assert sent == total == 3
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+
+from aiohttp import ClientSession
+
+from pyaltherma.comm import DaikinWSConnection
+from pyaltherma.controllers import AlthermaController
+from pyaltherma.timeseries import TimeSeries, TimeSeriesStore
+from tests.fake_adapter import FakeAdapter
+
+
+class Test_TimeSeries(TestCase):
+    def test_ring_buffer_keeps_latest_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'indoor.ts')
+            series = TimeSeries(path, capacity=5)
+            for i in range(8):
+                assert series.append(100 + i, 20 + i)
+            assert not series.append(50, 0)
+            series.close()
+            size = os.path.getsize(path)
+
+            series = TimeSeries(path)
+            assert (len(series), series.capacity) == (5, 5)
+            assert series.range() == [(103 + i, 23 + i) for i in range(5)]
+            assert series.range(104, 106) == [(104, 24), (105, 25)]
+            assert series.last() == (107, 27)
+            series.append(108, 28)
+            series.close()
+            assert os.path.getsize(path) == size
+
+    def test_downsample(self):
+        with tempfile.TemporaryDirectory() as directory:
+            series = TimeSeries(os.path.join(directory, 'outdoor.ts'), capacity=100)
+            for i in range(30):
+                series.append(i * 10, i)
+            assert series.downsample(100) == [(0, 4.5), (100, 14.5), (200, 24.5)]
+            assert series.downsample(100, start=150, aggregate='max') == [(100, 19), (200, 29)]
+            series.close()
+
+
+class Test_TimeSeriesStore(TestCase):
+    def test_snapshots_are_recorded_per_unit_and_resource(self):
+        async def _test(directory):
+            store = TimeSeriesStore(directory, capacity=10)
+            async with FakeAdapter() as adapter, ClientSession() as session:
+                conn = DaikinWSConnection(session, adapter.host, timeout=5)
+                controller = AlthermaController(conn)
+                await controller.discover_units()
+                store.attach(controller)
+                await controller.get_current_state()
+                adapter.set_value(1, 'Sensor', 'IndoorTemperature', 22.0)
+                await controller.get_current_state()
+                store.detach(controller)
+                await controller.get_current_state()
+                await conn.close()
+            indoor = [value for _, value in store.range('function/SpaceHeating', 'IndoorTemperature')]
+            resources = store.resources('function/SpaceHeating')
+            store.close()
+            return indoor, resources
+
+        with tempfile.TemporaryDirectory() as directory:
+            indoor, resources = asyncio.run(_test(directory))
+        assert indoor == [21.5, 22.0]
+        assert 'LeavingWaterTemperatureOffsetHeating' in resources
+        # Text operations such as Power are not stored
+        assert 'Power' not in resources
@@ -3,7 +3,8 @@ from unittest import TestCase
 import pytest
 
 from pyaltherma.const import VALID_RESPONSE_CODES
-from pyaltherma.utils import query_object, assert_response
+from pyaltherma import codec
+from pyaltherma.utils import query_object, assert_response, query_fields, PathQuery
 from pyaltherma.errors import PathException, AlthermaResponseException
 
 
@@ -67,4 +68,28 @@ class Test_Response_Error(TestCase):
             resp = {
                 'm2m:rsp': {'rsc': resp_code}
             }
-            assert_response(req, resp)
\ No newline at end of file
+            assert_response(req, resp)
+
+
+class Test_PathQuery(TestCase):
+    def test_fields_match_query_object(self):
+        o = {'m2m:rsp': {'rsc': 2000, 'pc': {'m2m:dvi': {'man': 'Daikin', 'swv': '1.2', 'dty': None}}}}
+        paths = {'code': 'm2m:rsp/rsc', 'manufacturer': 'm2m:rsp/pc/m2m:dvi/man',
+                 'firmware': 'm2m:rsp/pc/m2m:dvi/swv', 'duty': 'm2m:rsp/pc/m2m:dvi/dty',
+                 'serial_number': 'm2m:rsp/pc/m2m:dvi/dlb', 'missing': 'm2m:rsp/pc/m2m:cin/con'}
+        fields = query_fields(o, paths)
+        assert fields == {name: query_object(o, path) for name, path in paths.items()}
+        assert PathQuery(paths)({}) == {name: None for name in paths}
+
+    def test_codecs_round_trip(self):
+        message = {'m2m:rqp': {'op': 2, 'to': '/[0]/MNAE/1/Sensor/IndoorTemperature/la', 'rqi': 'abc12'}}
+        for name in ['json', 'orjson']:
+            if name == 'orjson' and codec.ORJSON_CODEC is None:
+                continue
+            previous = codec.get_codec()
+            codec.set_codec(name)
+            try:
+                assert codec.loads(codec.dumps(message)) == message
+                assert query_object(codec.dumps(message), 'm2m:rqp/rqi') == 'abc12'
+            finally:
+                codec.set_codec(previous)